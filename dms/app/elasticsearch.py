@@ -1,24 +1,109 @@
+import datetime
 import logging
-from typing import Optional, Union
+import time
+import uuid
+from typing import Iterator, Optional
 
 from elasticsearch import Elasticsearch
-from sqlalchemy.orm import Session
+from elasticsearch.exceptions import ElasticsearchException
+from elasticsearch.helpers import bulk, parallel_bulk
 
+from .exceptions.exceptions import ReindexJobNotFoundException
+from .postgres import postgres
+from .redis import redis_client
 from .settings.elasticsearch_settings import elasticsearch_settings
 from .tickers.models import TICKERS
-from .tickers.schemas import Ticker
 from .tickers.ticker_getter import ticker_getter
+from .tickers.ticker_setter import ticker_setter
 
 logger = logging.getLogger("uvicorn")
 
 SEARCH_FIELDS = {
     TICKERS: {
-        "ticker": 3,
+        "ticker": 5,
+        "ticker.prefix": 3,
         "name": 3,
+        "name.prefix": 2,
         "composite_figi": 1,
         "share_class_figi": 1,
     }
 }
+REINDEX_JOB = "reindex_job:{job_id}"
+REINDEX_TARGET = "reindex_target:{index}"
+REINDEX_LOCK = "reindex_lock:{index}"
+REINDEX_TOMBSTONES = "reindex_tombstones:{index}"
+REINDEX_JOB_TTL = 24 * 60 * 60
+REINDEX_LOCK_TTL = 60 * 60
+SUGGEST_FIELDS = ["id", "ticker", "name", "market", "type", "active"]
+
+# Edge n-grams are built at index time, so a prefix search is a plain term
+# lookup in the inverted index instead of a scan of every term.
+INDEX_SETTINGS = {
+    TICKERS: {
+        "settings": {
+            "analysis": {
+                "filter": {
+                    "prefix_filter": {
+                        "type": "edge_ngram",
+                        "min_gram": 1,
+                        "max_gram": 20,
+                    }
+                },
+                "analyzer": {
+                    "prefix": {
+                        "type": "custom",
+                        "tokenizer": "standard",
+                        "filter": ["lowercase", "prefix_filter"],
+                    },
+                    "prefix_search": {
+                        "type": "custom",
+                        "tokenizer": "standard",
+                        "filter": ["lowercase"],
+                    },
+                },
+                "normalizer": {
+                    "lowercase": {"type": "custom", "filter": ["lowercase"]}
+                },
+            }
+        },
+        "mappings": {
+            "dynamic": False,
+            "properties": {
+                "id": {"type": "integer"},
+                "ticker": {
+                    "type": "keyword",
+                    "normalizer": "lowercase",
+                    "fields": {
+                        "prefix": {
+                            "type": "text",
+                            "analyzer": "prefix",
+                            "search_analyzer": "prefix_search",
+                        }
+                    },
+                },
+                "name": {
+                    "type": "text",
+                    "fields": {
+                        "prefix": {
+                            "type": "text",
+                            "analyzer": "prefix",
+                            "search_analyzer": "prefix_search",
+                        }
+                    },
+                },
+                "market": {"type": "keyword"},
+                "locale": {"type": "keyword"},
+                "type": {"type": "keyword"},
+                "active": {"type": "boolean"},
+                "currency_name": {"type": "keyword"},
+                "composite_figi": {"type": "keyword", "normalizer": "lowercase"},
+                "share_class_figi": {"type": "keyword", "normalizer": "lowercase"},
+                "last_updated_utc": {"type": "keyword"},
+                "suggest": {"type": "completion", "analyzer": "simple"},
+            },
+        },
+    }
+}
 
 
 class ElasticsearchClient:
@@ -33,34 +118,365 @@ class ElasticsearchClient:
             ]
         )
 
-    def es_index(self, index: str, element: Union[Ticker]):
-        logger.info(f"indexing {index}")
-        self.es.index(index=index, id=element.id, body=element.to_dict())
+    def ensure_index(self, index: str):
+        """
+        Make `index` an alias of a versioned index with the explicit mapping.
+        A concrete index left under that name by an older release is kept
+        until the next reindex replaces it.
+        """
+        if self.es.indices.exists_alias(name=index):
+            return
+        if self.es.indices.exists(index=index):
+            logger.warning(
+                f"{index} is a dynamically mapped index, "
+                "reindex it to enable prefix search"
+            )
+            return
+        versioned_index = self.create_versioned_index(index=index)
+        self.es.indices.put_alias(index=versioned_index, name=index)
 
-    def es_search(self, query: str, index: str):
-        wildcard_queries = [
-            {"wildcard": {field: {"value": f"*{query}*", "boost": weight}}}
-            for field, weight in SEARCH_FIELDS[index].items()
+    def create_versioned_index(self, index: str) -> str:
+        versioned_index = (
+            f"{index}_{datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+        )
+        logger.info(f"creating {versioned_index}")
+        self.es.indices.create(index=versioned_index, body=INDEX_SETTINGS[index])
+        return versioned_index
+
+    def write_indices(self, index: str) -> list[str]:
+        """The alias, plus the index being rebuilt while a reindex runs."""
+        target = redis_client.get(REINDEX_TARGET.format(index=index))
+        return [index, target] if target else [index]
+
+    def record_tombstones(self, index: str, write_indices: list[str], ids: set[int]):
+        """Remember the deletes made while a reindex runs, see replay_tombstones."""
+        if len(write_indices) < 2:
+            return
+        for document_id in ids:
+            redis_client.add_to_set(
+                REINDEX_TOMBSTONES.format(index=index),
+                str(document_id),
+                ttl=REINDEX_LOCK_TTL,
+            )
+
+    def es_bulk_apply(
+        self, index: str, documents: list[dict], deleted_ids: set[int]
+    ) -> dict:
+        """
+        Index `documents` and delete `deleted_ids` in one bulk request.
+        Returns the error of every document that failed, by document id.
+        """
+        write_indices = self.write_indices(index)
+        self.record_tombstones(
+            index=index, write_indices=write_indices, ids=deleted_ids
+        )
+        actions = [
+            {
+                "_index": write_index,
+                "_id": document["id"],
+                "_source": es_document(index, document),
+            }
+            for write_index in write_indices
+            for document in documents
+        ] + [
+            {"_op_type": "delete", "_index": write_index, "_id": document_id}
+            for write_index in write_indices
+            for document_id in deleted_ids
         ]
+        if not actions:
+            return {}
+        _, errors = bulk(self.es, actions, raise_on_error=False)
+        failed = {}
+        for error in errors:
+            ((op_type, item),) = error.items()
+            if op_type == "delete" and item.get("status") == 404:
+                continue
+            failed[int(item["_id"])] = str(item.get("error", item.get("status")))
+        return failed
+
+    def drain_search_outbox(self, batch_size: Optional[int] = None) -> int:
+        """
+        Apply queued search events in batches until the outbox is empty or a
+        batch fails. Each document is read once per batch in its current state,
+        and indexed, or deleted if the row is gone. Failed events are retried
+        later with backoff. Returns the number of events applied.
+        """
+        batch_size = batch_size or elasticsearch_settings.SEARCH_OUTBOX_BATCH_SIZE
+        drained = 0
+        while True:
+            with postgres.sessionLocal() as db:
+                events = ticker_setter.claim_search_events(batch_size=batch_size, db=db)
+                if not events:
+                    return drained
+                failed = {}
+                for index in {event.index for event in events}:
+                    document_ids = {
+                        event.document_id for event in events if event.index == index
+                    }
+                    documents = ticker_getter.get_ticker_documents(
+                        ticker_ids=list(document_ids), db=db
+                    )
+                    try:
+                        failed.update(
+                            self.es_bulk_apply(
+                                index=index,
+                                documents=documents,
+                                deleted_ids=document_ids
+                                - {document["id"] for document in documents},
+                            )
+                        )
+                    except ElasticsearchException as e:
+                        failed.update(
+                            {document_id: str(e) for document_id in document_ids}
+                        )
+                applied = [
+                    event.id for event in events if event.document_id not in failed
+                ]
+                ticker_setter.complete_search_events(event_ids=applied, db=db)
+                ticker_setter.retry_search_events(
+                    events=[event for event in events if event.document_id in failed],
+                    errors=failed,
+                    db=db,
+                )
+                db.commit()
+            drained += len(applied)
+            if failed:
+                logger.warning(f"{len(failed)} search documents failed to index")
+                return drained
+            if len(events) < batch_size:
+                return drained
 
+    def es_search(self, query: str, index: str):
         search_body = {
-            "query": {"bool": {"should": wildcard_queries, "minimum_should_match": 1}}
+            "query": {
+                "multi_match": {
+                    "query": query,
+                    "fields": [
+                        f"{field}^{weight}"
+                        for field, weight in SEARCH_FIELDS[index].items()
+                    ],
+                    "type": "most_fields",
+                    "operator": "and",
+                }
+            },
+            "_source": {"excludes": ["suggest", "content_hash"]},
         }
         res = self.es.search(index=index, body=search_body)
         return [hit["_source"] for hit in res["hits"]["hits"]]
 
+    def es_suggest(self, prefix: str, index: str, size: int = 10) -> list[dict]:
+        """Type-ahead on the completion field, ranked by weight then score."""
+        search_body = {
+            "suggest": {
+                index: {
+                    "prefix": prefix,
+                    "completion": {
+                        "field": "suggest",
+                        "size": size,
+                        "skip_duplicates": True,
+                    },
+                }
+            },
+            "_source": SUGGEST_FIELDS,
+        }
+        res = self.es.search(index=index, body=search_body)
+        return [
+            {**option["_source"], "score": option["_score"]}
+            for option in res["suggest"][index][0]["options"]
+        ]
+
     def es_delete(self, index: str, id: int):
-        self.es.delete(index=index, id=id)
+        write_indices = self.write_indices(index)
+        self.record_tombstones(index=index, write_indices=write_indices, ids={id})
+        for write_index in write_indices:
+            self.es.delete(index=write_index, id=id, ignore=[404])
+
+    def start_reindex(self, index: str) -> str:
+        """Register a reindex job, refusing to start one while another runs."""
+        job_id = uuid.uuid4().hex
+        if not redis_client.acquire(
+            REINDEX_LOCK.format(index=index), job_id, REINDEX_LOCK_TTL
+        ):
+            raise ValueError(f"A reindex of {index} is already running.")
+        redis_client.set_hash(
+            REINDEX_JOB.format(job_id=job_id),
+            {"job_id": job_id, "index": index, "status": "pending"},
+            ttl=REINDEX_JOB_TTL,
+        )
+        return job_id
+
+    def get_reindex_job(self, job_id: str) -> dict:
+        job = redis_client.get_hash(REINDEX_JOB.format(job_id=job_id))
+        if not job:
+            raise ReindexJobNotFoundException(job_id=job_id)
+        return job
+
+    def reindex_all(self, index: str, job_id: str):
+        """
+        Rebuild `index` into a new versioned index and swap the alias to it in
+        one atomic call, so searches keep hitting the old index meanwhile.
+        Tickers are streamed from a server-side cursor into parallel bulk
+        requests; writes made during the rebuild go to both indices, and the
+        deletes among them are replayed before the swap.
+        """
+        job_key = REINDEX_JOB.format(job_id=job_id)
+        target_key = REINDEX_TARGET.format(index=index)
+        tombstones_key = REINDEX_TOMBSTONES.format(index=index)
+        started = time.monotonic()
+        versioned_index = None
+        try:
+            versioned_index = self.create_versioned_index(index=index)
+            self.es.indices.put_settings(
+                index=versioned_index, body={"index": {"refresh_interval": "-1"}}
+            )
+            redis_client.delete(tombstones_key)
+            redis_client.set(target_key, versioned_index, REINDEX_LOCK_TTL)
+            with postgres.sessionLocal() as db:
+                redis_client.set_hash(
+                    job_key,
+                    {
+                        "status": "running",
+                        "target": versioned_index,
+                        "total": ticker_getter.count_tickers(db=db),
+                        "indexed": 0,
+                        "failed": 0,
+                    },
+                    ttl=REINDEX_JOB_TTL,
+                )
+                indexed, failed = self.bulk_load(
+                    index=index,
+                    versioned_index=versioned_index,
+                    documents=ticker_getter.stream_ticker_documents(
+                        db=db,
+                        chunk_size=elasticsearch_settings.ELASTICSEARCH_BULK_CHUNK_SIZE,
+                    ),
+                    job_key=job_key,
+                )
+            self.replay_tombstones(index=index, versioned_index=versioned_index)
+            self.es.indices.put_settings(
+                index=versioned_index, body={"index": {"refresh_interval": None}}
+            )
+            self.es.indices.refresh(index=versioned_index)
+            self.swap_alias(index=index, versioned_index=versioned_index)
+            redis_client.set_hash(
+                job_key,
+                {
+                    "status": "completed",
+                    "indexed": indexed,
+                    "failed": failed,
+                    "seconds": round(time.monotonic() - started, 1),
+                },
+                ttl=REINDEX_JOB_TTL,
+            )
+            logger.info(f"reindexed {indexed} documents into {versioned_index}")
+        except Exception as e:
+            logger.error(f"reindex of {index} failed: {e}")
+            if versioned_index:
+                self.es.indices.delete(index=versioned_index, ignore=[404])
+            redis_client.set_hash(
+                job_key, {"status": "failed", "error": str(e)}, ttl=REINDEX_JOB_TTL
+            )
+        finally:
+            # Token checked, a job that outlived its lock must not release the
+            # lock or the target of the next one.
+            if versioned_index and redis_client.release_lease(
+                target_key, versioned_index
+            ):
+                redis_client.delete(tombstones_key)
+            redis_client.release_lease(REINDEX_LOCK.format(index=index), job_id)
+
+    def replay_tombstones(self, index: str, versioned_index: str) -> int:
+        """
+        Delete again from the rebuilt index the documents deleted while it was
+        loaded: the snapshot can reach a row after its delete went to both
+        indices, and create it again. Returns the documents deleted.
+        """
+        ids = {
+            int(document_id)
+            for document_id in redis_client.get_set_members(
+                REINDEX_TOMBSTONES.format(index=index)
+            )
+        }
+        if not ids:
+            return 0
+        with postgres.sessionLocal() as db:
+            existing = {
+                document["id"]
+                for document in ticker_getter.get_ticker_documents(
+                    ticker_ids=list(ids), db=db
+                )
+            }
+        deleted = ids - existing
+        bulk(
+            self.es,
+            [
+                {"_op_type": "delete", "_index": versioned_index, "_id": document_id}
+                for document_id in deleted
+            ],
+            raise_on_error=False,
+        )
+        return len(deleted)
+
+    def bulk_load(
+        self, index: str, versioned_index: str, documents: Iterator[dict], job_key: str
+    ) -> tuple[int, int]:
+        # op_type create keeps documents written by the live path during the
+        # rebuild, which are newer than the snapshot being streamed.
+        actions = (
+            {
+                "_op_type": "create",
+                "_index": versioned_index,
+                "_id": document["id"],
+                "_source": es_document(index, document),
+            }
+            for document in documents
+        )
+        chunk_size = elasticsearch_settings.ELASTICSEARCH_BULK_CHUNK_SIZE
+        indexed = failed = 0
+        for ok, item in parallel_bulk(
+            self.es,
+            actions,
+            thread_count=elasticsearch_settings.ELASTICSEARCH_BULK_THREADS,
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        ):
+            if ok or item["create"].get("status") == 409:
+                indexed += 1
+            else:
+                failed += 1
+            if (indexed + failed) % chunk_size == 0:
+                redis_client.set_hash(
+                    job_key, {"indexed": indexed, "failed": failed}, ttl=REINDEX_JOB_TTL
+                )
+        return indexed, failed
+
+    def swap_alias(self, index: str, versioned_index: str):
+        actions = [{"add": {"index": versioned_index, "alias": index}}]
+        previous_indices = []
+        if self.es.indices.exists_alias(name=index):
+            previous_indices = list(self.es.indices.get_alias(name=index))
+            actions += [
+                {"remove": {"index": previous_index, "alias": index}}
+                for previous_index in previous_indices
+            ]
+        elif self.es.indices.exists(index=index):
+            actions.append({"remove_index": {"index": index}})
+        self.es.indices.update_aliases(body={"actions": actions})
+        for previous_index in previous_indices:
+            self.es.indices.delete(index=previous_index, ignore=[404])
 
-    def reindex_all(self, index: str, db: Session):
-        items = []
-        if index == TICKERS:
-            items = ticker_getter.get_tickers(limit=-1, offset=0, db=db)
 
-        logger.info(f"indexing {index}")
-        for item in items:
-            self.es_index(index=index, element=item)
-        logger.info(f"finished indexing {index}")
+def es_document(index: str, document: dict) -> dict:
+    """Add the completion input of a document; active tickers rank first."""
+    if index != TICKERS:
+        return document
+    inputs = [document["ticker"]]
+    if document.get("name"):
+        inputs.append(document["name"])
+    return {
+        **document,
+        "suggest": {"input": inputs, "weight": 2 if document.get("active") else 1},
+    }
 
 
 es_client = ElasticsearchClient()
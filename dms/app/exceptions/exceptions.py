@@ -1,3 +1,4 @@
+import inspect
 from functools import wraps
 from typing import Optional
 
@@ -16,27 +17,60 @@ class TickerNotFoundException(Exception):
         super().__init__(self.message)
 
 
+class ReindexJobNotFoundException(Exception):
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.message = f"Reindex job {job_id} is not found"
+        super().__init__(self.message)
+
+
+class BackfillJobNotFoundException(Exception):
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.message = f"Backfill job {job_id} is not found"
+        super().__init__(self.message)
+
+
 def catch_errors(func):
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                raise to_http_exception(e)
+
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-        except ValueError as e:
-            raise HTTPException(status_code=422, detail=str(e))
-        except TickerNotFoundException as e:
-            print(f"Caught RoleNotFoundException: {e}")
-            raise HTTPException(status_code=404, detail=str(e))
-        except IntegrityError as e:
-            raise HTTPException(
-                status_code=422,
-                detail=f"Ticker creation failed: This ticker already exists. {str(e)}",
-            )
-        except SQLAlchemyError as e:
-            raise HTTPException(
-                status_code=422,
-                detail=f"Ticker creation failed: An error occurred while inserting the Ticker. {str(e)}",
-            )
         except Exception as e:
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+            raise to_http_exception(e)
 
     return wrapper
+
+
+def to_http_exception(e: Exception) -> HTTPException:
+    if isinstance(e, ValueError):
+        return HTTPException(status_code=422, detail=str(e))
+    if isinstance(e, TickerNotFoundException):
+        print(f"Caught RoleNotFoundException: {e}")
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, ReindexJobNotFoundException):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, BackfillJobNotFoundException):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, IntegrityError):
+        return HTTPException(
+            status_code=422,
+            detail=f"Ticker creation failed: This ticker already exists. {str(e)}",
+        )
+    if isinstance(e, SQLAlchemyError):
+        return HTTPException(
+            status_code=422,
+            detail=f"Ticker creation failed: An error occurred while inserting the Ticker. {str(e)}",
+        )
+    return HTTPException(status_code=500, detail="Internal Server Error")
@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, NamedTuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from .elasticsearch import es_client
+from .postgres import postgres
+from .redis import redis_client
+from .settings.elasticsearch_settings import elasticsearch_settings
+from .settings.polygon_settings import polygon_settings
+from .tickers.partitions import aggregation_partitions
+from .tickers.services.polygon_async_service import async_polygon_client
+from .tickers.services.polygon_service import STARTING_DATE, polygon_client
+
+logger = logging.getLogger("uvicorn")
+INGESTION_LEADER = "ingestion_leader"
+
+
+def ensure_aggregation_partitions():
+    with postgres.engine.begin() as conn:
+        aggregation_partitions.ensure_partitions(
+            conn, start=datetime.date.fromisoformat(STARTING_DATE)
+        )
+
+
+class LeaderLease:
+    """
+    A Redis lease held by at most one process: taken with SET NX PX and
+    renewed or released only by the token that took it. A leader that stops
+    renewing, because it crashed or lost Redis, is replaced once the lease
+    expires.
+    """
+
+    def __init__(self, key: str, ttl: float):
+        self.key = key
+        self.ttl_ms = int(ttl * 1000)
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.is_leader = False
+
+    def refresh(self) -> bool:
+        """Renew the lease when held, else try to take it. Returns is_leader."""
+        if self.is_leader:
+            self.is_leader = redis_client.renew_lease(self.key, self.token, self.ttl_ms)
+            if not self.is_leader:
+                logger.warning(f"Lost the {self.key} lease")
+        else:
+            self.is_leader = redis_client.acquire_lease(
+                self.key, self.token, self.ttl_ms
+            )
+            if self.is_leader:
+                logger.info(f"Took the {self.key} lease as {self.token}")
+        return self.is_leader
+
+    def release(self):
+        if self.is_leader:
+            redis_client.release_lease(self.key, self.token)
+            self.is_leader = False
+
+
+class Job(NamedTuple):
+    name: str
+    interval: float
+    run: Callable[[], Awaitable]
+    leader_only: bool = False
+    wait_first: bool = False
+
+
+class Ingestion:
+    """
+    The scheduled ingestion jobs, run by the API when RUN_INGESTION is set and
+    by `python -m app.worker`. Any number of processes can run them side by
+    side: the Polygon ticker sync and the partition maintenance only run in
+    the process holding the INGESTION_LEADER lease, while aggregation windows
+    are claimed per ticker from the Redis schedule and outbox events with
+    SKIP LOCKED, so that work is split between every process. Their Polygon
+    requests draw on one token bucket in Redis, POLYGON_RATE_LIMIT is the
+    budget of the API key whatever the number of processes.
+    """
+
+    def __init__(self):
+        self.lease = LeaderLease(
+            key=INGESTION_LEADER, ttl=polygon_settings.INGESTION_LEASE_TTL
+        )
+        self.tasks: list[asyncio.Task] = []
+
+    def jobs(self) -> list[Job]:
+        return [
+            Job(
+                name="tickers",
+                interval=60,
+                run=lambda: run_in_threadpool(polygon_client.get_tickers),
+                leader_only=True,
+            ),
+            Job(
+                name="aggregations",
+                interval=polygon_settings.POLYGON_INGESTION_INTERVAL,
+                run=async_polygon_client.get_aggregations,
+            ),
+            Job(
+                name="partitions",
+                interval=24 * 60 * 60,
+                run=lambda: run_in_threadpool(ensure_aggregation_partitions),
+                leader_only=True,
+                wait_first=True,
+            ),
+            Job(
+                name="search outbox",
+                interval=elasticsearch_settings.SEARCH_OUTBOX_INTERVAL,
+                run=lambda: run_in_threadpool(es_client.drain_search_outbox),
+            ),
+        ]
+
+    async def start(self):
+        await self.refresh_lease()
+        self.tasks = [asyncio.create_task(self.keep_lease())] + [
+            asyncio.create_task(self.repeat(job)) for job in self.jobs()
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await run_in_threadpool(self.lease.release)
+        await async_polygon_client.close()
+
+    async def refresh_lease(self):
+        was_leader = self.lease.is_leader
+        is_leader = await run_in_threadpool(self.lease.refresh)
+        if is_leader and not was_leader:
+            # The new leader repairs the schedule, as a single process did on startup.
+            await run_in_threadpool(polygon_client.initialize_schedule)
+
+    async def keep_lease(self):
+        while True:
+            await asyncio.sleep(polygon_settings.INGESTION_LEASE_TTL / 3)
+            try:
+                await self.refresh_lease()
+            except Exception:
+                logger.exception(f"Could not refresh the {INGESTION_LEADER} lease")
+
+    async def repeat(self, job: Job):
+        if job.wait_first:
+            await asyncio.sleep(job.interval)
+        while True:
+            if not job.leader_only or self.lease.is_leader:
+                try:
+                    await job.run()
+                except Exception:
+                    logger.exception(f"Ingestion job {job.name} failed")
+            await asyncio.sleep(job.interval)
+
+
+ingestion = Ingestion()
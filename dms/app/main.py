@@ -1,21 +1,33 @@
 import logging
 
+from elasticsearch.exceptions import ElasticsearchException
 from fastapi import FastAPI
-from fastapi_utilities import repeat_every
 
+from .elasticsearch import es_client
+from .ingestion import ensure_aggregation_partitions, ingestion
 from .postgres import postgres
 from .router import router
+from .settings.polygon_settings import polygon_settings
 from .tickers import models
-from .tickers.services.polygon_service import polygon_client
+from .tickers.broadcaster import bar_broadcaster
+from .tickers.services.polygon_async_service import async_polygon_client
 
 
 def create_application() -> FastAPI:
     application = FastAPI(openapi_url="/dms/openapi.json", docs_url="/dms/docs")
     application.include_router(router, prefix="/api/v1", tags=["dms"])
     models.postgres.base.metadata.create_all(bind=postgres.engine)
+    ensure_aggregation_partitions()
     return application
 
 
+def ensure_search_index():
+    try:
+        es_client.ensure_index(index=models.TICKERS)
+    except ElasticsearchException as e:
+        log.warning(f"Could not prepare the {models.TICKERS} index: {e}")
+
+
 app = create_application()
 log = logging.getLogger("uvicorn")
 
@@ -25,21 +37,15 @@ async def startup_event():
     log.info("Starting up...")
     url_list = [{"path": route.path, "name": route.name} for route in app.routes]
     log.info(url_list)
-    # polygon_client.get_aggregations()
+    ensure_search_index()
+    if polygon_settings.RUN_INGESTION:
+        await ingestion.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down...")
-
-
-@app.on_event("startup")
-@repeat_every(seconds=60)
-async def get_tickers_info_from_polygon():
-    polygon_client.get_tickers()
-
-
-@app.on_event("startup")
-@repeat_every(seconds=15)
-async def get_aggregations_from_polygon():
-    polygon_client.get_aggregations()
+    await ingestion.stop()
+    await async_polygon_client.close()
+    await bar_broadcaster.close()
+    await postgres.async_engine.dispose()
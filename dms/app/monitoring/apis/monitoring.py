@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ...postgres import postgres
+from ...tickers.ticker_getter import ticker_getter
+
+router = APIRouter(prefix="")
+
+
+@router.get("/pool")
+def get_pool_stats() -> dict:
+    return {
+        "sync": postgres.pool_monitor.report(),
+        "async": postgres.async_pool_monitor.report(),
+    }
+
+
+@router.get("/search-outbox")
+def get_search_outbox_lag(
+    db: Session = Depends(postgres.get_db),
+) -> dict:
+    return ticker_getter.get_search_outbox_lag(db=db)
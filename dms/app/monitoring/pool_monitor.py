@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+
+logger = logging.getLogger("uvicorn")
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MONITORING_DIR = os.path.dirname(os.path.abspath(__file__))
+WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0]
+
+
+class PoolMonitor:
+    """
+    Live statistics of one connection pool: how long callers wait for a
+    connection, how many are checked out, and which checkouts are held for
+    longer than `leak_threshold` seconds, which usually means a session that
+    was never closed.
+    """
+
+    def __init__(self, name: str, leak_threshold: float, track_stacks: bool = False):
+        self.name = name
+        self.leak_threshold = leak_threshold
+        self.track_stacks = track_stacks
+        self.engine: Optional[Engine] = None
+        self.lock = threading.Lock()
+        self.checkouts: dict[int, tuple[float, Optional[list[str]]]] = {}
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.total_checkouts = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+
+    def pool_class(self, base: type) -> type:
+        """Subclass `base` so every connect() is timed, across pool re-creations."""
+        monitor = self
+
+        class MonitoredPool(base):
+            def connect(self):
+                started = time.perf_counter()
+                try:
+                    return super().connect()
+                except TimeoutError:
+                    monitor.record_timeout()
+                    raise
+                finally:
+                    monitor.record_wait(time.perf_counter() - started)
+
+        MonitoredPool.__name__ = f"Monitored{base.__name__}"
+        return MonitoredPool
+
+    def attach(self, engine: Engine):
+        self.engine = engine
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+
+    def record_wait(self, seconds: float):
+        with self.lock:
+            self.wait_counts[bisect_left(WAIT_BUCKETS, seconds)] += 1
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        stack = checkout_stack() if self.track_stacks else None
+        with self.lock:
+            self.checkouts[id(connection_record)] = (time.monotonic(), stack)
+            self.total_checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, len(self.checkouts))
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            checkout = self.checkouts.pop(id(connection_record), None)
+        if checkout is None:
+            return
+        held = time.monotonic() - checkout[0]
+        if held > self.leak_threshold:
+            logger.warning(
+                f"{self.name} pool connection returned after {held:.1f}s"
+                + (f", checked out from {checkout[1]}" if checkout[1] else "")
+            )
+
+    def report(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            checkouts = list(self.checkouts.values())
+            wait_counts = list(self.wait_counts)
+            wait_count = sum(wait_counts)
+            report = {
+                "total_checkouts": self.total_checkouts,
+                "peak_checked_out": self.peak_checked_out,
+                "timeouts": self.timeouts,
+                "wait": {
+                    "count": wait_count,
+                    "mean_ms": (
+                        round(self.wait_sum / wait_count * 1000, 3)
+                        if wait_count
+                        else 0.0
+                    ),
+                    "max_ms": round(self.wait_max * 1000, 3),
+                    "histogram": {
+                        **{
+                            f"le_{bucket * 1000:g}ms": count
+                            for bucket, count in zip(WAIT_BUCKETS, wait_counts)
+                        },
+                        "le_inf": wait_counts[-1],
+                    },
+                },
+            }
+        if self.engine is not None:
+            pool = self.engine.pool
+            report.update(
+                {
+                    "pool_size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "checked_in": pool.checkedin(),
+                    "overflow": pool.overflow(),
+                }
+            )
+        report["leaks"] = sorted(
+            [
+                {"held_seconds": round(now - started, 1), "checked_out_from": stack}
+                for started, stack in checkouts
+                if now - started > self.leak_threshold
+            ],
+            key=lambda leak: -leak["held_seconds"],
+        )
+        return report
+
+
+def checkout_stack(limit: int = 3) -> list[str]:
+    """The innermost application frames that asked for the connection."""
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(APP_DIR)
+        and not frame.filename.startswith(MONITORING_DIR)
+    ]
+    return [
+        f"{frame.filename}:{frame.lineno} {frame.name}" for frame in frames[-limit:]
+    ]
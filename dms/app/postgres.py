@@ -1,28 +1,71 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
+from .monitoring.pool_monitor import PoolMonitor
 from .settings.postgres_settings import postgres_settings
 
 
 class Postgres:
     def __init__(self):
+        self.pool_monitor = PoolMonitor(
+            name="sync",
+            leak_threshold=postgres_settings.POSTGRES_LEAK_THRESHOLD,
+            track_stacks=postgres_settings.POSTGRES_TRACK_CHECKOUTS,
+        )
+        self.async_pool_monitor = PoolMonitor(
+            name="async",
+            leak_threshold=postgres_settings.POSTGRES_LEAK_THRESHOLD,
+            track_stacks=postgres_settings.POSTGRES_TRACK_CHECKOUTS,
+        )
         self.engine = create_engine(
             postgres_settings.DATABASE_URL,
+            poolclass=self.pool_monitor.pool_class(QueuePool),
             pool_size=10,
             max_overflow=20,
-            pool_timeout=30
+            pool_timeout=30,
         )
+        self.pool_monitor.attach(self.engine)
         self.sessionLocal = sessionmaker(
             autocommit=False, autoflush=False, bind=self.engine
         )
+        self.async_engine = create_async_engine(
+            async_database_url(),
+            poolclass=self.async_pool_monitor.pool_class(AsyncAdaptedQueuePool),
+            pool_size=postgres_settings.POSTGRES_ASYNC_POOL_SIZE,
+            max_overflow=postgres_settings.POSTGRES_ASYNC_MAX_OVERFLOW,
+            pool_timeout=30,
+        )
+        self.async_pool_monitor.attach(self.async_engine.sync_engine)
+        self.asyncSessionLocal = async_sessionmaker(
+            bind=self.async_engine, autoflush=False, expire_on_commit=False
+        )
         self.base = declarative_base()
 
     def get_db(self):
+        db = self.sessionLocal()
         try:
-            yield self.sessionLocal()
+            yield db
         finally:
-            self.sessionLocal().close()
+            db.close()
+
+    async def get_async_db(self):
+        async with self.asyncSessionLocal() as db:
+            yield db
+
+
+def async_database_url() -> str:
+    """Use ASYNC_DATABASE_URL, or the sync URL with its driver swapped for asyncpg."""
+    if postgres_settings.ASYNC_DATABASE_URL:
+        return postgres_settings.ASYNC_DATABASE_URL
+    return (
+        make_url(postgres_settings.DATABASE_URL)
+        .set(drivername="postgresql+asyncpg")
+        .render_as_string(hide_password=False)
+    )
 
 
 postgres = Postgres()
@@ -0,0 +1,32 @@
+import asyncio
+
+from fastapi.concurrency import run_in_threadpool
+
+from .redis import redis_client
+
+
+class TokenBucket:
+    """
+    Token bucket kept in Redis under `key`, shared by every coroutine of every
+    process that uses the same key, so N API workers and ingestion workers
+    together stay within one budget. `rate` tokens are refilled per second up
+    to `capacity`.
+    """
+
+    def __init__(self, key: str, rate: float, capacity: int):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self):
+        while True:
+            wait = await run_in_threadpool(
+                redis_client.take_token, self.key, self.rate, self.capacity
+            )
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds`, e.g. after a 429 Retry-After."""
+        await run_in_threadpool(redis_client.pause_tokens, self.key, seconds)
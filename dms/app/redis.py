@@ -1,10 +1,123 @@
+import datetime
 import json
+import time
 from typing import Optional
 
 import redis
 
 from .settings.redis_settings import redis_settings
 
+AGGREGATION_SCHEDULE = "aggregation_schedule"
+AGGREGATION_PROGRESS = "aggregation_progress"
+TICKER_INDEX_VERSION = "ticker_index_version"
+LATEST_BARS = "latest_bars"
+AGGREGATIONS_CHANNEL = "AGGREGATIONS"
+LATEST_BARS_BATCH_SIZE = 1000
+
+# Atomically pops up to ARGV[2] tickers due before ARGV[1] and pushes their
+# score to ARGV[3] so concurrent workers never claim the same ticker twice.
+CLAIM_DUE_TICKERS_SCRIPT = """
+local tickers = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local claimed = {}
+for _, ticker in ipairs(tickers) do
+    redis.call('ZADD', KEYS[1], ARGV[3], ticker)
+    table.insert(claimed, ticker)
+    table.insert(claimed, redis.call('HGET', KEYS[2], ticker) or '')
+end
+return claimed
+"""
+
+# Sets each (ticker id, timestamp, bar) of ARGV unless the stored bar of the
+# ticker is newer, so late or replayed batches never move it backwards while a
+# revised bar for the same timestamp replaces the stored one.
+SET_LATEST_BARS_SCRIPT = """
+local written = 0
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or cjson.decode(current).timestamp <= tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+        written = written + 1
+    end
+end
+return written
+"""
+
+# Moves the progress of ticker ARGV[1] to ARGV[4], and its schedule to ARGV[5],
+# when the range starting the day after ARGV[3] continues it without a gap. A
+# ticker without progress counts as computed up to ARGV[2]. Dates are ISO
+# strings, which compare in date order.
+ADVANCE_PROGRESS_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current or current == '' then
+    current = ARGV[2]
+end
+if current >= ARGV[3] and current < ARGV[4] then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('ZADD', KEYS[2], ARGV[5], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Lease scripts only touch the key while it still holds the caller's token, so
+# a process whose lease expired can never extend or drop its successor's.
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# Token bucket of KEYS[1] refilled at ARGV[1] tokens per second up to ARGV[2],
+# on the Redis clock so that every process shares one budget. Takes a token
+# and returns 0, or returns the seconds to wait before the next one. The
+# reply is a string, Redis truncates Lua numbers to integers.
+TAKE_TOKEN_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'paused_until')
+local paused_until = tonumber(bucket[3]) or 0
+if now < paused_until then
+    return tostring(paused_until - now)
+end
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+# Empties the bucket of KEYS[1] and hands out no token for ARGV[1] seconds.
+PAUSE_TOKENS_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local paused_until = math.max(
+    tonumber(redis.call('HGET', KEYS[1], 'paused_until')) or 0,
+    now + tonumber(ARGV[1])
+)
+redis.call(
+    'HSET', KEYS[1], 'tokens', '0', 'updated_at', tostring(paused_until),
+    'paused_until', tostring(paused_until)
+)
+redis.call('EXPIRE', KEYS[1], math.ceil(paused_until - now) + 60)
+return 1
+"""
+
 
 class RedisClient:
     def __init__(self, db: int = 0):
@@ -14,6 +127,12 @@ class RedisClient:
             db=db,
             decode_responses=True,
         )
+        self.binary_conn = redis.StrictRedis(
+            host=redis_settings.REDIS_HOST,
+            port=redis_settings.REDIS_PORT,
+            db=db,
+            decode_responses=False,
+        )
 
     def get(self, key: str) -> Optional[str]:
         value = self.redis_conn.get(key)
@@ -28,26 +147,247 @@ class RedisClient:
     def delete(self, key: str):
         return self.redis_conn.delete(key)
 
+    def incr(self, key: str) -> int:
+        return self.redis_conn.incr(key)
+
+    def acquire(self, key: str, value: str, ttl: int) -> bool:
+        """Set `key` only if it is free, as a lock expiring after `ttl` seconds."""
+        return bool(self.redis_conn.set(key, value, nx=True, ex=ttl))
+
+    def acquire_lease(self, key: str, token: str, ttl_ms: int) -> bool:
+        return bool(self.redis_conn.set(key, token, nx=True, px=ttl_ms))
+
+    def renew_lease(self, key: str, token: str, ttl_ms: int) -> bool:
+        return bool(self.redis_conn.eval(RENEW_LEASE_SCRIPT, 1, key, token, ttl_ms))
+
+    def release_lease(self, key: str, token: str) -> bool:
+        return bool(self.redis_conn.eval(RELEASE_LEASE_SCRIPT, 1, key, token))
+
+    def take_token(self, key: str, rate: float, capacity: int) -> float:
+        """Take a token of a shared bucket, else return the seconds to wait."""
+        return float(self.redis_conn.eval(TAKE_TOKEN_SCRIPT, 1, key, rate, capacity))
+
+    def pause_tokens(self, key: str, seconds: float):
+        self.redis_conn.eval(PAUSE_TOKENS_SCRIPT, 1, key, seconds)
+
+    def get_hash(self, key: str) -> dict:
+        return self.redis_conn.hgetall(key)
+
+    def set_hash(self, key: str, values: dict, ttl: Optional[int] = None):
+        pipeline = self.redis_conn.pipeline()
+        pipeline.hset(key, mapping=values)
+        if ttl:
+            pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def increment_hash(self, key: str, values: dict):
+        pipeline = self.redis_conn.pipeline()
+        for field, amount in values.items():
+            pipeline.hincrby(key, field, amount)
+        pipeline.execute()
+
+    def add_to_set(self, key: str, member: str, ttl: Optional[int] = None):
+        pipeline = self.redis_conn.pipeline()
+        pipeline.sadd(key, member)
+        if ttl:
+            pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def get_set_members(self, key: str) -> list[str]:
+        return list(self.redis_conn.smembers(key))
+
+    def get_many(self, keys: list[str]) -> list[Optional[str]]:
+        return self.redis_conn.mget(keys) if keys else []
+
+    def increment_many(self, keys: list[str], ttl: Optional[int] = None):
+        pipeline = self.redis_conn.pipeline()
+        for key in keys:
+            pipeline.incr(key)
+            if ttl:
+                pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def get_many_bytes(self, keys: list[str]) -> list[Optional[bytes]]:
+        return self.binary_conn.mget(keys) if keys else []
+
+    def set_many_bytes(self, values: dict, ttl: Optional[int] = None):
+        pipeline = self.binary_conn.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(key, value, ex=ttl)
+        pipeline.execute()
+
     def add_to_list(self, key: str, element: str):
         self.redis_conn.rpush(key, element)
 
     def get_list_elements(self, key: str, start: int = 0, end: int = -1):
         return self.redis_conn.lrange(key, start, end)
 
+    def pop_from_list(self, key: str) -> Optional[str]:
+        return self.redis_conn.lpop(key)
+
     def get_computed_aggregations(self, key: str = "computed_aggregations") -> dict:
         computed_aggregations = self.redis_conn.get(key)
-        return json.loads(computed_aggregations)
+        return json.loads(computed_aggregations) if computed_aggregations else {}
+
+    def set_ticker_progress(self, ticker: str, last_date: datetime.date):
+        """
+        Record the last computed date of a ticker and schedule its next fetch
+        for when that date falls behind yesterday.
+        """
+        pipeline = self.redis_conn.pipeline(transaction=True)
+        pipeline.hset(AGGREGATION_PROGRESS, ticker, f"{last_date}")
+        pipeline.zadd(AGGREGATION_SCHEDULE, {ticker: next_due_timestamp(last_date)})
+        pipeline.execute()
+
+    def advance_ticker_progress(
+        self,
+        ticker: str,
+        from_date: datetime.date,
+        last_date: datetime.date,
+        first_date: datetime.date,
+    ) -> bool:
+        """
+        set_ticker_progress to `last_date` when the range from `from_date`
+        leaves no gap after the current progress and ends past it. A ticker
+        without progress is fetched from `first_date`. Returns whether the
+        progress moved.
+        """
+        day = datetime.timedelta(days=1)
+        return bool(
+            self.redis_conn.eval(
+                ADVANCE_PROGRESS_SCRIPT,
+                2,
+                AGGREGATION_PROGRESS,
+                AGGREGATION_SCHEDULE,
+                ticker,
+                f"{first_date - day}",
+                f"{from_date - day}",
+                f"{last_date}",
+                next_due_timestamp(last_date),
+            )
+        )
+
+    def claim_due_tickers(
+        self, limit: int, lease_seconds: int = 300
+    ) -> list[tuple[str, datetime.date]]:
+        """
+        Claim up to `limit` tickers whose next fetch is due. Claimed tickers are
+        hidden from other workers for `lease_seconds` unless their progress is
+        recorded before.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        claimed = self.redis_conn.eval(
+            CLAIM_DUE_TICKERS_SCRIPT,
+            2,
+            AGGREGATION_SCHEDULE,
+            AGGREGATION_PROGRESS,
+            now,
+            limit,
+            now + lease_seconds,
+        )
+        return [
+            (
+                claimed[i],
+                datetime.date.fromisoformat(claimed[i + 1]) if claimed[i + 1] else None,
+            )
+            for i in range(0, len(claimed), 2)
+        ]
 
-    def set_computed_aggregations(
-        self, key: str = "computed_aggregations", computed_aggregations: dict = {}
-    ):
-        computed_aggregations_str = json.dumps(computed_aggregations)
-        self.redis_conn.set(key, computed_aggregations_str)
+    def schedule_new_tickers(
+        self, tickers: list[str], lease_seconds: int = 300
+    ) -> list[str]:
+        """
+        Add tickers without progress to the schedule as already claimed, so
+        they become due again if the claiming worker never records progress.
+        Returns the tickers that were not scheduled yet.
+        """
+        if not tickers:
+            return []
+        pipeline = self.redis_conn.pipeline(transaction=True)
+        for ticker in tickers:
+            pipeline.hsetnx(AGGREGATION_PROGRESS, ticker, "")
+            pipeline.zadd(
+                AGGREGATION_SCHEDULE, {ticker: time.time() + lease_seconds}, nx=True
+            )
+        added = pipeline.execute()[::2]
+        return [ticker for ticker, is_new in zip(tickers, added) if is_new]
+
+    def unschedule_ticker(self, ticker: str):
+        pipeline = self.redis_conn.pipeline(transaction=True)
+        pipeline.hdel(AGGREGATION_PROGRESS, ticker)
+        pipeline.zrem(AGGREGATION_SCHEDULE, ticker)
+        pipeline.execute()
+
+    def has_schedule(self) -> bool:
+        return self.redis_conn.zcard(AGGREGATION_SCHEDULE) > 0
+
+    def set_tickers_progress(self, progress: dict):
+        """Bulk version of set_ticker_progress, `None` dates are due right away."""
+        pipeline = self.redis_conn.pipeline(transaction=True)
+        for ticker, last_date in progress.items():
+            pipeline.hset(AGGREGATION_PROGRESS, ticker, f"{last_date or ''}")
+            pipeline.zadd(
+                AGGREGATION_SCHEDULE,
+                {ticker: next_due_timestamp(last_date) if last_date else 0},
+            )
+        pipeline.execute()
+
+    def migrate_computed_aggregations(self, key: str = "computed_aggregations"):
+        """Move the legacy computed_aggregations JSON blob into the schedule."""
+        computed_aggregations = self.get_computed_aggregations(key=key)
+        if not computed_aggregations:
+            return
+        self.set_tickers_progress(
+            {
+                ticker: datetime.date.fromisoformat(last_date)
+                for ticker, last_date in computed_aggregations.items()
+            }
+        )
+        self.delete(key)
+
+    def set_latest_bars(self, bars: list[dict]) -> int:
+        """Record the newest bar of each ticker, keyed by `ticker_id`."""
+        written = 0
+        for i in range(0, len(bars), LATEST_BARS_BATCH_SIZE):
+            arguments = []
+            for bar in bars[i : i + LATEST_BARS_BATCH_SIZE]:
+                arguments += [bar["ticker_id"], bar["timestamp"], json.dumps(bar)]
+            written += self.redis_conn.eval(
+                SET_LATEST_BARS_SCRIPT, 1, LATEST_BARS, *arguments
+            )
+        return written
+
+    def get_latest_bars(self, ticker_ids: list[int]) -> list[Optional[dict]]:
+        if not ticker_ids:
+            return []
+        bars = self.redis_conn.hmget(LATEST_BARS, ticker_ids)
+        return [json.loads(bar) if bar else None for bar in bars]
+
+    def get_all_latest_bars(self) -> dict[int, dict]:
+        return {
+            int(ticker_id): json.loads(bar)
+            for ticker_id, bar in self.redis_conn.hgetall(LATEST_BARS).items()
+        }
+
+    def has_latest_bars(self) -> bool:
+        return self.redis_conn.exists(LATEST_BARS) > 0
 
     def publish_message(self, data: dict, channel: str = "GENERATE_PREDICTION"):
         message = json.dumps(data)
         self.redis_conn.publish(channel, message)
-        return {"status": f"Message published to generate prediction for {data['ticker']}"}
+        return {
+            "status": f"Message published to generate prediction for {data['ticker']}"
+        }
+
+
+def next_due_timestamp(last_date: datetime.date) -> float:
+    # A ticker is due once its last computed date is older than yesterday.
+    due_date = last_date + datetime.timedelta(days=2)
+    return datetime.datetime.combine(
+        due_date, datetime.time.min, tzinfo=datetime.timezone.utc
+    ).timestamp()
 
 
 redis_client = RedisClient()
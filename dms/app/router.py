@@ -1,7 +1,9 @@
 from fastapi import APIRouter
 
+from .monitoring.apis.monitoring import router as monitoring_router
 from .tickers.apis.tickers import router as tickers_router
 
 router = APIRouter()
 
 router.include_router(tickers_router, prefix="/tickers", tags=["tickers"])
+router.include_router(monitoring_router, prefix="/monitoring", tags=["monitoring"])
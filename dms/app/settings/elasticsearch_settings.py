@@ -5,6 +5,12 @@ from pydantic_settings import BaseSettings
 class ElasticSearchSettings(BaseSettings):
     ELASTICSEARCH_HOST: str = Field(env="ELASTICSEARCH_HOST")
     ELASTICSEARCH_PORT: int = Field(env="ELASTICSEARCH_PORT")
+    ELASTICSEARCH_BULK_THREADS: int = Field(env="ELASTICSEARCH_BULK_THREADS", default=4)
+    ELASTICSEARCH_BULK_CHUNK_SIZE: int = Field(
+        env="ELASTICSEARCH_BULK_CHUNK_SIZE", default=1000
+    )
+    SEARCH_OUTBOX_BATCH_SIZE: int = Field(env="SEARCH_OUTBOX_BATCH_SIZE", default=500)
+    SEARCH_OUTBOX_INTERVAL: float = Field(env="SEARCH_OUTBOX_INTERVAL", default=1.0)
 
 
 elasticsearch_settings = ElasticSearchSettings()
@@ -5,6 +5,16 @@ from pydantic_settings import BaseSettings
 class PolygonSettings(BaseSettings):
     POLYGON_API_KEY: str = Field(env="DATABASE_URL")
     POLYGON_API_URL: str = Field(env="POLYGON_API_URL")
+    POLYGON_RATE_LIMIT: float = Field(env="POLYGON_RATE_LIMIT", default=5.0)
+    POLYGON_RATE_BURST: int = Field(env="POLYGON_RATE_BURST", default=5)
+    POLYGON_CONCURRENCY: int = Field(env="POLYGON_CONCURRENCY", default=10)
+    POLYGON_MAX_RETRIES: int = Field(env="POLYGON_MAX_RETRIES", default=5)
+    POLYGON_TIMEOUT: float = Field(env="POLYGON_TIMEOUT", default=30.0)
+    POLYGON_INGESTION_INTERVAL: float = Field(
+        env="POLYGON_INGESTION_INTERVAL", default=1.0
+    )
+    RUN_INGESTION: bool = Field(env="RUN_INGESTION", default=True)
+    INGESTION_LEASE_TTL: float = Field(env="INGESTION_LEASE_TTL", default=15.0)
 
 
 polygon_settings = PolygonSettings()
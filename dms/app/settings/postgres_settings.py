@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -8,6 +10,15 @@ class PostgresSettings(BaseSettings):
     POSTGRES_PASSWORD: str = Field(env="POSTGRES_PASSWORD")
     POSTGRES_DB: str = Field(env="POSTGRES_DB")
     POSTGRES_PORT: str = Field(env="POSTGRES_PORT", default="5432")
+    ASYNC_DATABASE_URL: Optional[str] = Field(env="ASYNC_DATABASE_URL", default=None)
+    POSTGRES_ASYNC_POOL_SIZE: int = Field(env="POSTGRES_ASYNC_POOL_SIZE", default=10)
+    POSTGRES_ASYNC_MAX_OVERFLOW: int = Field(
+        env="POSTGRES_ASYNC_MAX_OVERFLOW", default=20
+    )
+    POSTGRES_LEAK_THRESHOLD: float = Field(env="POSTGRES_LEAK_THRESHOLD", default=60.0)
+    POSTGRES_TRACK_CHECKOUTS: bool = Field(
+        env="POSTGRES_TRACK_CHECKOUTS", default=False
+    )
 
 
 postgres_settings = PostgresSettings()
@@ -5,6 +5,14 @@ from pydantic_settings import BaseSettings
 class RedisSettings(BaseSettings):
     REDIS_HOST: str = Field(env="REDIS_HOST")
     REDIS_PORT: str = Field(env="REDIS_PORT")
+    AGGREGATION_CACHE_TTL: int = Field(
+        env="AGGREGATION_CACHE_TTL", default=7 * 24 * 60 * 60
+    )
+    TICKER_INDEX_CHECK_INTERVAL: float = Field(
+        env="TICKER_INDEX_CHECK_INTERVAL", default=5.0
+    )
+    TICKER_INDEX_SIZE: int = Field(env="TICKER_INDEX_SIZE", default=20000)
+    STREAM_QUEUE_SIZE: int = Field(env="STREAM_QUEUE_SIZE", default=100)
 
 
 redis_settings = RedisSettings()
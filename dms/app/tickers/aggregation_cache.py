@@ -0,0 +1,144 @@
+import time
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from ..redis import redis_client
+from ..settings.redis_settings import redis_settings
+from . import models
+
+DAY = 24 * 60 * 60
+# Widest fields first, with the precision of the database columns.
+BAR_DTYPE = np.dtype(
+    [
+        ("timestamp", "<i8"),
+        ("trading_volume", "<f8"),
+        ("open_price", "<f8"),
+        ("highest_price", "<f8"),
+        ("lowest_price", "<f8"),
+        ("close_price", "<f8"),
+        ("volume_weighted_average_price", "<f8"),
+        ("number_of_transactions", "<i4"),
+    ]
+)
+# Part of every key, bumped whenever BAR_DTYPE changes.
+BAR_LAYOUT = 2
+
+
+class AggregationCache:
+    """
+    Read-through cache of bars in Redis, one binary block per ticker and UTC
+    day. Only days before today are cached since they no longer change once
+    ingested. Each day has a generation, read before the database is and
+    bumped by the ingest path for the days it writes, so a block read before
+    an ingest committed is written under a generation no reader asks for.
+    """
+
+    @staticmethod
+    def generation_key(ticker_id: int, day: int) -> str:
+        return f"aggregations_generation:{ticker_id}:{day}"
+
+    @staticmethod
+    def key(ticker_id: int, day: int, generation: str) -> str:
+        return f"aggregations:v{BAR_LAYOUT}:{ticker_id}:{day}:{generation}"
+
+    def get_range(
+        self, ticker_id: int, start_timestamp: int, end_timestamp: int, db: Session
+    ) -> np.ndarray:
+        """Return the bars of [start_timestamp, end_timestamp] as a BAR_DTYPE array."""
+        if end_timestamp < start_timestamp:
+            return np.empty(0, dtype=BAR_DTYPE)
+        today = int(time.time()) // DAY
+        days = list(range(start_timestamp // DAY, end_timestamp // DAY + 1))
+        cacheable = [day for day in days if day < today]
+        generations = redis_client.get_many(
+            [self.generation_key(ticker_id, day) for day in cacheable]
+        )
+        keys = {
+            day: self.key(ticker_id, day, generation or "0")
+            for day, generation in zip(cacheable, generations)
+        }
+        blocks = dict(
+            zip(cacheable, redis_client.get_many_bytes([keys[d] for d in cacheable]))
+        )
+        missing = [day for day in days if blocks.get(day) is None]
+        fetched = {}
+        for first_day, last_day in contiguous_runs(missing):
+            bars = self.load_bars(
+                ticker_id=ticker_id,
+                start_timestamp=first_day * DAY,
+                end_timestamp=(last_day + 1) * DAY - 1,
+                db=db,
+            )
+            bounds = np.searchsorted(
+                bars["timestamp"],
+                [day * DAY for day in range(first_day, last_day + 2)],
+            )
+            for index, day in enumerate(range(first_day, last_day + 1)):
+                fetched[day] = bars[bounds[index] : bounds[index + 1]]
+        redis_client.set_many_bytes(
+            {keys[day]: bars.tobytes() for day, bars in fetched.items() if day in keys},
+            ttl=redis_settings.AGGREGATION_CACHE_TTL,
+        )
+        bars = np.concatenate(
+            [
+                (
+                    fetched[day]
+                    if day in fetched
+                    else np.frombuffer(blocks[day], dtype=BAR_DTYPE)
+                )
+                for day in days
+            ]
+        )
+        return bars[
+            (bars["timestamp"] >= start_timestamp)
+            & (bars["timestamp"] <= end_timestamp)
+        ]
+
+    @staticmethod
+    def load_bars(
+        ticker_id: int, start_timestamp: int, end_timestamp: int, db: Session
+    ) -> np.ndarray:
+        statement = (
+            select(*[getattr(models.Aggregation, name) for name in BAR_DTYPE.names])
+            .where(
+                and_(
+                    models.Aggregation.ticker_id == ticker_id,
+                    models.Aggregation.timestamp >= start_timestamp,
+                    models.Aggregation.timestamp <= end_timestamp,
+                )
+            )
+            .order_by(models.Aggregation.timestamp)
+        )
+        rows = [tuple(row) for row in db.execute(statement)]
+        return np.array(rows, dtype=BAR_DTYPE)
+
+    def invalidate(self, ticker_id: int, timestamps: Iterable[int]):
+        days = {timestamp // DAY for timestamp in timestamps}
+        redis_client.increment_many(
+            [self.generation_key(ticker_id, day) for day in days],
+            ttl=redis_settings.AGGREGATION_CACHE_TTL,
+        )
+
+
+def contiguous_runs(days: list[int]) -> list[tuple[int, int]]:
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] == day - 1:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+def bars_to_dicts(bars: np.ndarray, ticker_id: int) -> list[dict]:
+    columns = {name: bars[name].tolist() for name in BAR_DTYPE.names}
+    return [
+        {**dict(zip(columns, bar)), "ticker_id": ticker_id}
+        for bar in zip(*columns.values())
+    ]
+
+
+aggregation_cache = AggregationCache()
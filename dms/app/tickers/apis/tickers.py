@@ -1,82 +1,248 @@
-from typing import List
+import asyncio
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Path, status
-from fastapi.openapi.models import Response
-from fastapi.responses import StreamingResponse
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    WebSocket,
+    status,
+)
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from ...elasticsearch import es_client
 from ...exceptions.exceptions import catch_errors
 from ...postgres import postgres
+from ..broadcaster import bar_broadcaster, parse_symbols
 from ..models import TICKERS
-from ..schemas import Aggregation, Ticker, TickerCreate, TickerUpdate
-from ..services import ticker_service
+from ..schemas import (
+    Aggregation,
+    AggregationBatchRequest,
+    BackfillRequest,
+    Ticker,
+    TickerCreate,
+    TickerSummary,
+    TickerUpdate,
+)
+from ..services import async_ticker_service, columnar_service, ticker_service
+from ..services.polygon_backfill_service import polygon_backfill
 
 router = APIRouter(prefix="")
+STREAM_HEARTBEAT = 15.0
 
 
-@router.get("")
+@router.get("", response_model=None)
 @catch_errors
-def get_tickers(
+async def get_tickers(
+    response: Response,
     limit: int = 100,
     offset: int = 0,
-    db: Session = Depends(postgres.get_db),
-) -> list[Ticker]:
-    return ticker_service.get_tickers(limit=limit, offset=offset, db=db)
+    after: Optional[str] = None,
+    order_by: str = "id",
+    include_aggregations: bool = False,
+    db: AsyncSession = Depends(postgres.get_async_db),
+) -> list[Union[TickerSummary, Ticker]]:
+    tickers = await async_ticker_service.get_tickers(
+        limit=limit,
+        offset=offset,
+        db=db,
+        after=after,
+        order_by=order_by,
+        include_aggregations=include_aggregations,
+    )
+    if limit != -1 and len(tickers) == limit:
+        response.headers["X-Next-Cursor"] = str(getattr(tickers[-1], order_by))
+    return tickers
+
+
+@router.get("/snapshot")
+@catch_errors
+async def get_tickers_snapshot(
+    symbols: Optional[str] = None,
+) -> list[dict]:
+    tickers = [symbol for symbol in symbols.split(",") if symbol] if symbols else None
+    return await async_ticker_service.get_ticker_snapshot(tickers=tickers)
+
+
+@router.get("/screener")
+@catch_errors
+async def screen_tickers(
+    metric: str = "change",
+    order: str = "desc",
+    days: int = 1,
+    limit: int = Query(default=20, ge=1, le=1000),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_volume: Optional[float] = None,
+) -> list[dict]:
+    return await async_ticker_service.screen_tickers(
+        metric=metric,
+        order=order,
+        days=days,
+        limit=limit,
+        min_price=min_price,
+        max_price=max_price,
+        min_volume=min_volume,
+    )
+
+
+@router.websocket("/stream")
+async def stream_aggregations_websocket(
+    websocket: WebSocket,
+    symbols: Optional[str] = None,
+):
+    await websocket.accept()
+    subscription = bar_broadcaster.subscribe(symbols=parse_symbols(symbols))
+
+    async def send():
+        while True:
+            await websocket.send_text(await subscription.get())
+
+    async def receive():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        bar_broadcaster.unsubscribe(subscription)
+
+
+@router.get("/stream")
+async def stream_aggregations_events(
+    request: Request,
+    symbols: Optional[str] = None,
+):
+    subscription = bar_broadcaster.subscribe(symbols=parse_symbols(symbols))
 
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(
+                        subscription.get(), timeout=STREAM_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: aggregations\ndata: {message}\n\n"
+        finally:
+            bar_broadcaster.unsubscribe(subscription)
 
-@router.get("/{ticker_id}")
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.get("/{ticker_id}", response_model=None)
 @catch_errors
-def get_ticker_by_id(
+async def get_ticker_by_id(
     ticker_id: int,
-    db: Session = Depends(postgres.get_db),
-) -> Ticker:
-    return ticker_service.get_ticker_by_id(ticker_id=ticker_id, db=db)
+    include_aggregations: bool = False,
+    db: AsyncSession = Depends(postgres.get_async_db),
+) -> Union[TickerSummary, Ticker]:
+    return await async_ticker_service.get_ticker_by_id(
+        ticker_id=ticker_id, db=db, include_aggregations=include_aggregations
+    )
 
 
-@router.get("/symbol/{symbol}")
+@router.get("/symbol/{symbol}", response_model=None)
 @catch_errors
-def get_ticker_by_id(
+async def get_ticker_by_id(
     symbol: str,
-    db: Session = Depends(postgres.get_db),
-) -> Ticker:
-    return ticker_service.get_ticker_by_symbol(ticker=symbol, db=db)
+    include_aggregations: bool = False,
+    db: AsyncSession = Depends(postgres.get_async_db),
+) -> Union[TickerSummary, Ticker]:
+    return await async_ticker_service.get_ticker_by_symbol(
+        ticker=symbol, db=db, include_aggregations=include_aggregations
+    )
 
 
 @router.post("")
 @catch_errors
-def create_ticker(
+async def create_ticker(
     ticker: TickerCreate,
-    db: Session = Depends(postgres.get_db),
+    db: AsyncSession = Depends(postgres.get_async_db),
 ) -> Ticker:
-    return ticker_service.create_ticker(ticker=ticker, db=db)
+    return await async_ticker_service.create_ticker(ticker=ticker, db=db)
 
 
 @router.put("/{ticker_id}")
 @catch_errors
-def update_ticker(
+async def update_ticker(
     ticker_id: int,
     ticker: TickerUpdate,
-    db: Session = Depends(postgres.get_db),
-) -> Ticker:
-    return ticker_service.update_ticker(ticker_id=ticker_id, ticker=ticker, db=db)
+    db: AsyncSession = Depends(postgres.get_async_db),
+) -> TickerSummary:
+    return await async_ticker_service.update_ticker(
+        ticker_id=ticker_id, ticker=ticker, db=db
+    )
 
 
 @router.delete("/{ticker_id}")
 @catch_errors
-def delete_ticker(
+async def delete_ticker(
     ticker_id: int,
-    db: Session = Depends(postgres.get_db),
-) -> Ticker:
-    return ticker_service.delete_ticker(ticker_id=ticker_id, db=db)
+    db: AsyncSession = Depends(postgres.get_async_db),
+) -> TickerSummary:
+    return await async_ticker_service.delete_ticker(ticker_id=ticker_id, db=db)
 
 
-@router.post("/reindex")
+@router.post("/reindex", status_code=status.HTTP_202_ACCEPTED)
 @catch_errors
 def reindex_tickers(
-    db: Session = Depends(postgres.get_db),
-):
-    return es_client.reindex_all(index=TICKERS, db=db)
+    background_tasks: BackgroundTasks,
+) -> dict:
+    job_id = es_client.start_reindex(index=TICKERS)
+    background_tasks.add_task(es_client.reindex_all, index=TICKERS, job_id=job_id)
+    return {"job_id": job_id, "status": "pending"}
+
+
+@router.get("/reindex/{job_id}")
+@catch_errors
+def get_reindex_job(
+    job_id: str,
+) -> dict:
+    return es_client.get_reindex_job(job_id=job_id)
+
+
+@router.post("/backfill", status_code=status.HTTP_202_ACCEPTED)
+@catch_errors
+def start_backfill(
+    request: BackfillRequest,
+) -> dict:
+    job_id = polygon_backfill.start(
+        start_date=request.start_date,
+        end_date=request.end_date,
+        symbols=request.symbols,
+    )
+    polygon_backfill.enqueue(job_id=job_id)
+    return {"job_id": job_id, "status": "pending"}
+
+
+@router.post("/backfill/{job_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+@catch_errors
+def resume_backfill(
+    job_id: str,
+) -> dict:
+    polygon_backfill.enqueue(job_id=job_id)
+    return polygon_backfill.get_job(job_id=job_id)
+
+
+@router.get("/backfill/{job_id}")
+@catch_errors
+def get_backfill_job(
+    job_id: str,
+) -> dict:
+    return polygon_backfill.get_job(job_id=job_id)
 
 
 @router.get("/search/{query}")
@@ -87,16 +253,85 @@ def search_tickers(
     return es_client.es_search(query=query, index=TICKERS)
 
 
+@router.get("/suggest/{prefix}")
+@catch_errors
+def suggest_tickers(
+    prefix: str,
+    size: int = Query(default=10, ge=1, le=100),
+) -> list[dict]:
+    return es_client.es_suggest(prefix=prefix, index=TICKERS, size=size)
+
+
+@router.post("/aggregations/batch")
+@catch_errors
+async def get_batch_aggregations(
+    request: AggregationBatchRequest,
+):
+    content, missing = await async_ticker_service.batch_ticker_aggregations(
+        request=request
+    )
+    response = StreamingResponse(content, media_type="application/x-ndjson")
+    if missing:
+        response.headers["X-Missing-Tickers"] = ",".join(missing)
+    return response
+
+
 @router.get("/{symbol}/aggregations/{start_date}/{end_date}")
 @catch_errors
-def get_ticker_aggregations(
+async def get_ticker_aggregations(
     symbol: str,
     start_date: str,
     end_date: str,
-    db: Session = Depends(postgres.get_db),
+    format: Optional[str] = None,
+    resolution: Optional[str] = None,
+    accept: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(postgres.get_async_db),
 ) -> list[Aggregation]:
-    return ticker_service.get_ticker_aggregations(
-        ticker=symbol, start_date=start_date, end_date=end_date, db=db
+    columnar_format = columnar_service.negotiate_format(format=format, accept=accept)
+    if columnar_format:
+        content = await columnar_service.async_export_ticker_aggregations(
+            ticker=symbol,
+            start_date=start_date,
+            end_date=end_date,
+            format=columnar_format,
+            db=db,
+            resolution=resolution,
+        )
+        return Response(
+            content=content, media_type=columnar_service.MEDIA_TYPES[columnar_format]
+        )
+    return await async_ticker_service.get_ticker_aggregations(
+        ticker=symbol,
+        start_date=start_date,
+        end_date=end_date,
+        db=db,
+        resolution=resolution,
+    )
+
+
+@router.get("/{symbol}/snapshot")
+@catch_errors
+async def get_ticker_snapshot(
+    symbol: str,
+) -> dict:
+    return await async_ticker_service.get_ticker_latest_bar(ticker=symbol)
+
+
+@router.get("/{symbol}/indicators/{start_date}/{end_date}")
+@catch_errors
+async def get_ticker_indicators(
+    symbol: str,
+    start_date: str,
+    end_date: str,
+    indicators: str = Query(default="sma,ema,rsi,bollinger,vwap"),
+    resolution: Optional[str] = None,
+) -> list[dict]:
+    return await async_ticker_service.get_ticker_indicators(
+        ticker=symbol,
+        start_date=start_date,
+        end_date=end_date,
+        indicators=indicators,
+        resolution=resolution,
     )
 
 
@@ -106,14 +341,18 @@ def export_ticker_aggregations(
     symbol: str,
     start_date: str,
     end_date: str,
+    gzip: bool = False,
     db: Session = Depends(postgres.get_db),
 ):
     csv_content = ticker_service.export_ticker_aggregations(
-        ticker=symbol, start_date=start_date, end_date=end_date, db=db
+        ticker=symbol, start_date=start_date, end_date=end_date, db=db, compress=gzip
+    )
+    extension = "csv.gz" if gzip else "csv"
+    response = StreamingResponse(
+        csv_content, media_type="application/gzip" if gzip else "text/csv"
     )
-    response = StreamingResponse(csv_content, media_type="text/csv")
     response.headers["Content-Disposition"] = (
-        f"attachment; filename=aggregations_of_{symbol}_from_{start_date}_to_{end_date}.csv"
+        f"attachment; filename=aggregations_of_{symbol}_from_{start_date}_to_{end_date}.{extension}"
     )
     return response
 
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+import redis.asyncio
+
+from ..redis import AGGREGATIONS_CHANNEL
+from ..settings.redis_settings import redis_settings
+
+logger = logging.getLogger("uvicorn")
+RECONNECT_DELAY = 1.0
+
+
+class Subscription:
+    """
+    The bars one client asked for, waiting to be sent. The queue is bounded:
+    when the client falls behind, the oldest message is dropped so a slow
+    consumer never holds anything up.
+    """
+
+    def __init__(self, symbols: Optional[set[str]], size: int):
+        self.symbols = symbols
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+
+    def put(self, ticker: str, message: str):
+        if self.symbols is not None and ticker not in self.symbols:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class BarBroadcaster:
+    """
+    Fans the bars published on AGGREGATIONS_CHANNEL out to the WebSocket and
+    SSE clients of this process. A single Redis subscription is held while at
+    least one client is connected, and each message is decoded once whatever
+    the number of clients.
+    """
+
+    def __init__(self):
+        self.subscriptions: set[Subscription] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self, symbols: Optional[set[str]] = None) -> Subscription:
+        subscription = Subscription(
+            symbols=symbols, size=redis_settings.STREAM_QUEUE_SIZE
+        )
+        self.subscriptions.add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.listen())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        if subscription.dropped:
+            logger.info(f"Stream subscriber dropped {subscription.dropped} messages")
+        if not self.subscriptions and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def listen(self):
+        while True:
+            connection = redis.asyncio.StrictRedis(
+                host=redis_settings.REDIS_HOST,
+                port=redis_settings.REDIS_PORT,
+                decode_responses=True,
+            )
+            try:
+                async with connection.pubsub() as pubsub:
+                    await pubsub.subscribe(AGGREGATIONS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.dispatch(message["data"])
+            except Exception as e:
+                # Timeouts and protocol errors end the subscription just like
+                # a dropped connection, the clients only see a short gap.
+                logger.warning(f"Lost the {AGGREGATIONS_CHANNEL} subscription: {e!r}")
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                await connection.aclose()
+
+    def dispatch(self, message: str):
+        try:
+            ticker = json.loads(message)["ticker"]
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Skipped a malformed {AGGREGATIONS_CHANNEL} message: {e!r}")
+            return
+        for subscription in list(self.subscriptions):
+            subscription.put(ticker=ticker, message=message)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.subscriptions.clear()
+
+
+def parse_symbols(symbols: Optional[str]) -> Optional[set[str]]:
+    """`AAPL,MSFT` to a set of symbols, nothing meaning every ticker."""
+    if not symbols:
+        return None
+    return {symbol for symbol in symbols.split(",") if symbol}
+
+
+bar_broadcaster = BarBroadcaster()
@@ -0,0 +1,377 @@
+import hashlib
+import time
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..redis import redis_client
+from ..settings.redis_settings import redis_settings
+from . import models
+from .aggregation_cache import BAR_DTYPE, aggregation_cache, contiguous_runs
+from .rollups import BAR_SECONDS, DAY, aggregation_rollups, bucket_offset
+
+# Chunks of daily and coarser series hold this many buckets.
+CHUNK_BUCKETS = 64
+# EMA and RSI are recursive, their seed weighs less than e^-10 after this
+# many periods, which is the warm-up they are given before a chunk.
+RECURSIVE_WARMUP = 10
+
+
+class IndicatorSpec(NamedTuple):
+    name: str
+    params: tuple
+
+    @property
+    def label(self) -> str:
+        return "_".join([self.name] + [f"{param:g}" for param in self.params])
+
+
+class Indicator(NamedTuple):
+    defaults: tuple
+    columns: tuple
+    warmup: Callable[[tuple], int]
+    compute: Callable[..., list]
+
+
+def rolling_windows(values: np.ndarray, period: int) -> Optional[np.ndarray]:
+    return sliding_window_view(values, period) if len(values) >= period else None
+
+
+def sma(bars: dict, period: int) -> list:
+    output = np.full(len(bars["close"]), np.nan)
+    windows = rolling_windows(bars["close"], int(period))
+    if windows is not None:
+        output[int(period) - 1 :] = windows.mean(axis=1)
+    return [output]
+
+
+def ema(bars: dict, period: int) -> list:
+    output = (pd.Series(bars["close"]).ewm(span=period, adjust=False).mean()).to_numpy(
+        copy=True
+    )
+    output[: int(period) - 1] = np.nan
+    return [output]
+
+
+def rsi(bars: dict, period: int) -> list:
+    """Wilder's RSI, the gains and losses smoothed with alpha = 1 / period."""
+    change = np.diff(bars["close"], prepend=np.nan)
+    gains = pd.Series(np.clip(change, 0, None))
+    losses = pd.Series(np.clip(-change, 0, None))
+    average_gain = gains.ewm(alpha=1 / period, adjust=False).mean()
+    average_loss = losses.ewm(alpha=1 / period, adjust=False).mean()
+    average_gain = average_gain.to_numpy(copy=True)
+    average_loss = average_loss.to_numpy(copy=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        output = 100 - 100 / (1 + average_gain / average_loss)
+    output[(average_loss == 0) & (average_gain > 0)] = 100
+    output[: int(period)] = np.nan
+    return [output]
+
+
+def bollinger(bars: dict, period: int, width: float) -> list:
+    middle = np.full(len(bars["close"]), np.nan)
+    deviation = np.full(len(bars["close"]), np.nan)
+    windows = rolling_windows(bars["close"], int(period))
+    if windows is not None:
+        middle[int(period) - 1 :] = windows.mean(axis=1)
+        deviation[int(period) - 1 :] = windows.std(axis=1)
+    return [middle, middle + width * deviation, middle - width * deviation]
+
+
+def vwap(bars: dict, width: float) -> list:
+    """
+    VWAP anchored on each UTC day, with bands at `width` volume-weighted
+    standard deviations of the typical price.
+    """
+    typical = (bars["high"] + bars["low"] + bars["close"]) / 3
+    volume = bars["volume"]
+    sessions = bars["timestamp"] // DAY
+    starts = np.flatnonzero(np.diff(sessions, prepend=-1))
+
+    def session_cumsum(values: np.ndarray) -> np.ndarray:
+        total = np.cumsum(values)
+        before = np.concatenate([[0.0], total])[starts]
+        return total - np.repeat(before, np.diff(np.append(starts, len(values))))
+
+    cumulative_volume = session_cumsum(volume)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = session_cumsum(typical * volume) / cumulative_volume
+        variance = session_cumsum(typical * typical * volume) / cumulative_volume
+    deviation = np.sqrt(np.clip(variance - value * value, 0, None))
+    return [value, value + width * deviation, value - width * deviation]
+
+
+INDICATORS = {
+    "sma": Indicator((20,), ("",), lambda params: int(params[0]) - 1, sma),
+    "ema": Indicator(
+        (20,), ("",), lambda params: RECURSIVE_WARMUP * int(params[0]), ema
+    ),
+    "rsi": Indicator(
+        (14,), ("",), lambda params: RECURSIVE_WARMUP * int(params[0]), rsi
+    ),
+    "bollinger": Indicator(
+        (20, 2),
+        ("middle", "upper", "lower"),
+        lambda params: int(params[0]) - 1,
+        bollinger,
+    ),
+    "vwap": Indicator((1,), ("", "upper", "lower"), lambda params: 0, vwap),
+}
+
+
+def parse_indicators(indicators: str) -> list[IndicatorSpec]:
+    """
+    Turn `sma:20,ema:50,rsi,bollinger:20:2,vwap:1` into specs, missing
+    parameters taking their defaults. Duplicates are dropped.
+    """
+    specs = []
+    for item in filter(None, (item.strip() for item in indicators.split(","))):
+        name, *values = item.split(":")
+        indicator = INDICATORS.get(name.lower())
+        if indicator is None:
+            raise ValueError(
+                f"Invalid indicator {name}. Expected one of {', '.join(INDICATORS)}."
+            )
+        if len(values) > len(indicator.defaults):
+            raise ValueError(f"Too many parameters for indicator {item}.")
+        try:
+            params = tuple(float(value) for value in values)
+        except ValueError:
+            raise ValueError(f"Invalid parameters for indicator {item}.")
+        params += indicator.defaults[len(params) :]
+        if params[0] <= 0 or (name.lower() != "vwap" and params[0] % 1):
+            raise ValueError(f"Invalid period for indicator {item}.")
+        spec = IndicatorSpec(name=name.lower(), params=params)
+        if spec not in specs:
+            specs.append(spec)
+    if not specs:
+        raise ValueError("No indicator requested.")
+    return specs
+
+
+def indicator_dtype(specs: list[IndicatorSpec]) -> np.dtype:
+    fields = [("timestamp", "<i8")]
+    for spec in specs:
+        for column in INDICATORS[spec.name].columns:
+            fields.append(("_".join(filter(None, [spec.label, column])), "<f8"))
+    return np.dtype(fields)
+
+
+class IndicatorEngine:
+    """
+    Computes indicators over the bars of a ticker in one vectorised pass and
+    caches the result in Redis by chunk: a UTC day of intraday bars, or
+    CHUNK_BUCKETS buckets of a daily or coarser series. Only chunks that
+    ended before today are cached. Missing chunks are computed together,
+    preceded by the warm-up bars the slowest indicator needs, so extending a
+    range only computes the new chunks. Writing bars bumps the ticker's
+    generation, which orphans its cached chunks.
+    """
+
+    @staticmethod
+    def generation_key(ticker_id: int) -> str:
+        return f"indicators_generation:{ticker_id}"
+
+    @staticmethod
+    def key(
+        ticker_id: int,
+        generation: str,
+        resolution: int,
+        specs: list[IndicatorSpec],
+        chunk: int,
+    ) -> str:
+        labels = ",".join(spec.label for spec in specs)
+        digest = hashlib.sha1(labels.encode()).hexdigest()[:16]
+        return f"indicators:{ticker_id}:{generation}:{resolution}:{digest}:{chunk}"
+
+    @staticmethod
+    def chunk_seconds(resolution: int) -> int:
+        return DAY if resolution < DAY else resolution * CHUNK_BUCKETS
+
+    def get_range(
+        self,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        specs: list[IndicatorSpec],
+        db: Session,
+        resolution: int = BAR_SECONDS,
+    ) -> np.ndarray:
+        """Indicator values of the bars in [start_timestamp, end_timestamp]."""
+        if resolution >= DAY and any(spec.name == "vwap" for spec in specs):
+            raise ValueError("The session VWAP needs an intraday resolution.")
+        dtype = indicator_dtype(specs)
+        if end_timestamp < start_timestamp:
+            return np.empty(0, dtype=dtype)
+        size = self.chunk_seconds(resolution)
+        offset = bucket_offset(resolution)
+        today = int(time.time()) // DAY * DAY
+        chunks = list(
+            range(
+                (start_timestamp - offset) // size, (end_timestamp - offset) // size + 1
+            )
+        )
+        cacheable = [chunk for chunk in chunks if (chunk + 1) * size + offset <= today]
+        generation = redis_client.get(self.generation_key(ticker_id)) or "0"
+        keys = {
+            chunk: self.key(ticker_id, generation, resolution, specs, chunk)
+            for chunk in cacheable
+        }
+        blocks = dict(
+            zip(cacheable, redis_client.get_many_bytes([keys[c] for c in cacheable]))
+        )
+        missing = [chunk for chunk in chunks if blocks.get(chunk) is None]
+        fetched = {}
+        for first_chunk, last_chunk in contiguous_runs(missing):
+            values = self.compute(
+                ticker_id=ticker_id,
+                start_timestamp=first_chunk * size + offset,
+                end_timestamp=(last_chunk + 1) * size + offset - 1,
+                resolution=resolution,
+                specs=specs,
+                dtype=dtype,
+                db=db,
+            )
+            bounds = np.searchsorted(
+                values["timestamp"],
+                [chunk * size + offset for chunk in range(first_chunk, last_chunk + 2)],
+            )
+            for index, chunk in enumerate(range(first_chunk, last_chunk + 1)):
+                fetched[chunk] = values[bounds[index] : bounds[index + 1]]
+        redis_client.set_many_bytes(
+            {
+                keys[chunk]: values.tobytes()
+                for chunk, values in fetched.items()
+                if chunk in keys
+            },
+            ttl=redis_settings.AGGREGATION_CACHE_TTL,
+        )
+        values = np.concatenate(
+            [
+                (
+                    fetched[chunk]
+                    if chunk in fetched
+                    else np.frombuffer(blocks[chunk], dtype=dtype)
+                )
+                for chunk in chunks
+            ]
+        )
+        return values[
+            (values["timestamp"] >= start_timestamp)
+            & (values["timestamp"] <= end_timestamp)
+        ]
+
+    def compute(
+        self,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        resolution: int,
+        specs: list[IndicatorSpec],
+        dtype: np.dtype,
+        db: Session,
+    ) -> np.ndarray:
+        bars = self.load_bars(ticker_id, start_timestamp, end_timestamp, resolution, db)
+        warmup = max(INDICATORS[spec.name].warmup(spec.params) for spec in specs)
+        if warmup and len(bars):
+            bars = np.concatenate(
+                [
+                    self.load_warmup(
+                        ticker_id, start_timestamp, warmup, resolution, db
+                    ),
+                    bars,
+                ]
+            )
+        series = {
+            "timestamp": bars["timestamp"],
+            "close": bars["close_price"].astype(np.float64),
+            "high": bars["highest_price"].astype(np.float64),
+            "low": bars["lowest_price"].astype(np.float64),
+            "volume": bars["trading_volume"],
+        }
+        values = np.empty(len(bars), dtype=dtype)
+        values["timestamp"] = bars["timestamp"]
+        names = iter(dtype.names[1:])
+        for spec in specs:
+            for column in INDICATORS[spec.name].compute(series, *spec.params):
+                values[next(names)] = column
+        return values[values["timestamp"] >= start_timestamp]
+
+    def load_warmup(
+        self,
+        ticker_id: int,
+        before_timestamp: int,
+        count: int,
+        resolution: int,
+        db: Session,
+    ) -> np.ndarray:
+        """
+        The last `count` bars before `before_timestamp`. Markets are closed
+        most of the time, so the window doubles until it holds enough bars or
+        reaches the first bar of the ticker.
+        """
+        first_timestamp = db.scalar(
+            select(models.AggregationCoverage.first_ts).where(
+                models.AggregationCoverage.ticker_id == ticker_id
+            )
+        )
+        if first_timestamp is None or first_timestamp >= before_timestamp:
+            return np.empty(0, dtype=BAR_DTYPE)
+        span = count * resolution
+        while True:
+            start_timestamp = max(before_timestamp - span, first_timestamp)
+            bars = self.load_bars(
+                ticker_id, start_timestamp, before_timestamp - 1, resolution, db
+            )
+            if len(bars) >= count or start_timestamp == first_timestamp:
+                return bars[-count:]
+            span *= 2
+
+    @staticmethod
+    def load_bars(
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        resolution: int,
+        db: Session,
+    ) -> np.ndarray:
+        if resolution == BAR_SECONDS:
+            return aggregation_cache.get_range(
+                ticker_id=ticker_id,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                db=db,
+            )
+        bars = aggregation_rollups.get_range(
+            ticker_id=ticker_id,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            resolution=resolution,
+            db=db,
+        )
+        return bars[
+            (bars["timestamp"] >= start_timestamp)
+            & (bars["timestamp"] <= end_timestamp)
+        ]
+
+    def invalidate(self, ticker_id: int):
+        redis_client.incr(self.generation_key(ticker_id))
+
+
+def values_to_dicts(values: np.ndarray) -> list[dict]:
+    """Rows of indicator values, with None until an indicator is warmed up."""
+    columns = {}
+    for name in values.dtype.names:
+        column = values[name].astype(object)
+        if name != "timestamp":
+            column[np.isnan(values[name])] = None
+        columns[name] = column.tolist()
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+indicator_engine = IndicatorEngine()
@@ -1,10 +1,29 @@
-from sqlalchemy import BigInteger, Boolean, Date, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    PrimaryKeyConstraint,
+    String,
+    func,
+)
 from sqlalchemy.orm import class_mapper, mapped_column, relationship
 
 from ..postgres import postgres
 
 TICKERS = "tickers"
 AGGREGATIONS = "aggregations"
+AGGREGATION_COVERAGE = "aggregation_coverage"
+AGGREGATION_FETCHES = "aggregation_fetches"
+SEARCH_OUTBOX = "search_outbox"
+AGGREGATION_ROLLUPS = "aggregation_rollups"
+
+COVERAGE_PENDING = "pending"
+COVERAGE_ACTIVE = "active"
+COVERAGE_EMPTY = "empty"
 
 
 class Ticker(postgres.base):
@@ -21,6 +40,7 @@ class Ticker(postgres.base):
     composite_figi = mapped_column(String, nullable=True)
     share_class_figi = mapped_column(String, nullable=True)
     last_updated_utc = mapped_column(String, nullable=True)
+    content_hash = mapped_column(String, nullable=True)
     aggregations = relationship(
         "Aggregation",
         back_populates="ticker",
@@ -38,25 +58,106 @@ class Ticker(postgres.base):
 
 
 class Aggregation(postgres.base):
+    """
+    One bar, keyed on (ticker_id, timestamp). Columns are ordered widest first
+    to avoid alignment padding. Prices stay double precision, a 4-byte real
+    loses the cents of prices above $131072; the request window of each fetch
+    lives once in AggregationFetch.
+    """
+
     __tablename__ = AGGREGATIONS
-    id = mapped_column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        PrimaryKeyConstraint("ticker_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    timestamp = mapped_column(BigInteger)
+    trading_volume = mapped_column(Float)
     close_price = mapped_column(Float)
     highest_price = mapped_column(Float)
     lowest_price = mapped_column(Float)
-    number_of_transactions = mapped_column(Integer)
     open_price = mapped_column(Float)
-    timestamp = mapped_column(BigInteger)
-    trading_volume = mapped_column(Float)
     volume_weighted_average_price = mapped_column(Float)
-    from_date = mapped_column(Date)
-    to_date = mapped_column(Date)
     ticker_id = mapped_column(Integer, ForeignKey(f"{TICKERS}.id"))
+    number_of_transactions = mapped_column(Integer)
     ticker = relationship("Ticker", back_populates="aggregations")
 
     def __repr__(self):
-        return f"<Aggregation(id={self.id}, ticker={self.ticker_id}, timestamp={self.timestamp})>"
+        return f"<Aggregation(ticker={self.ticker_id}, timestamp={self.timestamp})>"
 
     def to_dict(self):
         return {
             c.key: getattr(self, c.key) for c in class_mapper(self.__class__).columns
-        }
\ No newline at end of file
+        }
+
+
+class AggregationRollup(postgres.base):
+    """
+    One bar at a coarser resolution (in seconds), recomputed from the finer
+    level below it whenever bars in its bucket are written. Same column
+    layout as Aggregation.
+    """
+
+    __tablename__ = AGGREGATION_ROLLUPS
+    __table_args__ = (PrimaryKeyConstraint("ticker_id", "resolution", "timestamp"),)
+    timestamp = mapped_column(BigInteger)
+    trading_volume = mapped_column(Float)
+    close_price = mapped_column(Float)
+    highest_price = mapped_column(Float)
+    lowest_price = mapped_column(Float)
+    open_price = mapped_column(Float)
+    volume_weighted_average_price = mapped_column(Float)
+    ticker_id = mapped_column(Integer, ForeignKey(f"{TICKERS}.id", ondelete="CASCADE"))
+    resolution = mapped_column(Integer)
+    number_of_transactions = mapped_column(Integer)
+
+    def __repr__(self):
+        return f"<AggregationRollup(ticker={self.ticker_id}, resolution={self.resolution}, timestamp={self.timestamp})>"
+
+
+class AggregationFetch(postgres.base):
+    __tablename__ = AGGREGATION_FETCHES
+    id = mapped_column(Integer, primary_key=True, index=True)
+    ticker_id = mapped_column(
+        Integer, ForeignKey(f"{TICKERS}.id", ondelete="CASCADE"), index=True
+    )
+    from_date = mapped_column(Date)
+    to_date = mapped_column(Date)
+    bar_count = mapped_column(Integer, default=0)
+    fetched_at = mapped_column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<AggregationFetch(ticker={self.ticker_id}, from_date={self.from_date}, to_date={self.to_date})>"
+
+
+class AggregationCoverage(postgres.base):
+    __tablename__ = AGGREGATION_COVERAGE
+    ticker_id = mapped_column(
+        Integer, ForeignKey(f"{TICKERS}.id", ondelete="CASCADE"), primary_key=True
+    )
+    first_ts = mapped_column(BigInteger, nullable=True)
+    last_ts = mapped_column(BigInteger, nullable=True)
+    last_to_date = mapped_column(Date, nullable=True)
+    status = mapped_column(String, default=COVERAGE_PENDING)
+
+    def __repr__(self):
+        return f"<AggregationCoverage(ticker={self.ticker_id}, last_to_date={self.last_to_date}, status={self.status})>"
+
+
+class SearchOutboxEvent(postgres.base):
+    """
+    A document whose search copy is stale, written in the same transaction as
+    the change. The indexer reads the current row when it drains the event,
+    so several events for one document collapse into a single bulk action.
+    """
+
+    __tablename__ = SEARCH_OUTBOX
+    id = mapped_column(BigInteger, primary_key=True)
+    index = mapped_column(String)
+    document_id = mapped_column(Integer)
+    created_at = mapped_column(DateTime, server_default=func.now())
+    attempts = mapped_column(Integer, default=0)
+    next_attempt_at = mapped_column(DateTime, server_default=func.now(), index=True)
+    last_error = mapped_column(String, nullable=True)
+
+    def __repr__(self):
+        return f"<SearchOutboxEvent(index={self.index}, document_id={self.document_id}, attempts={self.attempts})>"
@@ -0,0 +1,308 @@
+import argparse
+import datetime
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from ..postgres import postgres
+from . import models
+from .models import AGGREGATION_ROLLUPS, AGGREGATIONS
+from .rollups import DAILY_INDEX
+
+logger = logging.getLogger("uvicorn")
+PARTITION_MONTHS_AHEAD = 3
+LEGACY_SUFFIX = "legacy"
+PRICE_COLUMNS = [
+    "open_price",
+    "highest_price",
+    "lowest_price",
+    "close_price",
+    "volume_weighted_average_price",
+]
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def next_month(month: datetime.date) -> datetime.date:
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def month_timestamp(month: datetime.date) -> int:
+    return int(
+        datetime.datetime.combine(
+            month, datetime.time.min, tzinfo=datetime.timezone.utc
+        ).timestamp()
+    )
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"{AGGREGATIONS}_y{month.year}m{month.month:02d}"
+
+
+class AggregationPartitions:
+    """
+    Monthly range partitions of the aggregations table on `timestamp`.
+    Range queries on (ticker_id, timestamp) only touch the matching months, and
+    old months can be detached without rewriting the table.
+    """
+
+    @classmethod
+    def is_partitioned(cls, conn: Connection) -> bool:
+        return (
+            conn.execute(
+                text(
+                    "SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass(:table)"
+                ),
+                {"table": AGGREGATIONS},
+            ).first()
+            is not None
+        )
+
+    @classmethod
+    def list_partitions(cls, conn: Connection) -> list[str]:
+        rows = conn.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:table) "
+                "ORDER BY child.relname"
+            ),
+            {"table": AGGREGATIONS},
+        )
+        return [row[0] for row in rows]
+
+    @classmethod
+    def create_partition(cls, conn: Connection, month: datetime.date):
+        month = month_start(month)
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+                f"PARTITION OF {AGGREGATIONS} FOR VALUES "
+                f"FROM ({month_timestamp(month)}) TO ({month_timestamp(next_month(month))})"
+            )
+        )
+
+    @classmethod
+    def ensure_partitions(
+        cls,
+        conn: Connection,
+        start: datetime.date,
+        months_ahead: int = PARTITION_MONTHS_AHEAD,
+    ):
+        """Create every missing monthly partition from `start` to `months_ahead` months from now."""
+        if not cls.is_partitioned(conn):
+            logger.warning(
+                f"{AGGREGATIONS} uses the legacy layout, run `python -m app.tickers.partitions migrate`"
+            )
+            return
+        month = month_start(start)
+        end = month_start(datetime.date.today())
+        for _ in range(months_ahead):
+            end = next_month(end)
+        while month <= end:
+            cls.create_partition(conn, month)
+            month = next_month(month)
+
+    @classmethod
+    def detach_partition(cls, conn: Connection, month: datetime.date):
+        """Detach a month from the aggregations table, the data stays in its own table."""
+        conn.execute(
+            text(
+                f"ALTER TABLE {AGGREGATIONS} DETACH PARTITION {partition_name(month_start(month))}"
+            )
+        )
+
+    @classmethod
+    def table_columns(cls, conn: Connection, table: str) -> set[str]:
+        rows = conn.execute(
+            text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_name = :table"
+            ),
+            {"table": table},
+        )
+        return {row[0] for row in rows}
+
+    @classmethod
+    def real_price_columns(cls, conn: Connection, table: str) -> list[str]:
+        rows = conn.execute(
+            text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_name = :table AND data_type = 'real'"
+            ),
+            {"table": table},
+        )
+        return [row[0] for row in rows if row[0] in PRICE_COLUMNS]
+
+    @classmethod
+    def widen_prices(cls, conn: Connection, table: str):
+        """Store the prices of a table written with 4-byte reals as double precision."""
+        columns = cls.real_price_columns(conn, table)
+        if not columns:
+            return
+        conn.execute(
+            text(
+                f"ALTER TABLE {table} "
+                + ", ".join(
+                    f"ALTER COLUMN {column} TYPE double precision" for column in columns
+                )
+            )
+        )
+        logger.info(f"{table} prices widened to double precision")
+
+    @classmethod
+    def is_current_layout(cls, conn: Connection) -> bool:
+        legacy_columns = {"id", "from_date", "to_date"}
+        return (
+            cls.is_partitioned(conn)
+            and not legacy_columns & cls.table_columns(conn, AGGREGATIONS)
+            and not cls.real_price_columns(conn, AGGREGATIONS)
+            and not cls.real_price_columns(conn, AGGREGATION_ROLLUPS)
+        )
+
+    @classmethod
+    def storage_report(cls, conn: Connection, table: str = AGGREGATIONS) -> dict:
+        """Row count, on-disk size (table, indexes and partitions) and bytes per bar."""
+        bars = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+        total_bytes = conn.execute(
+            text(
+                "SELECT coalesce(sum(pg_total_relation_size(relid)), 0) "
+                "FROM pg_partition_tree(to_regclass(:table))"
+            ),
+            {"table": table},
+        ).scalar()
+        row_bytes = conn.execute(
+            text(
+                f"SELECT avg(pg_column_size(sample.*)) "
+                f"FROM (SELECT * FROM {table} LIMIT 10000) sample"
+            )
+        ).scalar()
+        total_bytes = int(total_bytes)
+        return {
+            "table": table,
+            "bars": bars,
+            "total_bytes": total_bytes,
+            "bytes_per_bar": round(total_bytes / bars, 1) if bars else None,
+            "row_bytes": round(float(row_bytes), 1) if row_bytes else None,
+        }
+
+    @classmethod
+    def migrate(cls, conn: Connection) -> Optional[dict]:
+        """
+        Move an existing aggregations table into the current layout (monthly
+        partitions, compact bar columns, request windows in aggregation_fetches).
+        The old table and its partitions are renamed with a _legacy suffix and
+        kept so they can be checked and dropped manually. A table already in
+        the compact layout with 4-byte real prices is only widened in place.
+        The daily index of aggregation_rollups is created when missing.
+        Returns the storage report before and after the migration.
+        """
+        DAILY_INDEX.create(conn, checkfirst=True)
+        if cls.is_current_layout(conn):
+            logger.info(f"{AGGREGATIONS} already uses the current layout")
+            return None
+        before = cls.storage_report(conn)
+        cls.widen_prices(conn, AGGREGATION_ROLLUPS)
+        if cls.is_current_layout(conn) or cls.real_price_columns(conn, AGGREGATIONS):
+            cls.widen_prices(conn, AGGREGATIONS)
+            return {"before": before, "after": cls.storage_report(conn)}
+        legacy = f"{AGGREGATIONS}_{LEGACY_SUFFIX}"
+        legacy_columns = cls.table_columns(conn, AGGREGATIONS)
+        for partition in cls.list_partitions(conn):
+            conn.execute(
+                text(f"ALTER TABLE {partition} RENAME TO {partition}_{LEGACY_SUFFIX}")
+            )
+        conn.execute(text(f"ALTER TABLE {AGGREGATIONS} RENAME TO {legacy}"))
+        indexes = conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+            {"table": legacy},
+        )
+        for (index,) in indexes.all():
+            conn.execute(text(f"ALTER INDEX {index} RENAME TO {index}_{LEGACY_SUFFIX}"))
+        conn.execute(
+            text(
+                f"ALTER SEQUENCE IF EXISTS {AGGREGATIONS}_id_seq "
+                f"RENAME TO {legacy}_id_seq"
+            )
+        )
+        models.Aggregation.__table__.create(conn)
+        models.AggregationFetch.__table__.create(conn, checkfirst=True)
+
+        first_timestamp = conn.execute(
+            text(f"SELECT min(timestamp) FROM {legacy}")
+        ).scalar()
+        start = (
+            datetime.datetime.fromtimestamp(
+                first_timestamp, tz=datetime.timezone.utc
+            ).date()
+            if first_timestamp is not None
+            else datetime.date.today()
+        )
+        cls.ensure_partitions(conn, start=start)
+
+        columns = ", ".join(
+            column.name for column in models.Aggregation.__table__.columns
+        )
+        conn.execute(
+            text(
+                f"INSERT INTO {AGGREGATIONS} ({columns}) SELECT {columns} FROM {legacy} "
+                "ON CONFLICT DO NOTHING"
+            )
+        )
+        if {"from_date", "to_date"} <= legacy_columns:
+            conn.execute(
+                text(
+                    f"INSERT INTO {models.AGGREGATION_FETCHES} "
+                    "(ticker_id, from_date, to_date, bar_count) "
+                    f"SELECT ticker_id, from_date, to_date, count(*) FROM {legacy} "
+                    "WHERE from_date IS NOT NULL GROUP BY ticker_id, from_date, to_date"
+                )
+            )
+        after = cls.storage_report(conn)
+        logger.info(f"{AGGREGATIONS} migrated, {legacy} can be dropped")
+        return {"before": before, "after": after}
+
+
+aggregation_partitions = AggregationPartitions()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage aggregations partitions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser(
+        "migrate", help="convert a legacy table to the current layout"
+    )
+    subparsers.add_parser("list", help="list the monthly partitions")
+    subparsers.add_parser("report", help="print the storage size per bar")
+    ensure = subparsers.add_parser("ensure", help="create missing partitions")
+    ensure.add_argument("--start", type=datetime.date.fromisoformat, required=True)
+    ensure.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    detach = subparsers.add_parser("detach", help="detach the partition of a month")
+    detach.add_argument("month", type=datetime.date.fromisoformat)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with postgres.engine.begin() as conn:
+        if args.command == "migrate":
+            print(json.dumps(aggregation_partitions.migrate(conn), indent=4))
+        elif args.command == "report":
+            print(json.dumps(aggregation_partitions.storage_report(conn), indent=4))
+        elif args.command == "list":
+            for partition in aggregation_partitions.list_partitions(conn):
+                print(partition)
+        elif args.command == "ensure":
+            aggregation_partitions.ensure_partitions(
+                conn, start=args.start, months_ahead=args.months_ahead
+            )
+        elif args.command == "detach":
+            aggregation_partitions.detach_partition(conn, month=args.month)
+
+
+if __name__ == "__main__":
+    main()
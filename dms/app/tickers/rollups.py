@@ -0,0 +1,250 @@
+import argparse
+import logging
+import re
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Index, and_, func, literal, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert
+from sqlalchemy.orm import Session
+
+from ..postgres import postgres
+from . import models
+from .aggregation_cache import BAR_DTYPE
+
+logger = logging.getLogger("uvicorn")
+
+BAR_SECONDS = 10 * 60
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+# 1970-01-05 is the first Monday after the epoch, weeks start on Mondays.
+WEEK_OFFSET = 4 * DAY
+ROLLUP_RESOLUTIONS = [HOUR, DAY, WEEK]
+RESOLUTION_UNITS = {"m": 60, "h": HOUR, "d": DAY, "w": WEEK}
+VALUE_FIELDS = [
+    "trading_volume",
+    "close_price",
+    "highest_price",
+    "lowest_price",
+    "open_price",
+    "volume_weighted_average_price",
+    "number_of_transactions",
+]
+
+# The daily rows indexed by day with the columns the screener reads, so a
+# window of the whole universe is an index-only scan.
+DAILY_INDEX = Index(
+    "ix_aggregation_rollups_daily",
+    models.AggregationRollup.timestamp,
+    postgresql_where=models.AggregationRollup.resolution == DAY,
+    postgresql_include=[
+        "ticker_id",
+        "open_price",
+        "close_price",
+        "trading_volume",
+        "volume_weighted_average_price",
+    ],
+)
+
+
+def parse_resolution(resolution: str) -> int:
+    """Turn `30m`, `4h`, `1d` or `2w` into seconds, a multiple of the bar size."""
+    match = re.fullmatch(r"(\d+)([mhdw])", resolution)
+    seconds = int(match.group(1)) * RESOLUTION_UNITS[match.group(2)] if match else 0
+    if seconds <= 0 or seconds % BAR_SECONDS:
+        raise ValueError(
+            f"Invalid resolution {resolution}. Expected a multiple of "
+            f"{BAR_SECONDS // 60}m such as 1h, 1d or 1w."
+        )
+    return seconds
+
+
+def bucket_offset(resolution: int) -> int:
+    return WEEK_OFFSET if resolution % WEEK == 0 else 0
+
+
+def bucket_start(timestamp: int, resolution: int) -> int:
+    offset = bucket_offset(resolution)
+    return timestamp - (timestamp - offset) % resolution
+
+
+class AggregationRollups:
+    """
+    Maintains 1h, 1d and 1w bars in aggregation_rollups. Each level is
+    rebuilt for the touched buckets only, the hour from the raw bars, the day
+    from the hours and the week from the days: open is the first open, close
+    the last close, high/low the extremes, volume and transactions the sums
+    and VWAP the volume-weighted mean of the VWAPs.
+    """
+
+    @staticmethod
+    def source(resolution: int):
+        """The table, and the level within it, a resolution is built from."""
+        finer = [level for level in ROLLUP_RESOLUTIONS if resolution % level == 0]
+        finer = [level for level in finer if level < resolution]
+        if not finer:
+            return models.Aggregation.__table__, None
+        return models.AggregationRollup.__table__, max(finer)
+
+    @classmethod
+    def bucket_statement(
+        cls,
+        resolution: int,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+    ):
+        """Bars of `resolution` built from the finer level in [start, end)."""
+        table, level = cls.source(resolution)
+        column = table.c
+        offset = bucket_offset(resolution)
+        bucket = (column.timestamp - (column.timestamp - offset) % resolution).label(
+            "timestamp"
+        )
+        volume = func.sum(column.trading_volume)
+        price_volume = func.sum(
+            column.volume_weighted_average_price * column.trading_volume
+        )
+        conditions = [
+            column.ticker_id == ticker_id,
+            column.timestamp >= start_timestamp,
+            column.timestamp < end_timestamp,
+        ]
+        if level is not None:
+            conditions.append(column.resolution == level)
+        return (
+            select(
+                bucket,
+                volume.label("trading_volume"),
+                column.ticker_id,
+                array_agg(
+                    aggregate_order_by(column.close_price, column.timestamp.desc())
+                )[1].label("close_price"),
+                func.max(column.highest_price).label("highest_price"),
+                func.min(column.lowest_price).label("lowest_price"),
+                array_agg(
+                    aggregate_order_by(column.open_price, column.timestamp.asc())
+                )[1].label("open_price"),
+                func.coalesce(
+                    price_volume / func.nullif(volume, 0),
+                    func.avg(column.volume_weighted_average_price),
+                ).label("volume_weighted_average_price"),
+                func.sum(column.number_of_transactions).label("number_of_transactions"),
+            )
+            .where(and_(*conditions))
+            .group_by(column.ticker_id, bucket)
+        )
+
+    @classmethod
+    def refresh(
+        cls, ticker_id: int, first_timestamp: int, last_timestamp: int, db: Session
+    ):
+        """
+        Recompute every rollup bucket touching [first, last] from the level
+        below. Does not commit, so it lands in the transaction of the bars.
+        """
+        rollup = models.AggregationRollup
+        for resolution in ROLLUP_RESOLUTIONS:
+            buckets = cls.bucket_statement(
+                resolution=resolution,
+                ticker_id=ticker_id,
+                start_timestamp=bucket_start(first_timestamp, resolution),
+                end_timestamp=bucket_start(last_timestamp, resolution) + resolution,
+            ).add_columns(literal(resolution).label("resolution"))
+            statement = insert(rollup).from_select(
+                ["timestamp", "trading_volume", "ticker_id"]
+                + VALUE_FIELDS[1:]
+                + ["resolution"],
+                buckets,
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[rollup.ticker_id, rollup.resolution, rollup.timestamp],
+                set_={field: statement.excluded[field] for field in VALUE_FIELDS},
+            )
+            db.execute(statement)
+
+    @classmethod
+    def get_range(
+        cls,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        resolution: int,
+        db: Session,
+    ) -> np.ndarray:
+        """
+        Bars of any resolution whose bucket overlaps [start, end], read from
+        the stored rollup when there is one, else grouped from the coarsest
+        stored level that divides it.
+        """
+        start = bucket_start(start_timestamp, resolution)
+        end = bucket_start(end_timestamp, resolution) + resolution
+        if resolution in ROLLUP_RESOLUTIONS:
+            rollup = models.AggregationRollup
+            statement = select(
+                *[
+                    getattr(rollup, field)
+                    for field in ["timestamp", "ticker_id"] + VALUE_FIELDS
+                ]
+            ).where(
+                and_(
+                    rollup.ticker_id == ticker_id,
+                    rollup.resolution == resolution,
+                    rollup.timestamp >= start,
+                    rollup.timestamp < end,
+                )
+            )
+        else:
+            statement = cls.bucket_statement(
+                resolution=resolution,
+                ticker_id=ticker_id,
+                start_timestamp=start,
+                end_timestamp=end,
+            )
+        rows = db.execute(statement.order_by("timestamp")).mappings()
+        return np.array(
+            [tuple(row[name] for name in BAR_DTYPE.names) for row in rows],
+            dtype=BAR_DTYPE,
+        )
+
+    @classmethod
+    def rebuild(cls, db: Session, ticker_id: Optional[int] = None) -> int:
+        """Backfill the rollups of every covered ticker, committing per ticker."""
+        coverage = models.AggregationCoverage
+        statement = select(
+            coverage.ticker_id, coverage.first_ts, coverage.last_ts
+        ).where(coverage.last_ts != None)
+        if ticker_id is not None:
+            statement = statement.where(coverage.ticker_id == ticker_id)
+        tickers = db.execute(statement.order_by(coverage.ticker_id)).all()
+        for covered_ticker_id, first_ts, last_ts in tickers:
+            cls.refresh(
+                ticker_id=covered_ticker_id,
+                first_timestamp=first_ts,
+                last_timestamp=last_ts,
+                db=db,
+            )
+            db.commit()
+            logger.info(f"rebuilt rollups of ticker {covered_ticker_id}")
+        return len(tickers)
+
+
+aggregation_rollups = AggregationRollups()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage aggregation rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="recompute the rollups")
+    rebuild.add_argument("--ticker-id", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with postgres.sessionLocal() as db:
+        if args.command == "rebuild":
+            aggregation_rollups.rebuild(db=db, ticker_id=args.ticker_id)
+
+
+if __name__ == "__main__":
+    main()
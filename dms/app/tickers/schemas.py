@@ -1,4 +1,4 @@
-from datetime import date
+import datetime
 from typing import Optional
 
 from pydantic import BaseModel
@@ -13,8 +13,6 @@ class AggregationBase(BaseModel):
     timestamp: int
     trading_volume: float
     volume_weighted_average_price: float
-    from_date: date
-    to_date: date
     ticker_id: int
 
 
@@ -23,12 +21,23 @@ class AggregationCreate(AggregationBase):
 
 
 class Aggregation(AggregationBase):
-    id: int
-
     class Config:
         orm_mode = True
 
 
+class AggregationBatchRequest(BaseModel):
+    symbols: list[str]
+    start_date: str
+    end_date: str
+    resolution: Optional[str] = None
+
+
+class BackfillRequest(BaseModel):
+    start_date: datetime.date
+    end_date: Optional[datetime.date] = None
+    symbols: Optional[list[str]] = None
+
+
 class TickerBase(BaseModel):
     ticker: str
     name: Optional[str] = None
@@ -50,9 +59,12 @@ class TickerUpdate(TickerBase):
     pass
 
 
-class Ticker(TickerBase):
+class TickerSummary(TickerBase):
     id: int
-    aggregations: list[Aggregation] = []
 
     class Config:
         orm_mode = True
+
+
+class Ticker(TickerSummary):
+    aggregations: list[Aggregation] = []
@@ -0,0 +1,138 @@
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .rollups import DAY, bucket_start
+from .ticker_index import ticker_index
+
+DAILY_DTYPE = np.dtype(
+    [
+        ("ticker_id", "<i4"),
+        ("timestamp", "<i8"),
+        ("open_price", "<f8"),
+        ("close_price", "<f8"),
+        ("trading_volume", "<f8"),
+        ("volume_weighted_average_price", "<f8"),
+    ]
+)
+METRICS = ["change", "volume", "vwap_deviation"]
+ORDERS = ["asc", "desc"]
+MAX_DAYS = 366
+
+
+class Screener:
+    """
+    Ranks the whole universe over the last `days` daily rollups. The window
+    is read in one index-only scan and every statistic is computed with
+    array operations over all tickers at once: change is the last close
+    against the first open, volume the sum, and VWAP deviation the last close
+    against the volume-weighted VWAP of the window, both in percent.
+    """
+
+    @staticmethod
+    def latest_day(db: Session) -> Optional[int]:
+        last_ts = db.scalar(select(func.max(models.AggregationCoverage.last_ts)))
+        return bucket_start(last_ts, DAY) if last_ts is not None else None
+
+    @staticmethod
+    def load_days(start_timestamp: int, end_timestamp: int, db: Session) -> np.ndarray:
+        rollup = models.AggregationRollup
+        statement = (
+            select(*[getattr(rollup, name) for name in DAILY_DTYPE.names])
+            .where(
+                and_(
+                    rollup.resolution == DAY,
+                    rollup.timestamp >= start_timestamp,
+                    rollup.timestamp <= end_timestamp,
+                )
+            )
+            .order_by(rollup.ticker_id, rollup.timestamp)
+        )
+        rows = [tuple(row) for row in db.execute(statement)]
+        return np.array(rows, dtype=DAILY_DTYPE)
+
+    @staticmethod
+    def statistics(days: np.ndarray) -> dict:
+        """Per-ticker statistics of daily rows sorted by ticker then day."""
+        ticker_ids, first = np.unique(days["ticker_id"], return_index=True)
+        last = np.append(first[1:], len(days)) - 1
+        volume = np.add.reduceat(days["trading_volume"], first)
+        price_volume = np.add.reduceat(
+            days["volume_weighted_average_price"] * days["trading_volume"], first
+        )
+        open_price = days["open_price"][first]
+        close_price = days["close_price"][last]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vwap = np.where(volume > 0, price_volume / volume, np.nan)
+            change = (close_price - open_price) / open_price * 100
+            vwap_deviation = (close_price - vwap) / vwap * 100
+        return {
+            "ticker_id": ticker_ids,
+            "open_price": open_price,
+            "close_price": close_price,
+            "volume": volume,
+            "vwap": vwap,
+            "change": change,
+            "vwap_deviation": vwap_deviation,
+        }
+
+    def screen(
+        self,
+        db: Session,
+        metric: str = "change",
+        order: str = "desc",
+        days: int = 1,
+        limit: int = 20,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_volume: Optional[float] = None,
+    ) -> list[dict]:
+        if metric not in METRICS:
+            raise ValueError(
+                f"Invalid metric {metric}. Expected one of {', '.join(METRICS)}."
+            )
+        if order not in ORDERS:
+            raise ValueError(f"Invalid order {order}. Expected asc or desc.")
+        if not 1 <= days <= MAX_DAYS:
+            raise ValueError(f"Expected between 1 and {MAX_DAYS} days.")
+        end_timestamp = self.latest_day(db=db)
+        if end_timestamp is None:
+            return []
+        rows = self.load_days(
+            start_timestamp=end_timestamp - (days - 1) * DAY,
+            end_timestamp=end_timestamp,
+            db=db,
+        )
+        if not len(rows):
+            return []
+        statistics = self.statistics(rows)
+        keep = np.isfinite(statistics[metric])
+        if min_price is not None:
+            keep &= statistics["close_price"] >= min_price
+        if max_price is not None:
+            keep &= statistics["close_price"] <= max_price
+        if min_volume is not None:
+            keep &= statistics["volume"] >= min_volume
+        candidates = np.flatnonzero(keep)
+        values = statistics[metric][candidates]
+        order_values = -values if order == "desc" else values
+        ranked = candidates[np.argsort(order_values, kind="stable")][:limit]
+        ticker_ids = statistics["ticker_id"][ranked].tolist()
+        symbols = ticker_index.get_ticker_symbols(ticker_ids=ticker_ids, db=db)
+        columns = [name for name in statistics if name != "ticker_id"]
+        results = []
+        for index, ticker_id in zip(ranked, ticker_ids):
+            if ticker_id not in symbols:
+                continue
+            result = {"ticker": symbols[ticker_id]}
+            for name in columns:
+                value = statistics[name][index].item()
+                result[name] = value if np.isfinite(value) else None
+            results.append(result)
+        return results
+
+
+screener = Screener()
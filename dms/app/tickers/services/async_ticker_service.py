@@ -0,0 +1,151 @@
+from typing import Callable, Iterator, Optional, Union
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...postgres import postgres
+from ...tickers.schemas import (
+    Aggregation,
+    AggregationBatchRequest,
+    Ticker,
+    TickerCreate,
+    TickerSummary,
+    TickerUpdate,
+)
+from ..rollups import BAR_SECONDS, parse_resolution
+from ..ticker_getter import async_ticker_getter
+from ..ticker_setter import async_ticker_setter
+from . import ticker_service
+
+
+async def get_ticker_by_id(
+    ticker_id: int, db: AsyncSession, include_aggregations: bool = False
+) -> Union[TickerSummary, Ticker]:
+    ticker = await async_ticker_getter.get_ticker_by_id(
+        ticker_id=ticker_id, db=db, include_aggregations=include_aggregations
+    )
+    schema = Ticker if include_aggregations else TickerSummary
+    return schema.model_validate(ticker, from_attributes=True)
+
+
+async def get_ticker_by_symbol(
+    ticker: str, db: AsyncSession, include_aggregations: bool = False
+) -> Union[TickerSummary, Ticker]:
+    db_ticker = await async_ticker_getter.get_ticker_by_symbol(
+        ticker_symbol=ticker, db=db, include_aggregations=include_aggregations
+    )
+    schema = Ticker if include_aggregations else TickerSummary
+    return schema.model_validate(db_ticker, from_attributes=True)
+
+
+async def get_tickers(
+    limit: int,
+    offset: int,
+    db: AsyncSession,
+    after: Optional[str] = None,
+    order_by: str = "id",
+    include_aggregations: bool = False,
+) -> list[Union[TickerSummary, Ticker]]:
+    tickers = await async_ticker_getter.get_tickers(
+        limit=limit,
+        offset=offset,
+        db=db,
+        after=after,
+        order_by=order_by,
+        include_aggregations=include_aggregations,
+    )
+    schema = Ticker if include_aggregations else TickerSummary
+    return [schema.model_validate(ticker, from_attributes=True) for ticker in tickers]
+
+
+async def create_ticker(ticker: TickerCreate, db: AsyncSession) -> Ticker:
+    return await async_ticker_setter.create_ticker(ticker=ticker, db=db)
+
+
+async def update_ticker(
+    ticker_id: int, ticker: TickerUpdate, db: AsyncSession
+) -> TickerSummary:
+    db_ticker = await async_ticker_setter.update_ticker(
+        ticker_id=ticker_id, ticker=ticker, db=db
+    )
+    return TickerSummary.model_validate(db_ticker, from_attributes=True)
+
+
+async def delete_ticker(ticker_id: int, db: AsyncSession) -> TickerSummary:
+    db_ticker = await async_ticker_setter.delete_ticker(ticker_id=ticker_id, db=db)
+    return TickerSummary.model_validate(db_ticker, from_attributes=True)
+
+
+async def get_ticker_aggregations(
+    ticker: str,
+    start_date: str,
+    end_date: str,
+    db: AsyncSession,
+    resolution: Optional[str] = None,
+) -> list[Aggregation]:
+    seconds = parse_resolution(resolution) if resolution else BAR_SECONDS
+    if seconds == BAR_SECONDS:
+        return await async_ticker_getter.get_ticker_aggregations(
+            ticker=ticker, start_date=start_date, end_date=end_date, db=db
+        )
+    return await async_ticker_getter.get_ticker_rollups(
+        ticker=ticker,
+        start_date=start_date,
+        end_date=end_date,
+        resolution=seconds,
+        db=db,
+    )
+
+
+def with_session(function: Callable, **kwargs):
+    """
+    Call a ticker_service function on a sync session of its own. The Redis
+    caches and the numpy work behind it block, so it runs in the threadpool.
+    """
+    with postgres.sessionLocal() as db:
+        return function(db=db, **kwargs)
+
+
+async def get_ticker_snapshot(tickers: Optional[list[str]] = None) -> list[dict]:
+    return await run_in_threadpool(
+        with_session, ticker_service.get_ticker_snapshot, tickers=tickers
+    )
+
+
+async def get_ticker_latest_bar(ticker: str) -> dict:
+    return await run_in_threadpool(
+        with_session, ticker_service.get_ticker_latest_bar, ticker=ticker
+    )
+
+
+async def screen_tickers(**kwargs) -> list[dict]:
+    return await run_in_threadpool(
+        with_session, ticker_service.screen_tickers, **kwargs
+    )
+
+
+async def get_ticker_indicators(
+    ticker: str,
+    start_date: str,
+    end_date: str,
+    indicators: str,
+    resolution: Optional[str] = None,
+) -> list[dict]:
+    return await run_in_threadpool(
+        with_session,
+        ticker_service.get_ticker_indicators,
+        ticker=ticker,
+        start_date=start_date,
+        end_date=end_date,
+        indicators=indicators,
+        resolution=resolution,
+    )
+
+
+async def batch_ticker_aggregations(
+    request: AggregationBatchRequest,
+) -> tuple[Iterator[bytes], list[str]]:
+    """The symbols are resolved here, the stream reads on a session of its own."""
+    return await run_in_threadpool(
+        with_session, ticker_service.batch_ticker_aggregations, request=request
+    )
@@ -0,0 +1,105 @@
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..rollups import BAR_SECONDS, parse_resolution
+from ..ticker_getter import async_ticker_getter, validate_date
+
+ARROW = "arrow"
+PARQUET = "parquet"
+MEDIA_TYPES = {
+    ARROW: "application/vnd.apache.arrow.stream",
+    PARQUET: "application/vnd.apache.parquet",
+}
+COLUMN_TYPES = {
+    "timestamp": pa.int64(),
+    "open_price": pa.float64(),
+    "highest_price": pa.float64(),
+    "lowest_price": pa.float64(),
+    "close_price": pa.float64(),
+    "volume_weighted_average_price": pa.float64(),
+    "trading_volume": pa.float64(),
+    "number_of_transactions": pa.int32(),
+}
+
+
+def negotiate_format(format: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """Pick a columnar format from `?format=` first, then from the Accept header."""
+    if format:
+        if format not in MEDIA_TYPES:
+            raise ValueError(
+                f"Invalid format {format}. Expected one of {', '.join(MEDIA_TYPES)}."
+            )
+        return format
+    for name, media_type in MEDIA_TYPES.items():
+        if accept and media_type in accept:
+            return name
+    return None
+
+
+def read_table(csv_content: BytesIO) -> pa.Table:
+    return pa_csv.read_csv(
+        csv_content,
+        convert_options=pa_csv.ConvertOptions(column_types=COLUMN_TYPES),
+    )
+
+
+def bars_to_table(bars: np.ndarray) -> pa.Table:
+    return pa.table(
+        {name: pa.array(bars[name], type=type) for name, type in COLUMN_TYPES.items()}
+    )
+
+
+def serialize_table(table: pa.Table, format: str) -> bytes:
+    output = BytesIO()
+    if format == PARQUET:
+        pq.write_table(table, output)
+    else:
+        with pa.ipc.new_stream(output, table.schema) as writer:
+            writer.write_table(table)
+    return output.getvalue()
+
+
+async def async_export_ticker_aggregations(
+    ticker: str,
+    start_date: str,
+    end_date: str,
+    format: str,
+    db: AsyncSession,
+    resolution: Optional[str] = None,
+) -> bytes:
+    """
+    A range of bars as Arrow or Parquet: the raw bars dumped with COPY on
+    asyncpg, coarser resolutions read from the rollups.
+    """
+    start_timestamp = validate_date(start_date)
+    end_timestamp = validate_date(end_date)
+    ticker_id = await async_ticker_getter.get_ticker_id(ticker_symbol=ticker, db=db)
+    seconds = parse_resolution(resolution) if resolution else BAR_SECONDS
+    if seconds != BAR_SECONDS:
+        bars = await async_ticker_getter.get_rollup_bars(
+            ticker_id=ticker_id,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            resolution=seconds,
+            db=db,
+        )
+        return await run_in_threadpool(
+            lambda: serialize_table(table=bars_to_table(bars), format=format)
+        )
+    csv_content = await async_ticker_getter.copy_ticker_aggregations(
+        ticker_id=ticker_id,
+        start_timestamp=start_timestamp,
+        end_timestamp=end_timestamp,
+        columns=list(COLUMN_TYPES),
+        db=db,
+    )
+    return await run_in_threadpool(
+        lambda: serialize_table(table=read_table(csv_content), format=format)
+    )
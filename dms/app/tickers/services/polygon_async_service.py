@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import random
+from typing import Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+
+from ...postgres import postgres
+from ...rate_limiter import TokenBucket
+from ...settings.polygon_settings import polygon_settings
+from .polygon_service import polygon_client
+
+logger = logging.getLogger("uvicorn")
+POLYGON_RATE_LIMIT = "polygon_rate_limit"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AsyncPolygonClient:
+    """
+    Fetches many ticker windows concurrently over one pooled keep-alive
+    connection pool, under a token bucket in Redis shared by every request of
+    every process using the API key. Parsing and database writes run in the
+    threadpool so the event loop is never blocked.
+    """
+
+    def __init__(self):
+        self.headers: dict = polygon_client.headers
+        self.rate_limiter = TokenBucket(
+            key=POLYGON_RATE_LIMIT,
+            rate=polygon_settings.POLYGON_RATE_LIMIT,
+            capacity=polygon_settings.POLYGON_RATE_BURST,
+        )
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=polygon_settings.POLYGON_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=polygon_settings.POLYGON_CONCURRENCY,
+                    max_keepalive_connections=polygon_settings.POLYGON_CONCURRENCY,
+                ),
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def fetch(self, url: str) -> dict:
+        client = self.get_client()
+        for attempt in range(polygon_settings.POLYGON_MAX_RETRIES + 1):
+            await self.rate_limiter.acquire()
+            try:
+                response = await client.get(url)
+            except httpx.TransportError:
+                if attempt == polygon_settings.POLYGON_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            if (
+                response.status_code in RETRY_STATUS_CODES
+                and attempt < polygon_settings.POLYGON_MAX_RETRIES
+            ):
+                delay = self.retry_after(response) or self.backoff(attempt)
+                if response.status_code == 429:
+                    await self.rate_limiter.pause(delay)
+                logger.info(
+                    f"Polygon answered {response.status_code}, retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    @staticmethod
+    def retry_after(response: httpx.Response) -> Optional[float]:
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        return min(60.0, 2**attempt) + random.uniform(0, 1)
+
+    async def get_aggregations(self):
+        params_list = await run_in_threadpool(self.generate_batch_request_params)
+        await asyncio.gather(*[self.ingest_window(params) for params in params_list])
+
+    @staticmethod
+    def generate_batch_request_params() -> list[dict]:
+        db = postgres.sessionLocal()
+        try:
+            return polygon_client.generate_batch_request_params(
+                db=db, size=polygon_settings.POLYGON_CONCURRENCY
+            )
+        finally:
+            db.close()
+
+    async def ingest_window(self, params: dict):
+        if polygon_client.is_weekend_window(params):
+            await run_in_threadpool(polygon_client.mark_computed, params)
+            return
+        try:
+            response = await self.fetch(polygon_client.build_aggregations_url(params))
+            await run_in_threadpool(
+                polygon_client.store_aggregations, params=params, response=response
+            )
+        except httpx.HTTPStatusError as http_err:
+            logger.error(f"HTTP error occurred: {http_err}")
+        except httpx.RequestError as req_err:
+            logger.error(f"Request error occurred: {req_err}")
+
+
+async_polygon_client = AsyncPolygonClient()
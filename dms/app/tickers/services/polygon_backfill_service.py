@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import time
+import uuid
+from typing import Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
+
+from ...exceptions.exceptions import BackfillJobNotFoundException
+from ...postgres import postgres
+from ...redis import redis_client
+from ...settings.polygon_settings import polygon_settings
+from ..partitions import aggregation_partitions
+from ..ticker_getter import ticker_getter
+from ..ticker_index import ticker_index
+from . import ticker_service
+from .polygon_async_service import async_polygon_client
+from .polygon_service import STARTING_DATE, TIMELAPSE_CONFIG, polygon_client
+
+logger = logging.getLogger("uvicorn")
+BACKFILL_JOB = "backfill:{job_id}"
+BACKFILL_DONE = "backfill:{job_id}:done"
+BACKFILL_LOCK = "backfill:{job_id}:lock"
+BACKFILL_QUEUE = "backfill_queue"
+BACKFILL_QUEUE_WAIT = 1.0
+BACKFILL_JOB_TTL = 30 * 24 * 60 * 60
+BACKFILL_LOCK_TTL_MS = 10 * 60 * 1000
+# Polygon applies the limit to the minute bars the 10 minute bars are built
+# from, a window of 34 days of minutes around the clock fits in one page.
+BACKFILL_PAGE_LIMIT = 50000
+BACKFILL_WINDOW_DAYS = BACKFILL_PAGE_LIMIT // (24 * 60)
+
+
+class PolygonBackfill:
+    """
+    Loads a date range of history for many tickers at once. The range of each
+    ticker is split into windows of the largest size Polygon returns in one
+    page, and a pool of POLYGON_CONCURRENCY workers fetches them through the
+    shared rate limited client and writes them through the bulk upsert.
+
+    A job lives in Redis: its parameters and counters in a hash, the windows
+    already written in a set, so a crashed or stopped job resumes where it
+    was. The API only queues jobs, `python -m app.worker` runs them one at a
+    time. A lock renewed as windows complete keeps a job from running twice.
+    Progress is only moved forward, and only when the backfilled range
+    continues it without a gap, so the regular ingestion of a ticker neither
+    goes back to dates the backfill wrote nor skips the dates before them.
+    """
+
+    def start(
+        self,
+        start_date: datetime.date,
+        end_date: Optional[datetime.date] = None,
+        symbols: Optional[list[str]] = None,
+    ) -> str:
+        end_date = end_date or datetime.date.today() - datetime.timedelta(days=1)
+        if end_date < start_date:
+            raise ValueError("The end date of a backfill is before its start date.")
+        job_id = uuid.uuid4().hex
+        redis_client.set_hash(
+            BACKFILL_JOB.format(job_id=job_id),
+            {
+                "status": "pending",
+                "start_date": f"{start_date}",
+                "end_date": f"{end_date}",
+                "symbols": json.dumps(symbols),
+                "created_at": int(time.time()),
+            },
+            ttl=BACKFILL_JOB_TTL,
+        )
+        return job_id
+
+    def enqueue(self, job_id: str):
+        """Queue a job for the worker, refusing a job that runs."""
+        self.get_job(job_id)
+        if redis_client.get(BACKFILL_LOCK.format(job_id=job_id)):
+            raise ValueError(f"Backfill {job_id} is already running.")
+        redis_client.set_hash(BACKFILL_JOB.format(job_id=job_id), {"status": "pending"})
+        redis_client.add_to_list(BACKFILL_QUEUE, job_id)
+
+    async def consume(self):
+        """Run the queued jobs one after the other, in app.worker."""
+        while True:
+            # A short pop rather than a blocking one, a thread still blocked
+            # when the worker stops would take a job nobody runs.
+            job_id = await run_in_threadpool(redis_client.pop_from_list, BACKFILL_QUEUE)
+            if job_id is None:
+                await asyncio.sleep(BACKFILL_QUEUE_WAIT)
+                continue
+            try:
+                token = await run_in_threadpool(self.lock, job_id)
+            except (ValueError, BackfillJobNotFoundException) as e:
+                logger.warning(f"Skipped backfill {job_id}: {e}")
+                continue
+            try:
+                await self.run(job_id=job_id, token=token)
+            except Exception:
+                logger.exception(f"Backfill {job_id} failed")
+
+    def lock(self, job_id: str) -> str:
+        """Take the lock of a job before running it, refusing a job that runs."""
+        self.get_job(job_id)
+        token = uuid.uuid4().hex
+        if not redis_client.acquire_lease(
+            BACKFILL_LOCK.format(job_id=job_id), token, BACKFILL_LOCK_TTL_MS
+        ):
+            raise ValueError(f"Backfill {job_id} is already running.")
+        return token
+
+    def get_job(self, job_id: str) -> dict:
+        job = redis_client.get_hash(BACKFILL_JOB.format(job_id=job_id))
+        if not job:
+            raise BackfillJobNotFoundException(job_id=job_id)
+        job["symbols"] = json.loads(job["symbols"])
+        return {"job_id": job_id, **job}
+
+    async def run(self, job_id: str, token: str):
+        try:
+            await self.run_locked(job_id=job_id, token=token)
+        finally:
+            await run_in_threadpool(
+                redis_client.release_lease, BACKFILL_LOCK.format(job_id=job_id), token
+            )
+
+    async def run_locked(self, job_id: str, token: str):
+        job = await run_in_threadpool(self.get_job, job_id)
+        key = BACKFILL_JOB.format(job_id=job_id)
+        lock_key = BACKFILL_LOCK.format(job_id=job_id)
+        start_date = datetime.date.fromisoformat(job["start_date"])
+        end_date = datetime.date.fromisoformat(job["end_date"])
+        await run_in_threadpool(self.ensure_partitions, start_date)
+        tickers = await run_in_threadpool(self.resolve_tickers, job["symbols"])
+        done = set(
+            await run_in_threadpool(
+                redis_client.get_set_members, BACKFILL_DONE.format(job_id=job_id)
+            )
+        )
+        windows = [
+            window
+            for ticker_id, ticker in tickers
+            for window in self.split(ticker_id, ticker, start_date, end_date)
+        ]
+        pending = [window for window in windows if window_key(window) not in done]
+        await run_in_threadpool(
+            redis_client.set_hash,
+            key,
+            {
+                "status": "running",
+                "tickers": len(tickers),
+                "windows": len(windows),
+                "windows_done": len(windows) - len(pending),
+                "errors": 0,
+                "resumed_at": int(time.time()),
+            },
+            ttl=BACKFILL_JOB_TTL,
+        )
+        queue: asyncio.Queue = asyncio.Queue()
+        for window in pending:
+            queue.put_nowait(window)
+        started_at = time.monotonic()
+        counters = {"bars": 0}
+        failed = set()
+
+        async def worker():
+            while not queue.empty():
+                window = queue.get_nowait()
+                if not await run_in_threadpool(
+                    redis_client.renew_lease, lock_key, token, BACKFILL_LOCK_TTL_MS
+                ):
+                    raise RuntimeError(f"Backfill {job_id} lost its lock.")
+                bars = await self.backfill_window(job_id=job_id, window=window)
+                if bars is None:
+                    failed.add(window["ticker"])
+                    continue
+                counters["bars"] += bars
+                elapsed = max(time.monotonic() - started_at, 1e-9)
+                await run_in_threadpool(
+                    redis_client.set_hash,
+                    key,
+                    {"bars_per_second": round(counters["bars"] / elapsed, 1)},
+                )
+
+        workers = min(polygon_settings.POLYGON_CONCURRENCY, len(pending))
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            await run_in_threadpool(
+                redis_client.set_hash, key, {"status": "failed", "last_error": str(e)}
+            )
+            raise
+        finally:
+            # gather leaves the other workers running when one raises.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        completed = [ticker for _, ticker in tickers if ticker not in failed]
+        await run_in_threadpool(self.advance_progress, completed, start_date, end_date)
+        elapsed = max(time.monotonic() - started_at, 1e-9)
+        status = "failed" if failed else "done"
+        await run_in_threadpool(
+            redis_client.set_hash,
+            key,
+            {
+                "status": status,
+                "finished_at": int(time.time()),
+                "bars_per_second": round(counters["bars"] / elapsed, 1),
+            },
+        )
+        logger.info(
+            f"Backfill {job_id} {status}: {counters['bars']} bars from "
+            f"{len(pending)} windows in {elapsed:.1f}s "
+            f"({counters['bars'] / elapsed:.1f} bars/s)"
+        )
+
+    @staticmethod
+    def split(
+        ticker_id: int,
+        ticker: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+    ) -> list[dict]:
+        windows = []
+        from_date = start_date
+        while from_date <= end_date:
+            to_date = min(
+                from_date + datetime.timedelta(days=BACKFILL_WINDOW_DAYS - 1), end_date
+            )
+            windows.append(
+                {
+                    "ticker_id": ticker_id,
+                    "ticker": ticker,
+                    "from_date": from_date,
+                    "to_date": to_date,
+                    "timespan": TIMELAPSE_CONFIG["default"]["timespan"],
+                    "multiplier": TIMELAPSE_CONFIG["default"]["multiplier"],
+                }
+            )
+            from_date = to_date + datetime.timedelta(days=1)
+        return windows
+
+    async def backfill_window(self, job_id: str, window: dict) -> Optional[int]:
+        """
+        Fetch every page of a window and write it. Returns the bars written,
+        or None when the window failed and is left for a resume.
+        """
+        url = (
+            f"{polygon_client.build_aggregations_url(window)}"
+            f"&limit={BACKFILL_PAGE_LIMIT}"
+        )
+        results = []
+        try:
+            while url:
+                response = await async_polygon_client.fetch(url)
+                results += response.get("results") or []
+                url = response.get("next_url")
+            written = await run_in_threadpool(self.store_window, window, results)
+        except (httpx.HTTPError, SQLAlchemyError) as e:
+            logger.error(f"Backfill of {window_key(window)} failed: {e}")
+            await run_in_threadpool(self.record_failure, job_id, window, e)
+            return None
+        await run_in_threadpool(self.record_window, job_id, window, written)
+        return written
+
+    @staticmethod
+    def record_window(job_id: str, window: dict, written: int):
+        redis_client.add_to_set(
+            BACKFILL_DONE.format(job_id=job_id),
+            window_key(window),
+            ttl=BACKFILL_JOB_TTL,
+        )
+        redis_client.increment_hash(
+            BACKFILL_JOB.format(job_id=job_id), {"windows_done": 1, "bars": written}
+        )
+
+    @staticmethod
+    def record_failure(job_id: str, window: dict, error: Exception):
+        key = BACKFILL_JOB.format(job_id=job_id)
+        redis_client.increment_hash(key, {"errors": 1})
+        redis_client.set_hash(key, {"last_error": f"{window_key(window)}: {error}"})
+
+    @staticmethod
+    def store_window(window: dict, results: list[dict]) -> int:
+        with postgres.sessionLocal() as db:
+            if not results:
+                ticker_service.record_empty_window(
+                    ticker_id=window["ticker_id"],
+                    from_date=window["from_date"],
+                    to_date=window["to_date"],
+                    db=db,
+                )
+                return 0
+            return ticker_service.create_aggregations(
+                aggregations=polygon_client.parse_aggregations(
+                    ticker_id=window["ticker_id"], results=results
+                ),
+                db=db,
+                from_date=window["from_date"],
+                to_date=window["to_date"],
+            )
+
+    @staticmethod
+    def resolve_tickers(symbols: Optional[list[str]]) -> list[tuple[int, str]]:
+        with postgres.sessionLocal() as db:
+            if symbols is None:
+                return ticker_getter.get_active_tickers(db=db)
+            ids = ticker_index.get_ticker_ids(ticker_symbols=symbols, db=db)
+        return [(ticker_id, symbol) for symbol, ticker_id in ids.items()]
+
+    @staticmethod
+    def ensure_partitions(start_date: datetime.date):
+        with postgres.engine.begin() as conn:
+            aggregation_partitions.ensure_partitions(conn, start=start_date)
+
+    @staticmethod
+    def advance_progress(
+        tickers: list[str], start_date: datetime.date, end_date: datetime.date
+    ):
+        first_date = datetime.date.fromisoformat(STARTING_DATE)
+        for ticker in tickers:
+            redis_client.advance_ticker_progress(
+                ticker=ticker,
+                from_date=start_date,
+                last_date=end_date,
+                first_date=first_date,
+            )
+
+
+def window_key(window: dict) -> str:
+    return f"{window['ticker']}:{window['from_date']}"
+
+
+polygon_backfill = PolygonBackfill()
+
+
+async def run_backfill(job_id: str, token: str):
+    try:
+        await polygon_backfill.run(job_id=job_id, token=token)
+    finally:
+        await async_polygon_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill aggregations from Polygon")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    start = subparsers.add_parser("start", help="backfill a date range")
+    start.add_argument("start_date", type=datetime.date.fromisoformat)
+    start.add_argument("--end-date", type=datetime.date.fromisoformat, default=None)
+    start.add_argument(
+        "--symbols", default=None, help="comma separated, every active ticker if unset"
+    )
+    resume = subparsers.add_parser("resume", help="resume a stopped backfill")
+    resume.add_argument("job_id")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "start":
+        job_id = polygon_backfill.start(
+            start_date=args.start_date,
+            end_date=args.end_date,
+            symbols=args.symbols.split(",") if args.symbols else None,
+        )
+        logger.info(f"Started backfill {job_id}")
+    else:
+        job_id = args.job_id
+    token = polygon_backfill.lock(job_id=job_id)
+    asyncio.run(run_backfill(job_id=job_id, token=token))
+
+
+if __name__ == "__main__":
+    main()
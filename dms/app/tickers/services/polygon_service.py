@@ -4,14 +4,16 @@ import logging
 from typing import Optional
 
 import requests
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
+from ...exceptions.exceptions import TickerNotFoundException
 from ...postgres import postgres
-from ...redis import redis_client
+from ...redis import AGGREGATIONS_CHANNEL, redis_client
 from ...settings.polygon_settings import polygon_settings
 from ..schemas import AggregationCreate, TickerCreate
 from ..ticker_getter import ticker_getter
+from ..ticker_index import ticker_index
 from . import ticker_service
 
 logger = logging.getLogger("uvicorn")
@@ -52,29 +54,26 @@ class PolygonClient:
             response = requests.get(url, headers=self.headers)
             response.raise_for_status()
             response = response.json()
-            db: Session = postgres.sessionLocal()
 
             output = {
                 "success": [],
                 "fails": [],
             }
-            for result in response["results"]:
-                ticker: TickerCreate = TickerCreate(**result)
+            tickers: list[TickerCreate] = [
+                TickerCreate(**result) for result in response["results"]
+            ]
+            with postgres.sessionLocal() as db:
                 try:
-                    ticker_service.create_ticker(ticker=ticker, db=db)
-                    output["success"].append({"ticker": ticker.ticker})
-                except IntegrityError as e:
-                    output["fails"].append(
-                        {
-                            "ticker": ticker.ticker,
-                            "message": f"Ticker creation failed: This ticker already exists. {str(e)}",
-                        }
-                    )
+                    changed = ticker_service.upsert_tickers(tickers=tickers, db=db)
+                    output["success"] = [
+                        {"ticker": ticker["ticker"]} for ticker in changed
+                    ]
                 except SQLAlchemyError as e:
+                    db.rollback()
                     output["fails"].append(
                         {
-                            "ticker": ticker.ticker,
-                            "message": f"Ticker creation failed: An error occurred while inserting the Ticker. {str(e)}",
+                            "tickers": len(tickers),
+                            "message": f"Ticker upsert failed: An error occurred while inserting the Tickers. {str(e)}",
                         }
                     )
             logger.info(json.dumps(output, indent=4))
@@ -91,117 +90,180 @@ class PolygonClient:
         except requests.exceptions.RequestException as req_err:
             print(f"Request error occurred: {req_err}")
 
-    def get_aggregations(
-        self,
-    ):
-        db: Session = postgres.sessionLocal()
-        params = self.generate_request_params(db=db)
-        if params is None:
-            return
-        url: str = (
-            f"{self.api_url}v2/aggs/ticker/{params['ticker']}/range/{params['multiplier']}/{params['timespan']}/{params['from_date']}/{params['to_date']}?adjusted=true&sort=asc"
+    def build_aggregations_url(self, params: dict) -> str:
+        return f"{self.api_url}v2/aggs/ticker/{params['ticker']}/range/{params['multiplier']}/{params['timespan']}/{params['from_date']}/{params['to_date']}?adjusted=true&sort=asc"
+
+    @staticmethod
+    def is_weekend_window(params: dict) -> bool:
+        return (
+            params["from_date"] == params["to_date"]
+            and params["from_date"].weekday() >= 5
         )
-        if params["from_date"] == params["to_date"] and params["from_date"].weekday() >= 5:
-            computed_aggregations = redis_client.get_computed_aggregations(
-                key="computed_aggregations"
-            )
-            computed_aggregations[params["ticker"]] = f'{params["to_date"]}'
-            redis_client.set_computed_aggregations(
-                key="computed_aggregations", computed_aggregations=computed_aggregations
-            )
-            return
-        try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            response = response.json()
-            db: Session = postgres.sessionLocal()
-            output = {
-                "success": [],
-                "fails": [],
-            }
+
+    @staticmethod
+    def mark_computed(params: dict):
+        redis_client.set_ticker_progress(
+            ticker=params["ticker"], last_date=params["to_date"]
+        )
+
+    def store_aggregations(self, params: dict, response: dict):
+        output = {
+            "success": [],
+            "fails": [],
+        }
+        with postgres.sessionLocal() as db:
             if response["resultsCount"] > 0:
-                for result in response["results"]:
-                    aggregation: AggregationCreate = AggregationCreate(
-                        **{
-                            "close_price": result.get("c", 0),
-                            "highest_price": result.get("h", 0),
-                            "lowest_price": result.get("l", 0),
-                            "number_of_transactions": result.get("n", 0),
-                            "open_price": result.get("o", 0),
-                            "timestamp": result.get("t", 0) // 1000,
-                            "trading_volume": result.get("v", 0),
-                            "volume_weighted_average_price": result.get("vw", 0),
-                            "from_date": params["from_date"],
-                            "to_date": params["to_date"],
-                            "ticker_id": params["ticker_id"],
+                aggregations = self.parse_aggregations(
+                    ticker_id=params["ticker_id"], results=response["results"]
+                )
+                try:
+                    written = ticker_service.create_aggregations(
+                        aggregations=aggregations,
+                        db=db,
+                        from_date=params["from_date"],
+                        to_date=params["to_date"],
+                    )
+                    output["success"].append(
+                        {
+                            "ticker": params["ticker_id"],
+                            "received": len(aggregations),
+                            "written": written,
                         }
                     )
-                    try:
-                        ticker_service.create_aggregation(
-                            aggregation=aggregation, db=db
-                        )
-                        output["success"].append({"ticker": aggregation.ticker_id})
-                    except IntegrityError as e:
-                        output["fails"].append(
-                            {
-                                "aggregation": aggregation.ticker_id,
-                                "message": f"Aggregation creation failed: This Aggregation already exists. {str(e)}",
-                            }
-                        )
-                    except SQLAlchemyError as e:
-                        output["fails"].append(
-                            {
-                                "aggregation": aggregation.ticker_id,
-                                "message": f"Aggregation creation failed: An error occurred while inserting the Aggregation. {str(e)}",
-                            }
+                    if written:
+                        self.publish_aggregations(
+                            ticker=params["ticker"], aggregations=aggregations
                         )
+                    self.mark_computed(params)
+                except SQLAlchemyError as e:
+                    # The window stays claimed and is fetched again once the
+                    # claim expires.
+                    db.rollback()
+                    output["fails"].append(
+                        {
+                            "aggregation": params["ticker_id"],
+                            "message": f"Aggregation creation failed: An error occurred while inserting the Aggregations. {str(e)}",
+                        }
+                    )
             else:
-                redis_client.add_to_list(
-                    key="ticker_without_aggs", element=params["ticker"]
+                ticker_service.record_empty_window(
+                    ticker_id=params["ticker_id"],
+                    from_date=params["from_date"],
+                    to_date=params["to_date"],
+                    db=db,
                 )
-            computed_aggregations = redis_client.get_computed_aggregations(
-                key="computed_aggregations"
-            )
-            computed_aggregations[params["ticker"]] = f'{params["to_date"]}'
-            redis_client.set_computed_aggregations(
-                key="computed_aggregations", computed_aggregations=computed_aggregations
-            )
-            logger.info(f"Importing data of {params['ticker']} from {params['from_date']} to {params['to_date']}")
-            logger.info(json.dumps(output, indent=4))
+                self.mark_computed(params)
+        logger.info(
+            f"Importing data of {params['ticker']} from {params['from_date']} to {params['to_date']}"
+        )
+        logger.info(json.dumps(output, indent=4))
 
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")
-        except requests.exceptions.ConnectionError as conn_err:
-            print(f"Connection error occurred: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
-            print(f"Timeout error occurred: {timeout_err}")
-        except requests.exceptions.RequestException as req_err:
-            print(f"Request error occurred: {req_err}")
+    @staticmethod
+    def parse_aggregations(
+        ticker_id: int, results: list[dict]
+    ) -> list[AggregationCreate]:
+        return [
+            AggregationCreate(
+                **{
+                    "close_price": result.get("c", 0),
+                    "highest_price": result.get("h", 0),
+                    "lowest_price": result.get("l", 0),
+                    "number_of_transactions": result.get("n", 0),
+                    "open_price": result.get("o", 0),
+                    "timestamp": result.get("t", 0) // 1000,
+                    "trading_volume": result.get("v", 0),
+                    "volume_weighted_average_price": result.get("vw", 0),
+                    "ticker_id": ticker_id,
+                }
+            )
+            for result in results
+        ]
 
-    def generate_request_params(self, db: Session) -> Optional[dict]:
-        format = "%Y-%m-%d"
-        computed_aggregations = redis_client.get_computed_aggregations(
-            key="computed_aggregations"
+    @staticmethod
+    def publish_aggregations(ticker: str, aggregations: list[AggregationCreate]):
+        """Announce a committed batch to the stream subscribers of every process."""
+        redis_client.publish_message(
+            data={
+                "ticker": ticker,
+                "aggregations": [
+                    aggregation.dict(exclude={"ticker_id"})
+                    for aggregation in aggregations
+                ],
+            },
+            channel=AGGREGATIONS_CHANNEL,
         )
-        ticker_id, ticker, date = None, None, None
-        for ticker_symbol in computed_aggregations:
-            date = datetime.datetime.strptime(
-                computed_aggregations[ticker_symbol], format
-            ).date()
-            if date < datetime.datetime.now().date() - datetime.timedelta(days=1):
-                ticker = ticker_getter.get_ticker_by_symbol(
+
+    def generate_batch_request_params(self, db: Session, size: int) -> list[dict]:
+        """
+        Pick up to `size` distinct tickers to fetch next: tickers whose last
+        computed date is behind first, then tickers without any aggregation.
+        """
+        params = []
+        for ticker_symbol, date in redis_client.claim_due_tickers(limit=size):
+            try:
+                ticker_id = ticker_index.get_ticker_id(
                     ticker_symbol=ticker_symbol, db=db
                 )
-                ticker_id = ticker.id
-                ticker = ticker.ticker
-                break
-            date = None
-        if ticker is None and ticker_id is None and date is None:
-            ticker_id, ticker, date = ticker_getter.get_ticker_without_aggregation(
-                db=db
+            except TickerNotFoundException:
+                redis_client.unschedule_ticker(ticker=ticker_symbol)
+                continue
+            params.append(
+                self.build_request_params(
+                    ticker_id=ticker_id, ticker=ticker_symbol, date=date
+                )
             )
-        if ticker is None:
-            return None
+        new_tickers = ticker_getter.get_tickers_without_aggregation(
+            db=db, limit=size - len(params)
+        )
+        claimed_ids = ticker_service.claim_uncovered_tickers(
+            ticker_ids=[ticker_id for ticker_id, _, _ in new_tickers], db=db
+        )
+        new_tickers = {
+            ticker: ticker_id
+            for ticker_id, ticker, _ in new_tickers
+            if ticker_id in claimed_ids
+        }
+        # Scheduled before the claim commits: a crash in between leaves the
+        # ticker due in Redis rather than pending forever in coverage.
+        scheduled = redis_client.schedule_new_tickers(tickers=list(new_tickers))
+        db.commit()
+        for ticker in scheduled:
+            params.append(
+                self.build_request_params(
+                    ticker_id=new_tickers[ticker], ticker=ticker, date=None
+                )
+            )
+        return params
+
+    @staticmethod
+    def initialize_schedule():
+        """
+        Prepare the ingestion schedule on startup: migrate the legacy Redis blob,
+        backfill the coverage table of an existing database and, if Redis lost
+        the schedule or the latest-bar snapshot, rebuild them from the coverage
+        table.
+        """
+        redis_client.migrate_computed_aggregations()
+        db: Session = postgres.sessionLocal()
+        try:
+            if not ticker_getter.has_coverage(db=db):
+                ticker_service.rebuild_coverage(db=db)
+            if not redis_client.has_schedule():
+                redis_client.set_tickers_progress(
+                    ticker_getter.get_coverage_progress(db=db)
+                )
+            if not redis_client.has_latest_bars():
+                redis_client.set_latest_bars(
+                    ticker_getter.get_coverage_latest_bars(db=db)
+                )
+        finally:
+            db.close()
+
+    @staticmethod
+    def build_request_params(
+        ticker_id: int, ticker: str, date: Optional[datetime.date]
+    ) -> dict:
+        format = "%Y-%m-%d"
         from_date = (
             date if date else datetime.datetime.strptime(STARTING_DATE, format).date()
         )
@@ -1,49 +1,63 @@
 import csv
+import json
 import os
 import uuid
+import zlib
+from datetime import date
 from io import StringIO
+from typing import Iterable, Iterator, Optional
 
+import pandas as pd
 from sqlalchemy.orm import Session
 
+from ...exceptions.exceptions import TickerNotFoundException
+from ...postgres import postgres
 from ...redis import redis_client
 from ...tickers.schemas import (
     Aggregation,
+    AggregationBatchRequest,
     AggregationCreate,
-    Ticker,
     TickerCreate,
-    TickerUpdate,
 )
-from ..ticker_getter import ticker_getter
+from ..rollups import BAR_SECONDS, ROLLUP_RESOLUTIONS, parse_resolution
+from ..screener import screener
+from ..ticker_getter import ticker_getter, validate_date
+from ..ticker_index import ticker_index
 from ..ticker_setter import ticker_setter
-import pandas as pd
-
-
-def get_ticker_by_id(ticker_id: int, db: Session) -> Ticker:
-    return ticker_getter.get_ticker_by_id(ticker_id=ticker_id, db=db)
-
 
-def get_ticker_by_symbol(ticker: str, db: Session) -> Ticker:
-    return ticker_getter.get_ticker_by_symbol(ticker_symbol=ticker, db=db)
+EXPORT_FIELDS = [
+    field for field in Aggregation.__fields__.keys() if field not in ["ticker_id"]
+]
+BATCH_MAX_SYMBOLS = 200
 
 
-def get_tickers(limit: int, offset: int, db: Session) -> list[Ticker]:
-    return ticker_getter.get_tickers(limit=limit, offset=offset, db=db)
+def upsert_tickers(tickers: list[TickerCreate], db: Session) -> list[dict]:
+    return ticker_setter.upsert_tickers(tickers=tickers, db=db)
 
 
-def create_ticker(ticker: TickerCreate, db: Session) -> Ticker:
-    return ticker_setter.create_ticker(ticker=ticker, db=db)
+def create_aggregations(
+    aggregations: list[AggregationCreate],
+    db: Session,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+) -> int:
+    return ticker_setter.create_aggregations(
+        aggregations=aggregations, db=db, from_date=from_date, to_date=to_date
+    )
 
 
-def update_ticker(ticker_id: int, ticker: TickerUpdate, db: Session) -> Ticker:
-    return ticker_setter.update_ticker(ticker_id=ticker_id, ticker=ticker, db=db)
+def record_empty_window(ticker_id: int, from_date: date, to_date: date, db: Session):
+    return ticker_setter.record_empty_window(
+        ticker_id=ticker_id, from_date=from_date, to_date=to_date, db=db
+    )
 
 
-def delete_ticker(ticker_id: int, db: Session) -> Ticker:
-    return ticker_setter.delete_ticker(ticker_id=ticker_id, db=db)
+def claim_uncovered_tickers(ticker_ids: list[int], db: Session) -> list[int]:
+    return ticker_setter.claim_uncovered_tickers(ticker_ids=ticker_ids, db=db)
 
 
-def create_aggregation(aggregation: AggregationCreate, db: Session) -> Ticker:
-    return ticker_setter.create_aggregation(aggregation=aggregation, db=db)
+def rebuild_coverage(db: Session):
+    return ticker_setter.rebuild_coverage(db=db)
 
 
 def get_ticker_aggregations(
@@ -54,29 +68,178 @@ def get_ticker_aggregations(
     )
 
 
-def export_ticker_aggregations(
-    ticker: str, start_date: str, end_date: str, db: Session
-):
-    aggregations: list[Aggregation] = ticker_getter.get_ticker_aggregations(
-        ticker=ticker, start_date=start_date, end_date=end_date, db=db
+def get_ticker_snapshot(db: Session, tickers: Optional[list[str]] = None) -> list[dict]:
+    return ticker_getter.get_ticker_snapshot(db=db, ticker_symbols=tickers)
+
+
+def get_ticker_latest_bar(ticker: str, db: Session) -> dict:
+    snapshot = ticker_getter.get_ticker_snapshot(db=db, ticker_symbols=[ticker])
+    if not snapshot:
+        raise TickerNotFoundException(
+            ticker_id=ticker, msg=f"Ticker {ticker} has no aggregation"
+        )
+    return snapshot[0]
+
+
+def screen_tickers(
+    db: Session,
+    metric: str,
+    order: str,
+    days: int,
+    limit: int,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_volume: Optional[float] = None,
+) -> list[dict]:
+    return screener.screen(
+        db=db,
+        metric=metric,
+        order=order,
+        days=days,
+        limit=limit,
+        min_price=min_price,
+        max_price=max_price,
+        min_volume=min_volume,
     )
-    return aggregations_to_csv(aggregations=aggregations)
 
 
-def aggregations_to_csv(aggregations: list[Aggregation]):
+def get_ticker_indicators(
+    ticker: str,
+    start_date: str,
+    end_date: str,
+    indicators: str,
+    db: Session,
+    resolution: Optional[str] = None,
+) -> list[dict]:
+    return ticker_getter.get_ticker_indicators(
+        ticker=ticker,
+        start_date=start_date,
+        end_date=end_date,
+        indicators=indicators,
+        db=db,
+        resolution=resolution,
+    )
+
+
+def export_ticker_aggregations(
+    ticker: str, start_date: str, end_date: str, db: Session, compress: bool = False
+) -> Iterator[bytes]:
+    start_timestamp = validate_date(start_date)
+    end_timestamp = validate_date(end_date)
+    ticker_id = ticker_index.get_ticker_id(ticker_symbol=ticker, db=db)
+    chunks = stream_ticker_aggregations(
+        ticker_id=ticker_id,
+        start_timestamp=start_timestamp,
+        end_timestamp=end_timestamp,
+        columns=EXPORT_FIELDS,
+    )
+    return aggregations_to_csv(chunks=chunks, compress=compress)
+
+
+def batch_ticker_aggregations(
+    request: AggregationBatchRequest, db: Session
+) -> tuple[Iterator[bytes], list[str]]:
+    """
+    Resolve the symbols of a batch and return the NDJSON stream of their bars,
+    one line per symbol in the order asked, with the unknown symbols.
+    """
+    symbols = list(dict.fromkeys(request.symbols))
+    if not symbols or len(symbols) > BATCH_MAX_SYMBOLS:
+        raise ValueError(f"Expected between 1 and {BATCH_MAX_SYMBOLS} symbols.")
+    start_timestamp = validate_date(request.start_date)
+    end_timestamp = validate_date(request.end_date)
+    resolution = (
+        parse_resolution(request.resolution) if request.resolution else BAR_SECONDS
+    )
+    if resolution != BAR_SECONDS and resolution not in ROLLUP_RESOLUTIONS:
+        raise ValueError(
+            "Invalid resolution for a batch query. Expected 10m, 1h, 1d or 1w."
+        )
+    ticker_ids = ticker_index.get_ticker_ids(ticker_symbols=symbols, db=db)
+    missing = [symbol for symbol in symbols if symbol not in ticker_ids]
+    content = stream_batch_aggregations(
+        ticker_ids=ticker_ids,
+        start_timestamp=start_timestamp,
+        end_timestamp=end_timestamp,
+        resolution=resolution,
+    )
+    return content, missing
+
+
+def stream_batch_aggregations(
+    ticker_ids: dict[str, int],
+    start_timestamp: int,
+    end_timestamp: int,
+    resolution: int,
+) -> Iterator[bytes]:
+    symbols = {ticker_id: symbol for symbol, ticker_id in ticker_ids.items()}
+    pending = list(ticker_ids.values())
+
+    def line(ticker_id: int, rows: list[tuple]) -> bytes:
+        aggregations = [dict(zip(EXPORT_FIELDS, row)) for row in rows]
+        document = {"ticker": symbols[ticker_id], "aggregations": aggregations}
+        return (json.dumps(document) + "\n").encode()
+
+    db: Session = postgres.sessionLocal()
+    try:
+        for ticker_id, rows in ticker_getter.stream_batch_aggregations(
+            ticker_ids=pending,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            columns=EXPORT_FIELDS,
+            db=db,
+            resolution=resolution,
+        ):
+            # Tickers without bars in the range are not returned by the scan.
+            while pending[0] != ticker_id:
+                yield line(pending.pop(0), [])
+            yield line(pending.pop(0), rows)
+    finally:
+        db.close()
+    for ticker_id in pending:
+        yield line(ticker_id, [])
+
+
+def stream_ticker_aggregations(
+    ticker_id: int, start_timestamp: int, end_timestamp: int, columns: list[str]
+) -> Iterator[list[tuple]]:
+    # The request session is released before a streaming response is sent,
+    # so the server-side cursor runs on a session owned by the generator.
+    db: Session = postgres.sessionLocal()
+    try:
+        yield from ticker_getter.stream_ticker_aggregations(
+            ticker_id=ticker_id,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            columns=columns,
+            db=db,
+        )
+    finally:
+        db.close()
+
+
+def aggregations_to_csv(
+    chunks: Iterable[list[tuple]], compress: bool = False
+) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
     output = StringIO()
     writer = csv.writer(output)
-    fieldnames = [
-        field
-        for field in Aggregation.__fields__.keys()
-        if field not in ["ticker_id", "id"]
-    ]
-    writer.writerow(fieldnames)
-    for aggregation in aggregations:
-        writer.writerow([getattr(aggregation, field) for field in fieldnames])
-
-    output.seek(0)
-    return output
+
+    def flush() -> bytes:
+        content = output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+        return compressor.compress(content) if compressor else content
+
+    writer.writerow(EXPORT_FIELDS)
+    yield flush()
+    for rows in chunks:
+        writer.writerows(rows)
+        content = flush()
+        if content:
+            yield content
+    if compressor:
+        yield compressor.flush()
 
 
 def generate_ticker_aggregations_predictions(ticker: str, db: Session):
@@ -1,88 +1,173 @@
-from datetime import date, datetime, timedelta
+from datetime import datetime
+from io import BytesIO
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import Iterator, Optional
 
-from sqlalchemy import and_, func, or_
-from sqlalchemy.orm import Session
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Integer, and_, any_, bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 from ..exceptions.exceptions import TickerNotFoundException
+from ..postgres import postgres
 from ..redis import redis_client
 from ..tickers import models
 from ..tickers.schemas import Aggregation, Ticker
+from .aggregation_cache import aggregation_cache, bars_to_dicts
+from .indicators import indicator_engine, parse_indicators, values_to_dicts
+from .rollups import BAR_SECONDS, aggregation_rollups, parse_resolution
+from .ticker_index import ticker_index
+
+TICKER_CURSORS = {"id": int, "ticker": str}
 
 
 class TickerGetter:
     @classmethod
-    def get_ticker_by_id(cls, ticker_id: int, db: Session) -> Ticker:
-        ticker: Ticker = (
-            db.query(models.Ticker).filter(models.Ticker.id == ticker_id).first()
-        )
-        if ticker:
-            return ticker
-        raise TickerNotFoundException(ticker_id=str(ticker_id))
+    def count_tickers(cls, db: Session) -> int:
+        return db.scalar(select(func.count()).select_from(models.Ticker))
 
     @classmethod
-    def get_ticker_by_symbol(cls, ticker_symbol: str, db: Session) -> Ticker:
-        ticker: Ticker = (
-            db.query(models.Ticker)
-            .filter(models.Ticker.ticker == ticker_symbol)
-            .first()
-        )
-        if ticker:
-            return ticker
-        raise TickerNotFoundException(
-            ticker_id=ticker_symbol, msg=f"Ticker {ticker_symbol} is not found"
+    def stream_ticker_documents(
+        cls, db: Session, chunk_size: int = 1000
+    ) -> Iterator[dict]:
+        """Yield every ticker as a column dict, read from a server-side cursor."""
+        statement = (
+            select(*models.Ticker.__table__.columns)
+            .order_by(models.Ticker.id)
+            .execution_options(yield_per=chunk_size)
         )
+        for row in db.execute(statement):
+            yield dict(row._mapping)
 
     @classmethod
-    def get_tickers(cls, limit: int, offset: int, db: Session) -> list[Ticker]:
-        if limit == -1:
-            tickers: list[Ticker] = db.query(models.Ticker).all()
-        else:
-            tickers: list[Ticker] = db.query(models.Ticker).limit(limit).offset(offset)
-        return tickers
+    def get_ticker_documents(cls, ticker_ids: list[int], db: Session) -> list[dict]:
+        rows = db.execute(
+            select(*models.Ticker.__table__.columns).where(
+                models.Ticker.id.in_(ticker_ids)
+            )
+        )
+        return [dict(row._mapping) for row in rows]
 
     @classmethod
-    def get_ticker_without_aggregation(cls, db: Session) -> tuple:
-        target_date = datetime.now().date() - timedelta(days=1)
-        computed_aggregations = redis_client.get_computed_aggregations(
-            key="computed_aggregations"
+    def get_search_outbox_lag(cls, db: Session) -> dict:
+        """How far search is behind the database, from the undrained events."""
+        outbox = models.SearchOutboxEvent
+        pending, oldest, failing, max_attempts = db.execute(
+            select(
+                func.count(),
+                func.extract("epoch", func.now() - func.min(outbox.created_at)),
+                func.count().filter(outbox.attempts > 0),
+                func.max(outbox.attempts),
+            )
+        ).one()
+        last_error = db.scalar(
+            select(outbox.last_error)
+            .where(outbox.last_error != None)
+            .order_by(outbox.id.desc())
+            .limit(1)
         )
-        tickers_without_aggs: list[str] = [ticker for ticker in computed_aggregations]
+        return {
+            "pending": pending,
+            "lag_seconds": round(float(oldest), 3) if oldest is not None else 0.0,
+            "failing": failing,
+            "max_attempts": max_attempts or 0,
+            "last_error": last_error,
+        }
 
-        # Subquery to get ticker IDs that have an aggregation for the target date
-        subquery = (
-            db.query(models.Aggregation.ticker_id)
-            .filter(models.Aggregation.to_date == target_date)
-            .subquery()
+    @classmethod
+    def get_active_tickers(cls, db: Session) -> list[tuple[int, str]]:
+        statement = (
+            select(models.Ticker.id, models.Ticker.ticker)
+            .where(models.Ticker.active == True)
+            .order_by(models.Ticker.id)
         )
+        return [tuple(row) for row in db.execute(statement)]
 
-        # Query to find the first ticker without aggregation on the target date or with no aggregations at all
-        ticker = (
+    @classmethod
+    def get_tickers_without_aggregation(cls, db: Session, limit: int = 1) -> list:
+        """
+        Return tickers that were never scheduled for ingestion, i.e. without a
+        coverage row. Tickers already being ingested are tracked by the Redis
+        schedule, so this lookup never touches the aggregations table.
+        """
+        if limit <= 0:
+            return []
+        tickers = (
             db.query(
                 models.Ticker.id,
                 models.Ticker.ticker,
-                func.max(models.Aggregation.to_date).label("latest_to_date"),
+                models.AggregationCoverage.last_to_date,
             )
             .outerjoin(
-                models.Aggregation,
-                and_(models.Ticker.id == models.Aggregation.ticker_id),
-            )
-            .filter(
-                and_(
-                    or_(
-                        models.Aggregation.ticker_id == None,
-                        ~models.Ticker.id.in_(subquery),
-                    ),
-                    ~models.Ticker.ticker.in_(tickers_without_aggs),
-                )
+                models.AggregationCoverage,
+                models.Ticker.id == models.AggregationCoverage.ticker_id,
             )
-            .group_by(models.Ticker.id)
+            .filter(models.AggregationCoverage.ticker_id == None)
             .order_by(models.Ticker.id)
-            .first()
+            .limit(limit)
+            .all()
         )
-        if ticker:
-            return ticker[0], ticker[1], ticker[2]
-        else:
-            return None, None, None
+        return [(ticker[0], ticker[1], ticker[2]) for ticker in tickers]
+
+    @classmethod
+    def get_coverage_progress(cls, db: Session) -> dict:
+        """Map every covered ticker symbol to its last ingested date."""
+        rows = (
+            db.query(models.Ticker.ticker, models.AggregationCoverage.last_to_date)
+            .join(
+                models.AggregationCoverage,
+                models.Ticker.id == models.AggregationCoverage.ticker_id,
+            )
+            .all()
+        )
+        return {row[0]: row[1] for row in rows}
+
+    @classmethod
+    def get_coverage_latest_bars(cls, db: Session) -> list[dict]:
+        """The bar at last_ts of every covered ticker, one primary key lookup each."""
+        coverage = models.AggregationCoverage
+        aggregation = models.Aggregation
+        rows = db.execute(
+            select(aggregation).join(
+                coverage,
+                and_(
+                    coverage.ticker_id == aggregation.ticker_id,
+                    coverage.last_ts == aggregation.timestamp,
+                ),
+            )
+        ).scalars()
+        return [row.to_dict() for row in rows]
+
+    @classmethod
+    def get_ticker_snapshot(
+        cls, db: Session, ticker_symbols: Optional[list[str]] = None
+    ) -> list[dict]:
+        """
+        Latest bar of the given symbols, or of every ticker, from the snapshot
+        kept by the ingest path. Symbols without a bar are left out.
+        """
+        if ticker_symbols is None:
+            bars = redis_client.get_all_latest_bars()
+            symbols = ticker_index.get_ticker_symbols(ticker_ids=list(bars), db=db)
+            return [
+                {"ticker": symbols[ticker_id], **bar}
+                for ticker_id, bar in sorted(bars.items())
+                if ticker_id in symbols
+            ]
+        ids = ticker_index.get_ticker_ids(ticker_symbols=ticker_symbols, db=db)
+        bars = redis_client.get_latest_bars(ticker_ids=list(ids.values()))
+        return [
+            {"ticker": symbol, **bar}
+            for symbol, bar in zip(ids, bars)
+            if bar is not None
+        ]
+
+    @classmethod
+    def has_coverage(cls, db: Session) -> bool:
+        return db.query(models.AggregationCoverage.ticker_id).first() is not None
 
     @classmethod
     def get_ticker_aggregations(
@@ -90,35 +175,306 @@ class TickerGetter:
     ) -> list[Aggregation]:
         start_date = validate_date(start_date)
         end_date = validate_date(end_date)
-        ticker: Ticker = cls.get_ticker_by_symbol(ticker_symbol=ticker, db=db)
-        aggregations: list[Aggregation] = (
-            db.query(models.Aggregation)
-            .filter(
+        ticker_id = ticker_index.get_ticker_id(ticker_symbol=ticker, db=db)
+        bars = aggregation_cache.get_range(
+            ticker_id=ticker_id,
+            start_timestamp=start_date,
+            end_timestamp=end_date,
+            db=db,
+        )
+        return bars_to_dicts(bars=bars, ticker_id=ticker_id)
+
+    @classmethod
+    def get_ticker_indicators(
+        cls,
+        ticker: str,
+        start_date: str,
+        end_date: str,
+        indicators: str,
+        db: Session,
+        resolution: Optional[str] = None,
+    ) -> list[dict]:
+        start_timestamp = validate_date(start_date)
+        end_timestamp = validate_date(end_date)
+        specs = parse_indicators(indicators)
+        seconds = parse_resolution(resolution) if resolution else BAR_SECONDS
+        ticker_id = ticker_index.get_ticker_id(ticker_symbol=ticker, db=db)
+        values = indicator_engine.get_range(
+            ticker_id=ticker_id,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            specs=specs,
+            db=db,
+            resolution=seconds,
+        )
+        return values_to_dicts(values)
+
+    @classmethod
+    def stream_ticker_aggregations(
+        cls,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        columns: list[str],
+        db: Session,
+        chunk_size: int = 5000,
+    ) -> Iterator[list[tuple]]:
+        """
+        Yield the bars of a range as chunks of tuples read from a server-side
+        cursor, so memory stays flat whatever the size of the range.
+        """
+        statement = (
+            select(*[getattr(models.Aggregation, column) for column in columns])
+            .where(
                 and_(
-                    models.Aggregation.ticker_id == ticker.id,
-                    models.Aggregation.timestamp <= end_date,
-                    models.Aggregation.timestamp >= start_date,
+                    models.Aggregation.ticker_id == ticker_id,
+                    models.Aggregation.timestamp <= end_timestamp,
+                    models.Aggregation.timestamp >= start_timestamp,
                 )
             )
             .order_by(models.Aggregation.timestamp)
-            .all()
+            .execution_options(yield_per=chunk_size)
         )
-        return aggregations
+        for partition in db.execute(statement).partitions():
+            yield [tuple(row) for row in partition]
+
+    @classmethod
+    def stream_batch_aggregations(
+        cls,
+        ticker_ids: list[int],
+        start_timestamp: int,
+        end_timestamp: int,
+        columns: list[str],
+        db: Session,
+        resolution: int = BAR_SECONDS,
+        chunk_size: int = 5000,
+    ) -> Iterator[tuple[int, list[tuple]]]:
+        """
+        Yield (ticker_id, bars) for each ticker with bars in the range, in the
+        order of `ticker_ids`, from a single `ticker_id = ANY(...)` range scan
+        read through a server-side cursor. `resolution` is the raw bar size or
+        one of the stored rollups, checked by the caller.
+        """
+        if resolution == BAR_SECONDS:
+            table = models.Aggregation
+            conditions = []
+        else:
+            table = models.AggregationRollup
+            conditions = [table.resolution == resolution]
+        ids = bindparam("ticker_ids", ticker_ids, type_=ARRAY(Integer))
+        statement = (
+            select(table.ticker_id, *[getattr(table, column) for column in columns])
+            .where(
+                and_(
+                    table.ticker_id == any_(ids),
+                    table.timestamp <= end_timestamp,
+                    table.timestamp >= start_timestamp,
+                    *conditions,
+                )
+            )
+            .order_by(func.array_position(ids, table.ticker_id), table.timestamp)
+            .execution_options(yield_per=chunk_size)
+        )
+        rows = chain.from_iterable(db.execute(statement).partitions())
+        for ticker_id, ticker_rows in groupby(rows, key=itemgetter(0)):
+            yield ticker_id, [tuple(row)[1:] for row in ticker_rows]
 
     @classmethod
     def get_ticker_aggregations_for_prediction(
         cls, ticker: str, db: Session, limit: int = 480
     ):
-        ticker: Ticker = cls.get_ticker_by_symbol(ticker_symbol=ticker, db=db)
+        ticker_id = ticker_index.get_ticker_id(ticker_symbol=ticker, db=db)
         aggregations: list[Aggregation] = (
             db.query(models.Aggregation)
-            .filter(models.Aggregation.ticker_id == ticker.id)
+            .filter(models.Aggregation.ticker_id == ticker_id)
             .order_by(models.Aggregation.timestamp.desc())
             .limit(limit)
         )
         return aggregations
 
 
+class AsyncTickerGetter:
+    """
+    Lookups of the API on the asyncpg pool. Relationships read by the response
+    models are loaded eagerly when asked for, as a lazy load cannot run on the
+    event loop. Reads going through the Redis caches, whose client blocks, run
+    in the threadpool on a sync session.
+    """
+
+    @classmethod
+    async def get_ticker_by_id(
+        cls, ticker_id: int, db: AsyncSession, include_aggregations: bool = False
+    ) -> Ticker:
+        statement = select(models.Ticker).where(models.Ticker.id == ticker_id)
+        if include_aggregations:
+            statement = statement.options(selectinload(models.Ticker.aggregations))
+        ticker: Ticker = await db.scalar(statement)
+        if ticker:
+            return ticker
+        raise TickerNotFoundException(ticker_id=str(ticker_id))
+
+    @classmethod
+    async def get_ticker_by_symbol(
+        cls, ticker_symbol: str, db: AsyncSession, include_aggregations: bool = False
+    ) -> Ticker:
+        statement = select(models.Ticker).where(models.Ticker.ticker == ticker_symbol)
+        if include_aggregations:
+            statement = statement.options(selectinload(models.Ticker.aggregations))
+        ticker: Ticker = await db.scalar(statement)
+        if ticker:
+            return ticker
+        raise TickerNotFoundException(
+            ticker_id=ticker_symbol, msg=f"Ticker {ticker_symbol} is not found"
+        )
+
+    @classmethod
+    async def get_ticker_id(cls, ticker_symbol: str, db: AsyncSession) -> int:
+        ticker_id = ticker_index.peek_ticker_id(ticker_symbol)
+        if ticker_id is not None:
+            return ticker_id
+        return await run_in_threadpool(cls.resolve_ticker_id, ticker_symbol)
+
+    @staticmethod
+    def resolve_ticker_id(ticker_symbol: str) -> int:
+        with postgres.sessionLocal() as session:
+            return ticker_index.get_ticker_id(ticker_symbol=ticker_symbol, db=session)
+
+    @classmethod
+    async def get_tickers(
+        cls,
+        limit: int,
+        offset: int,
+        db: AsyncSession,
+        after: Optional[str] = None,
+        order_by: str = "id",
+        include_aggregations: bool = False,
+    ) -> list[Ticker]:
+        """
+        Page through tickers ordered by `order_by`. With `after`, the page starts
+        right after that key (keyset pagination) and `offset` is ignored.
+        Aggregations are only loaded when `include_aggregations` is set.
+        """
+        if order_by not in TICKER_CURSORS:
+            raise ValueError(
+                f"Invalid order_by {order_by}. "
+                f"Expected one of {', '.join(TICKER_CURSORS)}."
+            )
+        column = getattr(models.Ticker, order_by)
+        statement = select(models.Ticker).order_by(column)
+        if include_aggregations:
+            statement = statement.options(selectinload(models.Ticker.aggregations))
+        if after is not None:
+            statement = statement.where(column > parse_cursor(after, order_by))
+        elif offset:
+            statement = statement.offset(offset)
+        if limit != -1:
+            statement = statement.limit(limit)
+        return list(await db.scalars(statement))
+
+    @classmethod
+    async def get_ticker_aggregations(
+        cls, ticker: str, start_date: str, end_date: str, db: AsyncSession
+    ) -> list[Aggregation]:
+        start_date = validate_date(start_date)
+        end_date = validate_date(end_date)
+        ticker_id = await cls.get_ticker_id(ticker_symbol=ticker, db=db)
+        return await run_in_threadpool(
+            cls.read_cached_aggregations,
+            ticker_id=ticker_id,
+            start_timestamp=start_date,
+            end_timestamp=end_date,
+        )
+
+    @staticmethod
+    def read_cached_aggregations(
+        ticker_id: int, start_timestamp: int, end_timestamp: int
+    ) -> list[dict]:
+        with postgres.sessionLocal() as session:
+            bars = aggregation_cache.get_range(
+                ticker_id=ticker_id,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                db=session,
+            )
+        return bars_to_dicts(bars=bars, ticker_id=ticker_id)
+
+    @classmethod
+    async def get_ticker_rollups(
+        cls,
+        ticker: str,
+        start_date: str,
+        end_date: str,
+        resolution: int,
+        db: AsyncSession,
+    ) -> list[Aggregation]:
+        start_date = validate_date(start_date)
+        end_date = validate_date(end_date)
+        ticker_id = await cls.get_ticker_id(ticker_symbol=ticker, db=db)
+        bars = await cls.get_rollup_bars(
+            ticker_id=ticker_id,
+            start_timestamp=start_date,
+            end_timestamp=end_date,
+            resolution=resolution,
+            db=db,
+        )
+        return bars_to_dicts(bars=bars, ticker_id=ticker_id)
+
+    @classmethod
+    async def get_rollup_bars(
+        cls,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        resolution: int,
+        db: AsyncSession,
+    ) -> np.ndarray:
+        return await db.run_sync(
+            lambda session: aggregation_rollups.get_range(
+                ticker_id=ticker_id,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                resolution=resolution,
+                db=session,
+            )
+        )
+
+    @classmethod
+    async def copy_ticker_aggregations(
+        cls,
+        ticker_id: int,
+        start_timestamp: int,
+        end_timestamp: int,
+        columns: list[str],
+        db: AsyncSession,
+    ) -> BytesIO:
+        """COPY a range to CSV through the asyncpg connection of the session."""
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        output = BytesIO()
+        await raw_connection.driver_connection.copy_from_query(
+            f"SELECT {', '.join(columns)} FROM {models.AGGREGATIONS} "
+            "WHERE ticker_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+            "ORDER BY timestamp",
+            ticker_id,
+            start_timestamp,
+            end_timestamp,
+            output=output,
+            format="csv",
+            header=True,
+        )
+        output.seek(0)
+        return output
+
+
+def parse_cursor(cursor: str, order_by: str):
+    if TICKER_CURSORS[order_by] is int:
+        try:
+            return int(cursor)
+        except ValueError:
+            raise ValueError(f"Invalid cursor {cursor}. Expected an integer.")
+    return cursor
+
+
 def validate_date(date_str: str) -> int:
     try:
         dt = datetime.strptime(date_str, "%Y-%m-%d").date()
@@ -129,3 +485,4 @@ def validate_date(date_str: str) -> int:
 
 
 ticker_getter = TickerGetter()
+async_ticker_getter = AsyncTickerGetter()
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import Integer, String, any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from ..exceptions.exceptions import TickerNotFoundException
+from ..redis import TICKER_INDEX_VERSION, redis_client
+from ..settings.redis_settings import redis_settings
+from . import models
+
+
+class TickerIndex:
+    """
+    Process-local symbol <-> id map of the tickers in use, so hot paths
+    resolve a symbol without a database round trip. The map holds at most
+    TICKER_INDEX_SIZE tickers and evicts the least recently used one.
+
+    Writers bump a version counter in Redis after committing a ticker change;
+    readers compare it at most every TICKER_INDEX_CHECK_INTERVAL seconds and
+    reload the tickers they hold in one query when it moved. A symbol missing
+    from the map falls back to the database and is added to it.
+    """
+
+    def __init__(self):
+        self.ids: OrderedDict[str, int] = OrderedDict()
+        self.symbols: dict[int, str] = {}
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def get_ticker_id(self, ticker_symbol: str, db: Session) -> int:
+        self.refresh(db=db)
+        ticker_id = self.lookup_id(ticker_symbol)
+        if ticker_id is not None:
+            return ticker_id
+        ticker_id = db.scalar(
+            select(models.Ticker.id).where(models.Ticker.ticker == ticker_symbol)
+        )
+        if ticker_id is None:
+            raise TickerNotFoundException(
+                ticker_id=ticker_symbol, msg=f"Ticker {ticker_symbol} is not found"
+            )
+        self.add(ticker_id=ticker_id, ticker_symbol=ticker_symbol)
+        return ticker_id
+
+    def peek_ticker_id(self, ticker_symbol: str) -> Optional[int]:
+        """The id of a symbol when the map is up to date and holds it, without I/O."""
+        elapsed = time.monotonic() - self.checked_at
+        if elapsed >= redis_settings.TICKER_INDEX_CHECK_INTERVAL:
+            return None
+        return self.lookup_id(ticker_symbol)
+
+    def get_ticker_ids(self, ticker_symbols: list[str], db: Session) -> dict[str, int]:
+        """
+        Ids of the known symbols, in the order asked. The symbols missing from
+        the map are looked up together in one query; unknown ones are left out.
+        """
+        self.refresh(db=db)
+        held = {symbol: self.lookup_id(symbol) for symbol in ticker_symbols}
+        missing = [symbol for symbol, ticker_id in held.items() if ticker_id is None]
+        found = {}
+        if missing:
+            found = dict(
+                db.execute(
+                    select(models.Ticker.ticker, models.Ticker.id).where(
+                        models.Ticker.ticker
+                        == any_(bindparam("symbols", missing, type_=ARRAY(String)))
+                    )
+                ).all()
+            )
+            for ticker_symbol, ticker_id in found.items():
+                self.add(ticker_id=ticker_id, ticker_symbol=ticker_symbol)
+        ids = {}
+        for symbol in ticker_symbols:
+            ticker_id = held[symbol] or found.get(symbol)
+            if ticker_id is not None:
+                ids[symbol] = ticker_id
+        return ids
+
+    def get_ticker_symbols(self, ticker_ids: list[int], db: Session) -> dict[int, str]:
+        """Same as get_ticker_ids, from ids to symbols."""
+        self.refresh(db=db)
+        held = {ticker_id: self.lookup_symbol(ticker_id) for ticker_id in ticker_ids}
+        missing = [ticker_id for ticker_id, symbol in held.items() if symbol is None]
+        found = {}
+        if missing:
+            found = dict(
+                db.execute(
+                    select(models.Ticker.id, models.Ticker.ticker).where(
+                        models.Ticker.id
+                        == any_(bindparam("ids", missing, type_=ARRAY(Integer)))
+                    )
+                ).all()
+            )
+            for ticker_id, ticker_symbol in found.items():
+                self.add(ticker_id=ticker_id, ticker_symbol=ticker_symbol)
+        symbols = {}
+        for ticker_id in ticker_ids:
+            ticker_symbol = held[ticker_id] or found.get(ticker_id)
+            if ticker_symbol is not None:
+                symbols[ticker_id] = ticker_symbol
+        return symbols
+
+    def refresh(self, db: Session):
+        now = time.monotonic()
+        if now - self.checked_at < redis_settings.TICKER_INDEX_CHECK_INTERVAL:
+            return
+        with self.refresh_lock:
+            if now - self.checked_at < redis_settings.TICKER_INDEX_CHECK_INTERVAL:
+                return
+            version = redis_client.get(TICKER_INDEX_VERSION) or "0"
+            if version != self.version:
+                self.load(db=db)
+                self.version = version
+            self.checked_at = time.monotonic()
+
+    def load(self, db: Session):
+        """Reload the tickers held, dropping the ones renamed or deleted."""
+        with self.lock:
+            held = list(self.ids)
+        rows = []
+        if held:
+            rows = db.execute(
+                select(models.Ticker.ticker, models.Ticker.id).where(
+                    models.Ticker.ticker
+                    == any_(bindparam("symbols", held, type_=ARRAY(String)))
+                )
+            ).all()
+        ids = dict(rows)
+        with self.lock:
+            self.ids = OrderedDict(
+                (symbol, ids[symbol]) for symbol in held if symbol in ids
+            )
+            self.symbols = {
+                ticker_id: ticker_symbol
+                for ticker_symbol, ticker_id in self.ids.items()
+            }
+
+    def lookup_id(self, ticker_symbol: str) -> Optional[int]:
+        with self.lock:
+            ticker_id = self.ids.get(ticker_symbol)
+            if ticker_id is not None:
+                self.ids.move_to_end(ticker_symbol)
+            return ticker_id
+
+    def lookup_symbol(self, ticker_id: int) -> Optional[str]:
+        with self.lock:
+            ticker_symbol = self.symbols.get(ticker_id)
+            if ticker_symbol is not None:
+                self.ids.move_to_end(ticker_symbol)
+            return ticker_symbol
+
+    def add(self, ticker_id: int, ticker_symbol: str):
+        with self.lock:
+            previous_symbol = self.symbols.get(ticker_id)
+            if previous_symbol not in (None, ticker_symbol):
+                self.ids.pop(previous_symbol, None)
+            previous_id = self.ids.get(ticker_symbol)
+            if previous_id not in (None, ticker_id):
+                self.symbols.pop(previous_id, None)
+            self.ids[ticker_symbol] = ticker_id
+            self.ids.move_to_end(ticker_symbol)
+            self.symbols[ticker_id] = ticker_symbol
+            while len(self.ids) > redis_settings.TICKER_INDEX_SIZE:
+                _, evicted = self.ids.popitem(last=False)
+                self.symbols.pop(evicted, None)
+
+    def invalidate(self):
+        """Called after a ticker write is committed, in every process that writes."""
+        redis_client.incr(TICKER_INDEX_VERSION)
+        self.checked_at = 0.0
+
+
+ticker_index = TickerIndex()
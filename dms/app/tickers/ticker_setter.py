@@ -1,63 +1,420 @@
+import datetime
+import hashlib
+import json
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Date, case, cast, delete, func, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ..elasticsearch import es_client
-from ..exceptions.exceptions import TickerNotFoundException
+from ..redis import redis_client
 from ..tickers import models
 from ..tickers.schemas import (
-    Aggregation,
     AggregationCreate,
     Ticker,
     TickerCreate,
     TickerUpdate,
 )
+from .aggregation_cache import aggregation_cache
+from .indicators import indicator_engine
 from .models import TICKERS
+from .rollups import aggregation_rollups
+from .ticker_getter import async_ticker_getter
+from .ticker_index import ticker_index
+
+AGGREGATIONS_BATCH_SIZE = 1000
+SEARCH_OUTBOX_MAX_DELAY = 300
+AGGREGATION_VALUE_FIELDS = [
+    "close_price",
+    "highest_price",
+    "lowest_price",
+    "number_of_transactions",
+    "open_price",
+    "trading_volume",
+    "volume_weighted_average_price",
+]
 
 
 class TickerSetter:
     @classmethod
-    def create_ticker(cls, ticker: TickerCreate, db: Session) -> Ticker:
-        db_ticker = models.Ticker(**ticker.dict())
-        db.add(db_ticker)
+    def upsert_tickers(cls, tickers: list[TickerCreate], db: Session) -> list[dict]:
+        """
+        Upsert a page of tickers keyed on the ticker symbol in one statement.
+        Rows whose content hash did not change are skipped, and only the
+        inserted or changed rows are returned and queued for search indexing.
+        """
+        rows = list(
+            {
+                ticker.ticker: {**ticker.dict(), "content_hash": ticker_hash(ticker)}
+                for ticker in tickers
+            }.values()
+        )
+        if not rows:
+            return []
+        statement = insert(models.Ticker).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[models.Ticker.ticker],
+            set_={
+                field: statement.excluded[field]
+                for field in rows[0]
+                if field != "ticker"
+            },
+            where=models.Ticker.content_hash.is_distinct_from(
+                statement.excluded.content_hash
+            ),
+        ).returning(*models.Ticker.__table__.columns)
+        changed = [dict(row._mapping) for row in db.execute(statement)]
+        cls.record_search_events(
+            document_ids=[ticker["id"] for ticker in changed], db=db
+        )
         db.commit()
-        db.refresh(db_ticker)
-        es_client.es_index(index=TICKERS, element=db_ticker)
-        return db_ticker
+        if changed:
+            ticker_index.invalidate()
+        return changed
+
+    @classmethod
+    def record_search_events(
+        cls, document_ids: list[int], db: Session, index: str = TICKERS
+    ):
+        """Queue documents for search indexing, in the caller's transaction."""
+        if document_ids:
+            db.execute(search_events_statement(document_ids=document_ids, index=index))
+
+    @classmethod
+    def claim_search_events(
+        cls, batch_size: int, db: Session
+    ) -> list[models.SearchOutboxEvent]:
+        """
+        Lock the oldest due events. SKIP LOCKED lets several indexers drain the
+        outbox side by side; the locks are held until the caller commits.
+        """
+        return (
+            db.execute(
+                select(models.SearchOutboxEvent)
+                .where(models.SearchOutboxEvent.next_attempt_at <= func.now())
+                .order_by(models.SearchOutboxEvent.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            .scalars()
+            .all()
+        )
+
+    @classmethod
+    def complete_search_events(cls, event_ids: list[int], db: Session):
+        if event_ids:
+            db.execute(
+                delete(models.SearchOutboxEvent).where(
+                    models.SearchOutboxEvent.id.in_(event_ids)
+                )
+            )
+
+    @classmethod
+    def retry_search_events(
+        cls, events: list[models.SearchOutboxEvent], errors: dict, db: Session
+    ):
+        """Push failed events back with an exponential delay capped at 5 minutes."""
+        for event in events:
+            db.execute(
+                update(models.SearchOutboxEvent)
+                .where(models.SearchOutboxEvent.id == event.id)
+                .values(
+                    attempts=models.SearchOutboxEvent.attempts + 1,
+                    last_error=errors[event.document_id][:1000],
+                    next_attempt_at=func.now()
+                    + func.make_interval(
+                        0,
+                        0,
+                        0,
+                        0,
+                        0,
+                        0,
+                        func.least(
+                            SEARCH_OUTBOX_MAX_DELAY,
+                            func.power(2, models.SearchOutboxEvent.attempts),
+                        ),
+                    ),
+                )
+            )
+
+    @classmethod
+    def create_aggregations(
+        cls,
+        aggregations: list[AggregationCreate],
+        db: Session,
+        from_date: Optional[datetime.date] = None,
+        to_date: Optional[datetime.date] = None,
+    ) -> int:
+        """
+        Upsert a batch of aggregations keyed on (ticker_id, timestamp) and commit once.
+        Bars that already exist with the same values are left untouched, so
+        re-fetching an overlapping window is a no-op. The request window, when
+        given, is recorded once per ticker in aggregation_fetches, and the
+        rollup buckets covering the batch are recomputed in the same commit.
+        Once committed, the newest bar of each ticker goes to the latest-bar
+        snapshot. Returns the number of inserted or changed rows.
+        """
+        rows = list(
+            {
+                (aggregation.ticker_id, aggregation.timestamp): aggregation.dict()
+                for aggregation in aggregations
+            }.values()
+        )
+        written = 0
+        for i in range(0, len(rows), AGGREGATIONS_BATCH_SIZE):
+            statement = insert(models.Aggregation).values(
+                rows[i : i + AGGREGATIONS_BATCH_SIZE]
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[
+                    models.Aggregation.ticker_id,
+                    models.Aggregation.timestamp,
+                ],
+                set_={
+                    field: statement.excluded[field]
+                    for field in AGGREGATION_VALUE_FIELDS
+                },
+                where=or_(
+                    *[
+                        getattr(models.Aggregation, field).is_distinct_from(
+                            statement.excluded[field]
+                        )
+                        for field in AGGREGATION_VALUE_FIELDS
+                    ]
+                ),
+            )
+            written += db.execute(statement).rowcount
+        for ticker_id in {row["ticker_id"] for row in rows}:
+            timestamps = [
+                row["timestamp"] for row in rows if row["ticker_id"] == ticker_id
+            ]
+            if from_date and to_date:
+                cls.record_fetch(
+                    ticker_id=ticker_id,
+                    from_date=from_date,
+                    to_date=to_date,
+                    bar_count=len(timestamps),
+                    db=db,
+                )
+            cls.record_coverage(
+                ticker_id=ticker_id,
+                to_date=to_date or timestamp_date(max(timestamps)),
+                first_ts=min(timestamps),
+                last_ts=max(timestamps),
+                db=db,
+            )
+            if written:
+                aggregation_rollups.refresh(
+                    ticker_id=ticker_id,
+                    first_timestamp=min(timestamps),
+                    last_timestamp=max(timestamps),
+                    db=db,
+                )
+        db.commit()
+        if written:
+            for ticker_id in {row["ticker_id"] for row in rows}:
+                aggregation_cache.invalidate(
+                    ticker_id=ticker_id,
+                    timestamps=[
+                        row["timestamp"]
+                        for row in rows
+                        if row["ticker_id"] == ticker_id
+                    ],
+                )
+                indicator_engine.invalidate(ticker_id=ticker_id)
+            latest = {}
+            for row in rows:
+                if row["timestamp"] > latest.get(row["ticker_id"], row)["timestamp"]:
+                    latest[row["ticker_id"]] = row
+                latest.setdefault(row["ticker_id"], row)
+            redis_client.set_latest_bars(list(latest.values()))
+        return written
+
+    @classmethod
+    def record_fetch(
+        cls,
+        ticker_id: int,
+        from_date: datetime.date,
+        to_date: datetime.date,
+        bar_count: int,
+        db: Session,
+    ):
+        db.add(
+            models.AggregationFetch(
+                ticker_id=ticker_id,
+                from_date=from_date,
+                to_date=to_date,
+                bar_count=bar_count,
+            )
+        )
+
+    @classmethod
+    def record_coverage(
+        cls,
+        ticker_id: int,
+        to_date: datetime.date,
+        db: Session,
+        first_ts: Optional[int] = None,
+        last_ts: Optional[int] = None,
+    ):
+        """
+        Widen the ingestion coverage of a ticker with a fetched window.
+        Does not commit, so it lands in the same transaction as the bars.
+        """
+        coverage = models.AggregationCoverage
+        statement = insert(coverage).values(
+            ticker_id=ticker_id,
+            first_ts=first_ts,
+            last_ts=last_ts,
+            last_to_date=to_date,
+            status=models.COVERAGE_ACTIVE if last_ts else models.COVERAGE_EMPTY,
+        )
+        last_ts = func.greatest(coverage.last_ts, statement.excluded.last_ts)
+        statement = statement.on_conflict_do_update(
+            index_elements=[coverage.ticker_id],
+            set_={
+                "first_ts": func.least(coverage.first_ts, statement.excluded.first_ts),
+                "last_ts": last_ts,
+                "last_to_date": func.greatest(
+                    coverage.last_to_date, statement.excluded.last_to_date
+                ),
+                "status": case(
+                    (last_ts.is_(None), models.COVERAGE_EMPTY),
+                    else_=models.COVERAGE_ACTIVE,
+                ),
+            },
+        )
+        db.execute(statement)
 
     @classmethod
-    def update_ticker(cls, ticker_id: int, ticker: TickerUpdate, db: Session):
-        db_ticker = (
-            db.query(models.Ticker).filter(models.Ticker.id == ticker_id).first()
+    def record_empty_window(
+        cls,
+        ticker_id: int,
+        from_date: datetime.date,
+        to_date: datetime.date,
+        db: Session,
+    ):
+        cls.record_fetch(
+            ticker_id=ticker_id,
+            from_date=from_date,
+            to_date=to_date,
+            bar_count=0,
+            db=db,
         )
-        if db_ticker:
-            for key, value in ticker.dict().items():
-                setattr(db_ticker, key, value)
-            db.commit()
-            db.refresh(db_ticker)
-            es_client.es_index(index=TICKERS, element=db_ticker)
-            return db_ticker
-        raise TickerNotFoundException(ticker_id=str(ticker_id))
+        cls.record_coverage(ticker_id=ticker_id, to_date=to_date, db=db)
+        db.commit()
 
     @classmethod
-    def delete_ticker(cls, ticker_id: int, db: Session):
-        db_ticker = (
-            db.query(models.Ticker).filter(models.Ticker.id == ticker_id).first()
+    def claim_uncovered_tickers(cls, ticker_ids: list[int], db: Session) -> list[int]:
+        """
+        Mark tickers without coverage as pending so no other worker picks them.
+        Returns the ids that were claimed by this call. The caller commits once
+        it scheduled them, a claim never outlives a failed schedule.
+        """
+        if not ticker_ids:
+            return []
+        statement = (
+            insert(models.AggregationCoverage)
+            .values(
+                [
+                    {"ticker_id": ticker_id, "status": models.COVERAGE_PENDING}
+                    for ticker_id in ticker_ids
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=["ticker_id"])
+            .returning(models.AggregationCoverage.ticker_id)
         )
-        if db_ticker:
-            db.delete(db_ticker)
-            db.commit()
-            es_client.es_delete(index=TICKERS, id=ticker_id)
-            return db_ticker
-        raise TickerNotFoundException(ticker_id=str(ticker_id))
+        return [row[0] for row in db.execute(statement)]
 
     @classmethod
-    def create_aggregation(
-        cls, aggregation: AggregationCreate, db: Session
-    ) -> Aggregation:
-        db_aggregation = models.Aggregation(**aggregation.dict())
-        db.add(db_aggregation)
+    def rebuild_coverage(cls, db: Session):
+        """Backfill the coverage table from the stored aggregations."""
+        aggregation = models.Aggregation
+        rows = select(
+            aggregation.ticker_id,
+            func.min(aggregation.timestamp),
+            func.max(aggregation.timestamp),
+            cast(func.to_timestamp(func.max(aggregation.timestamp)), Date),
+            literal(models.COVERAGE_ACTIVE),
+        ).group_by(aggregation.ticker_id)
+        statement = (
+            insert(models.AggregationCoverage)
+            .from_select(
+                ["ticker_id", "first_ts", "last_ts", "last_to_date", "status"], rows
+            )
+            .on_conflict_do_nothing(index_elements=["ticker_id"])
+        )
+        db.execute(statement)
         db.commit()
-        db.refresh(db_aggregation)
-        return db_aggregation
+
+
+class AsyncTickerSetter:
+    """
+    Ticker writes of the API on the asyncpg pool. Search indexing is queued in
+    the same transaction and done by the outbox indexer.
+    """
+
+    @classmethod
+    async def create_ticker(cls, ticker: TickerCreate, db: AsyncSession) -> Ticker:
+        db_ticker = models.Ticker(
+            **ticker.dict(), content_hash=ticker_hash(ticker), aggregations=[]
+        )
+        db.add(db_ticker)
+        await db.flush()
+        await db.execute(search_events_statement(document_ids=[db_ticker.id]))
+        await db.commit()
+        await run_in_threadpool(ticker_index.invalidate)
+        return db_ticker
+
+    @classmethod
+    async def update_ticker(
+        cls, ticker_id: int, ticker: TickerUpdate, db: AsyncSession
+    ) -> Ticker:
+        db_ticker = await async_ticker_getter.get_ticker_by_id(
+            ticker_id=ticker_id, db=db
+        )
+        for key, value in ticker.dict().items():
+            setattr(db_ticker, key, value)
+        db_ticker.content_hash = ticker_hash(ticker)
+        await db.execute(search_events_statement(document_ids=[ticker_id]))
+        await db.commit()
+        await run_in_threadpool(ticker_index.invalidate)
+        return db_ticker
+
+    @classmethod
+    async def delete_ticker(cls, ticker_id: int, db: AsyncSession) -> Ticker:
+        db_ticker = await async_ticker_getter.get_ticker_by_id(
+            ticker_id=ticker_id, db=db
+        )
+        # Delete the bars in one statement, the cascade then finds none to load.
+        await db.execute(
+            delete(models.Aggregation).where(models.Aggregation.ticker_id == ticker_id)
+        )
+        await db.delete(db_ticker)
+        await db.execute(search_events_statement(document_ids=[ticker_id]))
+        await db.commit()
+        await run_in_threadpool(ticker_index.invalidate)
+        return db_ticker
+
+
+def search_events_statement(document_ids: list[int], index: str = TICKERS):
+    return insert(models.SearchOutboxEvent).values(
+        [{"index": index, "document_id": document_id} for document_id in document_ids]
+    )
+
+
+def ticker_hash(ticker: TickerCreate) -> str:
+    content = ticker.dict(exclude={"last_updated_utc"})
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def timestamp_date(timestamp: int) -> datetime.date:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).date()
 
 
 ticker_setter = TickerSetter()
+async_ticker_setter = AsyncTickerSetter()
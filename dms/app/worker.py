@@ -0,0 +1,40 @@
+import asyncio
+import logging
+import signal
+
+from .ingestion import ingestion
+from .postgres import postgres
+from .tickers.services.polygon_backfill_service import polygon_backfill
+
+logger = logging.getLogger("uvicorn")
+
+
+async def run():
+    """
+    Run the ingestion jobs and the queued backfills without serving HTTP,
+    until SIGINT or SIGTERM.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    logger.info("Starting the ingestion worker...")
+    await ingestion.start()
+    backfills = asyncio.create_task(polygon_backfill.consume())
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping the ingestion worker...")
+        backfills.cancel()
+        await asyncio.gather(backfills, return_exceptions=True)
+        await ingestion.stop()
+        await postgres.async_engine.dispose()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
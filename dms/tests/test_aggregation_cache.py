@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from app.tickers.aggregation_cache import (
+    BAR_DTYPE,
+    DAY,
+    AggregationCache,
+    aggregation_cache,
+    contiguous_runs,
+)
+
+# 2024-01-01, long before today.
+FIRST_DAY = 19723 * DAY
+
+
+class Table:
+    """The aggregations table of one ticker, counting the range reads."""
+
+    def __init__(self, timestamps):
+        self.bars = {timestamp: 1.0 for timestamp in timestamps}
+        self.reads = []
+
+    def load_bars(self, ticker_id, start_timestamp, end_timestamp, db):
+        self.reads.append((start_timestamp // DAY, end_timestamp // DAY))
+        return np.array(
+            [
+                (timestamp, 0, 0, 0, 0, close_price, 0, 0)
+                for timestamp, close_price in sorted(self.bars.items())
+                if start_timestamp <= timestamp <= end_timestamp
+            ],
+            dtype=BAR_DTYPE,
+        )
+
+
+@pytest.fixture
+def table(monkeypatch, fake_redis):
+    table = Table(
+        [FIRST_DAY + day * DAY + minute * 600 for day in range(4) for minute in [0, 1]]
+    )
+    monkeypatch.setattr(AggregationCache, "load_bars", table.load_bars)
+    return table
+
+
+def get_range(start_timestamp: int, end_timestamp: int) -> np.ndarray:
+    return aggregation_cache.get_range(
+        ticker_id=1,
+        start_timestamp=start_timestamp,
+        end_timestamp=end_timestamp,
+        db=None,
+    )
+
+
+def test_past_days_are_read_once(table):
+    bars = get_range(FIRST_DAY + 600, FIRST_DAY + 3 * DAY)
+    assert len(bars) == 6
+    assert bars["timestamp"][0] == FIRST_DAY + 600
+    # The missing days are read in one contiguous range.
+    assert table.reads == [(19723, 19726)]
+
+    assert np.array_equal(get_range(FIRST_DAY + 600, FIRST_DAY + 3 * DAY), bars)
+    assert len(table.reads) == 1
+
+
+def test_invalidate_reloads_only_the_days_written(table):
+    get_range(FIRST_DAY, FIRST_DAY + 4 * DAY - 1)
+    table.bars[FIRST_DAY + DAY] = 2.0
+    aggregation_cache.invalidate(ticker_id=1, timestamps=[FIRST_DAY + DAY])
+
+    bars = get_range(FIRST_DAY, FIRST_DAY + 4 * DAY - 1)
+    assert table.reads[1:] == [(19724, 19724)]
+    assert bars["close_price"][2] == 2.0
+
+
+def test_block_read_before_an_ingest_is_not_served(table, monkeypatch):
+    load_bars = table.load_bars
+
+    def load_bars_then_ingest(**kwargs):
+        bars = load_bars(**kwargs)
+        # An ingest commits after the generations were read.
+        table.bars[FIRST_DAY] = 3.0
+        aggregation_cache.invalidate(ticker_id=1, timestamps=[FIRST_DAY])
+        return bars
+
+    monkeypatch.setattr(
+        AggregationCache, "load_bars", staticmethod(load_bars_then_ingest)
+    )
+    assert get_range(FIRST_DAY, FIRST_DAY + DAY - 1)["close_price"][0] == 1.0
+    monkeypatch.setattr(AggregationCache, "load_bars", table.load_bars)
+
+    assert get_range(FIRST_DAY, FIRST_DAY + DAY - 1)["close_price"][0] == 3.0
+    assert len(table.reads) == 2
+
+
+def test_other_tickers_keep_their_blocks(table):
+    get_range(FIRST_DAY, FIRST_DAY + DAY - 1)
+    aggregation_cache.invalidate(ticker_id=2, timestamps=[FIRST_DAY])
+    get_range(FIRST_DAY, FIRST_DAY + DAY - 1)
+    assert len(table.reads) == 1
+
+
+def test_today_is_never_cached(table):
+    today = int(np.datetime64("now", "s").astype(int)) // DAY * DAY
+    get_range(today, today + 600)
+    get_range(today, today + 600)
+    assert len(table.reads) == 2
+
+
+def test_contiguous_runs():
+    assert contiguous_runs([]) == []
+    assert contiguous_runs([1, 2, 3, 5, 7, 8]) == [(1, 3), (5, 5), (7, 8)]
@@ -0,0 +1,139 @@
+import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.tickers import ticker_setter as setter_module
+from app.tickers.schemas import AggregationCreate
+from app.tickers.ticker_setter import TickerSetter, ticker_setter
+
+
+class Result:
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+
+
+class RecordingSession:
+    """Reports `rowcount` rows written per statement and counts the commits."""
+
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+        self.statements = []
+        self.commits = 0
+
+    def execute(self, statement):
+        self.statements.append(statement)
+        return Result(self.rowcount)
+
+    def commit(self):
+        self.commits += 1
+
+
+def bar(ticker_id: int, timestamp: int, close_price: float = 1.0) -> AggregationCreate:
+    return AggregationCreate(
+        close_price=close_price,
+        highest_price=2.0,
+        lowest_price=0.5,
+        number_of_transactions=3,
+        open_price=1.0,
+        timestamp=timestamp,
+        trading_volume=10.0,
+        volume_weighted_average_price=1.2,
+        ticker_id=ticker_id,
+    )
+
+
+@pytest.fixture
+def calls(monkeypatch, fake_redis):
+    """The bookkeeping around the upsert, recorded instead of run."""
+    calls = {"fetch": [], "coverage": [], "refresh": [], "invalidate": []}
+    monkeypatch.setattr(
+        TickerSetter, "record_fetch", lambda **kwargs: calls["fetch"].append(kwargs)
+    )
+    monkeypatch.setattr(
+        TickerSetter,
+        "record_coverage",
+        lambda **kwargs: calls["coverage"].append(kwargs),
+    )
+    monkeypatch.setattr(
+        setter_module.aggregation_rollups,
+        "refresh",
+        lambda **kwargs: calls["refresh"].append(kwargs),
+    )
+    monkeypatch.setattr(
+        setter_module.aggregation_cache,
+        "invalidate",
+        lambda **kwargs: calls["invalidate"].append(kwargs),
+    )
+    monkeypatch.setattr(
+        setter_module.indicator_engine, "invalidate", lambda **kwargs: None
+    )
+    return calls
+
+
+def test_upsert_is_one_statement_keyed_on_ticker_and_timestamp(calls):
+    db = RecordingSession(rowcount=3)
+    written = ticker_setter.create_aggregations(
+        aggregations=[bar(1, 600), bar(1, 0), bar(2, 0), bar(1, 600, close_price=5.0)],
+        db=db,
+        from_date=datetime.date(2024, 1, 1),
+        to_date=datetime.date(2024, 1, 2),
+    )
+
+    assert written == 3
+    assert db.commits == 1
+    [statement] = db.statements
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (ticker_id, timestamp) DO UPDATE" in sql
+    assert "IS DISTINCT FROM excluded.close_price" in sql
+    # The repeated bar is sent once, with the last values seen.
+    rows = statement.compile(dialect=postgresql.dialect()).params
+    assert rows["close_price_m0"] == 5.0
+    assert "timestamp_m3" not in rows
+    assert sorted(call["ticker_id"] for call in calls["fetch"]) == [1, 2]
+    assert {call["ticker_id"]: call["last_ts"] for call in calls["coverage"]} == {
+        1: 600,
+        2: 0,
+    }
+    assert {call["ticker_id"] for call in calls["invalidate"]} == {1, 2}
+
+
+def test_upsert_splits_large_batches(calls, monkeypatch):
+    monkeypatch.setattr(setter_module, "AGGREGATIONS_BATCH_SIZE", 2)
+    db = RecordingSession(rowcount=2)
+    written = ticker_setter.create_aggregations(
+        aggregations=[bar(1, 600 * i) for i in range(5)], db=db
+    )
+    assert len(db.statements) == 3
+    assert written == 6
+    assert db.commits == 1
+
+
+def test_refetch_without_changes_leaves_caches_alone(calls, fake_redis):
+    db = RecordingSession(rowcount=0)
+    written = ticker_setter.create_aggregations(
+        aggregations=[bar(1, 0), bar(1, 600)], db=db
+    )
+    assert written == 0
+    assert db.commits == 1
+    assert calls["refresh"] == []
+    assert calls["invalidate"] == []
+    assert fake_redis.get_latest_bars([1]) == [None]
+    # The coverage is still recorded, the window was fetched.
+    assert len(calls["coverage"]) == 1
+
+
+def test_newest_bar_goes_to_the_snapshot(calls, fake_redis):
+    ticker_setter.create_aggregations(
+        aggregations=[bar(1, 1200, 3.0), bar(1, 600, 2.0), bar(2, 0, 7.0)],
+        db=RecordingSession(rowcount=3),
+    )
+    first, second = fake_redis.get_latest_bars([1, 2])
+    assert (first["timestamp"], first["close_price"]) == (1200, 3.0)
+    assert (second["timestamp"], second["close_price"]) == (0, 7.0)
+
+    # An older window fetched later does not move the snapshot back.
+    ticker_setter.create_aggregations(
+        aggregations=[bar(1, 0, 9.0)], db=RecordingSession(rowcount=1)
+    )
+    assert fake_redis.get_latest_bars([1])[0]["timestamp"] == 1200
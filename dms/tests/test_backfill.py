@@ -0,0 +1,171 @@
+import asyncio
+import datetime
+
+import pytest
+
+from app.exceptions.exceptions import BackfillJobNotFoundException
+from app.redis import AGGREGATION_PROGRESS, AGGREGATION_SCHEDULE
+from app.tickers.services.polygon_backfill_service import (
+    BACKFILL_DONE,
+    BACKFILL_LOCK,
+    BACKFILL_QUEUE,
+    BACKFILL_WINDOW_DAYS,
+    PolygonBackfill,
+    polygon_backfill,
+    window_key,
+)
+
+DAY = datetime.timedelta(days=1)
+
+
+def test_split_covers_the_range_without_gaps():
+    start_date = datetime.date(2024, 1, 1)
+    end_date = datetime.date(2024, 4, 15)
+    windows = PolygonBackfill.split(1, "AAPL", start_date, end_date)
+
+    assert windows[0]["from_date"] == start_date
+    assert windows[-1]["to_date"] == end_date
+    for window, following in zip(windows, windows[1:]):
+        assert following["from_date"] == window["to_date"] + DAY
+    assert all(
+        window["to_date"] - window["from_date"] < BACKFILL_WINDOW_DAYS * DAY
+        for window in windows
+    )
+    assert len(windows) == -(-106 // BACKFILL_WINDOW_DAYS)
+    assert {(window["ticker_id"], window["ticker"]) for window in windows} == {
+        (1, "AAPL")
+    }
+
+
+def test_split_single_day():
+    day = datetime.date(2024, 1, 1)
+    [window] = PolygonBackfill.split(1, "AAPL", day, day)
+    assert (window["from_date"], window["to_date"]) == (day, day)
+
+
+def progress(fake_redis, ticker: str):
+    return fake_redis.redis_conn.hget(AGGREGATION_PROGRESS, ticker)
+
+
+def test_advance_progress_continues_without_gaps(fake_redis):
+    fake_redis.set_tickers_progress(
+        {
+            # Continued by the range, or overlapping it.
+            "NEXT": datetime.date(2024, 2, 29),
+            "OVERLAP": datetime.date(2024, 3, 10),
+            # A gap before the range, or already past it.
+            "GAP": datetime.date(2024, 2, 27),
+            "AHEAD": datetime.date(2024, 4, 1),
+        }
+    )
+    PolygonBackfill.advance_progress(
+        ["NEXT", "OVERLAP", "GAP", "AHEAD"],
+        datetime.date(2024, 3, 1),
+        datetime.date(2024, 3, 31),
+    )
+    assert progress(fake_redis, "NEXT") == "2024-03-31"
+    assert progress(fake_redis, "OVERLAP") == "2024-03-31"
+    assert progress(fake_redis, "GAP") == "2024-02-27"
+    assert progress(fake_redis, "AHEAD") == "2024-04-01"
+    assert (
+        fake_redis.redis_conn.zscore(AGGREGATION_SCHEDULE, "NEXT")
+        == datetime.datetime(2024, 4, 2, tzinfo=datetime.timezone.utc).timestamp()
+    )
+
+
+def test_advance_progress_of_new_tickers(fake_redis):
+    fake_redis.schedule_new_tickers(["NEW", "LATE"])
+    # New tickers are fetched from STARTING_DATE, 2024-01-01.
+    PolygonBackfill.advance_progress(
+        ["NEW"], datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)
+    )
+    PolygonBackfill.advance_progress(
+        ["LATE"], datetime.date(2024, 1, 2), datetime.date(2024, 1, 31)
+    )
+    assert progress(fake_redis, "NEW") == "2024-01-31"
+    assert progress(fake_redis, "LATE") == ""
+
+
+def test_a_job_is_locked_once(fake_redis):
+    job_id = polygon_backfill.start(
+        start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 1, 2)
+    )
+    polygon_backfill.enqueue(job_id)
+    assert fake_redis.get_list_elements(BACKFILL_QUEUE) == [job_id]
+
+    token = polygon_backfill.lock(job_id)
+    with pytest.raises(ValueError):
+        polygon_backfill.lock(job_id)
+    with pytest.raises(ValueError):
+        polygon_backfill.enqueue(job_id)
+    fake_redis.release_lease(BACKFILL_LOCK.format(job_id=job_id), token)
+    polygon_backfill.lock(job_id)
+
+    with pytest.raises(BackfillJobNotFoundException):
+        polygon_backfill.enqueue("unknown")
+    with pytest.raises(ValueError):
+        polygon_backfill.start(
+            start_date=datetime.date(2024, 1, 2), end_date=datetime.date(2024, 1, 1)
+        )
+
+
+@pytest.fixture
+def windows(monkeypatch, fake_redis):
+    """The windows a job fetches, with the MSFT ones failing."""
+    fetched = []
+
+    async def backfill_window(job_id, window):
+        fetched.append(window_key(window))
+        if window["ticker"] == "MSFT":
+            PolygonBackfill.record_failure(job_id, window, RuntimeError("HTTP 500"))
+            return None
+        PolygonBackfill.record_window(job_id, window, 10)
+        return 10
+
+    monkeypatch.setattr(polygon_backfill, "backfill_window", backfill_window)
+    monkeypatch.setattr(
+        PolygonBackfill, "ensure_partitions", staticmethod(lambda start_date: None)
+    )
+    monkeypatch.setattr(
+        PolygonBackfill,
+        "resolve_tickers",
+        staticmethod(lambda symbols: [(1, "AAPL"), (2, "MSFT")]),
+    )
+    return fetched
+
+
+def run(job_id: str):
+    asyncio.run(polygon_backfill.run(job_id, polygon_backfill.lock(job_id)))
+
+
+def test_run_records_windows_and_progress(fake_redis, windows):
+    fake_redis.schedule_new_tickers(["AAPL", "MSFT"])
+    job_id = polygon_backfill.start(
+        start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 2, 15)
+    )
+    run(job_id)
+
+    job = polygon_backfill.get_job(job_id)
+    assert job["status"] == "failed"
+    assert (job["windows"], job["windows_done"], job["errors"]) == ("4", "2", "2")
+    assert job["bars"] == "20"
+    assert job["last_error"].startswith("MSFT:")
+    assert progress(fake_redis, "AAPL") == "2024-02-15"
+    assert progress(fake_redis, "MSFT") == ""
+    assert fake_redis.get(BACKFILL_LOCK.format(job_id=job_id)) is None
+
+
+def test_resume_skips_the_windows_done(fake_redis, windows):
+    job_id = polygon_backfill.start(
+        start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 2, 15)
+    )
+    run(job_id)
+    windows.clear()
+    run(job_id)
+
+    assert sorted(windows) == ["MSFT:2024-01-01", "MSFT:2024-02-04"]
+    assert set(fake_redis.get_set_members(BACKFILL_DONE.format(job_id=job_id))) == {
+        "AAPL:2024-01-01",
+        "AAPL:2024-02-04",
+    }
+    assert polygon_backfill.get_job(job_id)["windows_done"] == "2"
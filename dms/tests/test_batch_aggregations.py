@@ -0,0 +1,131 @@
+import json
+
+from sqlalchemy.dialects import postgresql
+
+from app.tickers.services import ticker_service
+from app.tickers.ticker_getter import ticker_getter
+
+
+class Result:
+    def __init__(self, partitions):
+        self.chunks = partitions
+
+    def partitions(self):
+        return iter(self.chunks)
+
+
+class RecordingSession:
+    """Returns the given row chunks and keeps the statement it ran."""
+
+    def __init__(self, partitions=()):
+        self.chunks = partitions
+        self.statement = None
+        self.closed = False
+
+    def execute(self, statement):
+        self.statement = statement
+        return Result(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_batch_scan_orders_by_requested_ticker():
+    db = RecordingSession()
+    list(
+        ticker_getter.stream_batch_aggregations(
+            ticker_ids=[7, 3],
+            start_timestamp=0,
+            end_timestamp=100,
+            columns=["timestamp", "close_price"],
+            db=db,
+        )
+    )
+    sql = str(db.statement.compile(dialect=postgresql.dialect()))
+    assert "= ANY (" in sql
+    assert "ORDER BY array_position(" in sql
+    assert sql.rstrip().endswith(".timestamp")
+
+
+def test_batch_scan_groups_bars_across_partitions():
+    db = RecordingSession(
+        [
+            [(7, 10, 1.0), (7, 20, 2.0)],
+            [(7, 30, 3.0), (3, 10, 4.0)],
+            [(3, 20, 5.0)],
+        ]
+    )
+    groups = list(
+        ticker_getter.stream_batch_aggregations(
+            ticker_ids=[7, 3],
+            start_timestamp=0,
+            end_timestamp=100,
+            columns=["timestamp", "close_price"],
+            db=db,
+        )
+    )
+    assert groups == [
+        (7, [(10, 1.0), (20, 2.0), (30, 3.0)]),
+        (3, [(10, 4.0), (20, 5.0)]),
+    ]
+
+
+def test_batch_stream_keeps_order_and_symbols_without_bars(monkeypatch):
+    db = RecordingSession()
+    monkeypatch.setattr(ticker_service.postgres, "sessionLocal", lambda: db)
+
+    def stream_batch_aggregations(ticker_ids, columns, **kwargs):
+        # Only the second and last of the four tickers have bars.
+        assert ticker_ids == [4, 2, 9, 5]
+        row = tuple(range(len(columns)))
+        yield 2, [row]
+        yield 5, [row, row]
+
+    monkeypatch.setattr(
+        ticker_service.ticker_getter,
+        "stream_batch_aggregations",
+        stream_batch_aggregations,
+    )
+    lines = list(
+        ticker_service.stream_batch_aggregations(
+            ticker_ids={"MSFT": 4, "AAPL": 2, "IBM": 9, "TSLA": 5},
+            start_timestamp=0,
+            end_timestamp=100,
+            resolution=600,
+        )
+    )
+    documents = [json.loads(line) for line in lines]
+
+    assert [document["ticker"] for document in documents] == [
+        "MSFT",
+        "AAPL",
+        "IBM",
+        "TSLA",
+    ]
+    assert [len(document["aggregations"]) for document in documents] == [0, 1, 0, 2]
+    assert set(documents[1]["aggregations"][0]) == set(ticker_service.EXPORT_FIELDS)
+    assert all(line.endswith(b"\n") for line in lines)
+    assert db.closed
+
+
+def test_batch_stream_without_any_bars(monkeypatch):
+    monkeypatch.setattr(
+        ticker_service.postgres, "sessionLocal", lambda: RecordingSession()
+    )
+    monkeypatch.setattr(
+        ticker_service.ticker_getter,
+        "stream_batch_aggregations",
+        lambda **kwargs: iter(()),
+    )
+    lines = list(
+        ticker_service.stream_batch_aggregations(
+            ticker_ids={"MSFT": 4, "AAPL": 2},
+            start_timestamp=0,
+            end_timestamp=100,
+            resolution=600,
+        )
+    )
+    assert [json.loads(line) for line in lines] == [
+        {"ticker": "MSFT", "aggregations": []},
+        {"ticker": "AAPL", "aggregations": []},
+    ]
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import redis.asyncio
+
+from app.tickers import broadcaster
+from app.tickers.broadcaster import BarBroadcaster
+
+
+class FlakyPubSub:
+    """Fails the first subscription with a timeout, then delivers messages."""
+
+    attempts = 0
+
+    def __init__(self, messages: list):
+        self.messages = messages
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def subscribe(self, channel: str):
+        FlakyPubSub.attempts += 1
+        if FlakyPubSub.attempts == 1:
+            raise redis.asyncio.TimeoutError("Timeout reading from socket")
+
+    async def listen(self):
+        for message in self.messages:
+            yield {"type": "message", "data": message}
+        await asyncio.Event().wait()
+
+
+class FakeConnection:
+    def __init__(self, messages: list):
+        self.messages = messages
+
+    def pubsub(self) -> FlakyPubSub:
+        return FlakyPubSub(self.messages)
+
+    async def aclose(self):
+        pass
+
+
+def test_dispatch_skips_malformed_messages():
+    bar_broadcaster = BarBroadcaster()
+    bar_broadcaster.subscriptions.add(broadcaster.Subscription(symbols=None, size=4))
+    bar = json.dumps({"ticker": "AAPL"})
+    for message in ["not json", "[]", json.dumps({"symbol": "AAPL"}), bar]:
+        bar_broadcaster.dispatch(message)
+    (subscription,) = bar_broadcaster.subscriptions
+    assert subscription.queue.get_nowait() == bar
+    assert subscription.queue.empty()
+
+
+def test_listen_resubscribes_after_a_timeout(monkeypatch):
+    bar = json.dumps({"ticker": "AAPL"})
+    monkeypatch.setattr(broadcaster, "RECONNECT_DELAY", 0)
+    monkeypatch.setattr(
+        redis.asyncio,
+        "StrictRedis",
+        lambda **kwargs: FakeConnection(["{", bar]),
+    )
+
+    async def receive() -> str:
+        bar_broadcaster = BarBroadcaster()
+        subscription = bar_broadcaster.subscribe()
+        try:
+            return await asyncio.wait_for(subscription.get(), timeout=5)
+        finally:
+            await bar_broadcaster.close()
+
+    assert asyncio.run(receive()) == bar
+    assert FlakyPubSub.attempts == 2
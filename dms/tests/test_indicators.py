@@ -0,0 +1,146 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from app.tickers import indicators
+from app.tickers.aggregation_cache import BAR_DTYPE
+from app.tickers.indicators import IndicatorEngine, parse_indicators
+from app.tickers.rollups import BAR_SECONDS, DAY
+
+TICKER_ID = 1
+START = int(datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc).timestamp())
+# 14:30 to 21:00 UTC, the regular session.
+SESSION = range(14 * 3600 + 1800, 21 * 3600, BAR_SECONDS)
+
+
+def make_bars(timestamps: list[int], seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, len(timestamps)))
+    bars = np.zeros(len(timestamps), dtype=BAR_DTYPE)
+    bars["timestamp"] = timestamps
+    bars["open_price"] = close - rng.normal(0, 0.2, len(timestamps))
+    bars["close_price"] = close
+    bars["highest_price"] = np.maximum(bars["open_price"], close) + 0.1
+    bars["lowest_price"] = np.minimum(bars["open_price"], close) - 0.1
+    bars["volume_weighted_average_price"] = (
+        bars["highest_price"] + bars["lowest_price"]
+    ) / 2
+    bars["trading_volume"] = rng.integers(100, 10000, len(timestamps))
+    bars["number_of_transactions"] = 10
+    return bars
+
+
+def weekdays(count: int) -> list[int]:
+    days = [START + day * DAY for day in range(count * 2)]
+    return [day for day in days if datetime.date.fromtimestamp(day).weekday() < 5][
+        :count
+    ]
+
+
+SERIES = {
+    BAR_SECONDS: make_bars(
+        [day + second for day in weekdays(30) for second in SESSION]
+    ),
+    DAY: make_bars(weekdays(400)),
+}
+SPECS = {
+    BAR_SECONDS: parse_indicators("sma:20,ema:20,rsi:14,bollinger:20:2,vwap:1"),
+    DAY: parse_indicators("sma:20,ema:20,rsi:14,bollinger:20:2"),
+}
+
+
+class CoverageSession:
+    """Answers the first bar timestamp the warm-up looks up."""
+
+    def scalar(self, statement):
+        return int(SERIES[BAR_SECONDS]["timestamp"][0])
+
+
+@pytest.fixture
+def series(monkeypatch, memory_redis):
+    series = {resolution: bars.copy() for resolution, bars in SERIES.items()}
+
+    def load_bars(ticker_id, start_timestamp, end_timestamp, resolution, db):
+        bars = series[resolution]
+        return bars[
+            (bars["timestamp"] >= start_timestamp)
+            & (bars["timestamp"] <= end_timestamp)
+        ]
+
+    monkeypatch.setattr(indicators, "redis_client", memory_redis)
+    monkeypatch.setattr(IndicatorEngine, "load_bars", staticmethod(load_bars))
+    return series
+
+
+def get_range(resolution: int, start_timestamp: int, end_timestamp: int) -> np.ndarray:
+    return IndicatorEngine().get_range(
+        ticker_id=TICKER_ID,
+        start_timestamp=start_timestamp,
+        end_timestamp=end_timestamp,
+        specs=SPECS[resolution],
+        db=CoverageSession(),
+        resolution=resolution,
+    )
+
+
+def assert_values_equal(actual: np.ndarray, expected: np.ndarray):
+    np.testing.assert_array_equal(actual["timestamp"], expected["timestamp"])
+    for name in expected.dtype.names[1:]:
+        # EMA and RSI restart from a seed before each chunk, which weighs less
+        # than e^-10 after their warm-up.
+        np.testing.assert_allclose(
+            actual[name], expected[name], rtol=1e-6, atol=1e-3, err_msg=name
+        )
+
+
+@pytest.mark.parametrize("resolution", [BAR_SECONDS, DAY])
+def test_range_from_cached_chunks_matches_one_call(
+    monkeypatch, memory_redis, series, resolution
+):
+    timestamps = series[resolution]["timestamp"]
+    # Start well into the series so that every chunk has a full warm-up.
+    start_timestamp = int(timestamps[len(timestamps) // 2])
+    end_timestamp = int(timestamps[-1])
+    one_call = get_range(resolution, start_timestamp, end_timestamp)
+    assert len(one_call) == np.count_nonzero(timestamps >= start_timestamp)
+
+    memory_redis.values.clear()
+    size = IndicatorEngine.chunk_seconds(resolution)
+    for chunk_start in range(start_timestamp, end_timestamp + 1, size // 3):
+        get_range(resolution, chunk_start, chunk_start + size // 3 - 1)
+
+    def no_database(*args, **kwargs):
+        raise AssertionError("the range should be read from the cache")
+
+    monkeypatch.setattr(IndicatorEngine, "load_bars", staticmethod(no_database))
+    assert_values_equal(get_range(resolution, start_timestamp, end_timestamp), one_call)
+
+
+def test_invalidate_orphans_cached_chunks(series):
+    bars = series[BAR_SECONDS]
+    start_timestamp = int(bars["timestamp"][len(bars) // 2])
+    end_timestamp = int(bars["timestamp"][-1])
+    cached = get_range(BAR_SECONDS, start_timestamp, end_timestamp)
+
+    for name in ["open_price", "close_price", "highest_price", "lowest_price"]:
+        bars[name] *= 2
+    assert_values_equal(get_range(BAR_SECONDS, start_timestamp, end_timestamp), cached)
+
+    IndicatorEngine().invalidate(ticker_id=TICKER_ID)
+    refreshed = get_range(BAR_SECONDS, start_timestamp, end_timestamp)
+    np.testing.assert_allclose(
+        refreshed["sma_20"], cached["sma_20"] * 2, rtol=1e-9, equal_nan=True
+    )
+
+
+def test_parse_indicators_defaults_and_errors():
+    assert [spec.label for spec in parse_indicators("sma,ema:50,bollinger:10")] == [
+        "sma_20",
+        "ema_50",
+        "bollinger_10_2",
+    ]
+    assert len(parse_indicators("rsi,rsi:14")) == 1
+    for invalid in ["", "macd", "sma:0", "sma:2.5", "sma:x", "rsi:14:2"]:
+        with pytest.raises(ValueError):
+            parse_indicators(invalid)
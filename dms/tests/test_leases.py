@@ -0,0 +1,55 @@
+import time
+
+from app.ingestion import LeaderLease
+
+
+def test_lease_is_renewed_and_released_only_by_its_token(fake_redis):
+    assert fake_redis.acquire_lease("lease", "first", 10_000)
+    assert not fake_redis.acquire_lease("lease", "second", 10_000)
+
+    assert not fake_redis.renew_lease("lease", "second", 60_000)
+    assert not fake_redis.release_lease("lease", "second")
+    assert fake_redis.get("lease") == "first"
+
+    assert fake_redis.renew_lease("lease", "first", 60_000)
+    assert fake_redis.redis_conn.pttl("lease") > 10_000
+    assert fake_redis.release_lease("lease", "first")
+    assert fake_redis.get("lease") is None
+
+
+def test_expired_lease_cannot_touch_its_successor(fake_redis):
+    assert fake_redis.acquire_lease("lease", "first", 50)
+    time.sleep(0.1)
+    assert fake_redis.acquire_lease("lease", "second", 10_000)
+
+    assert not fake_redis.renew_lease("lease", "first", 10_000)
+    assert not fake_redis.release_lease("lease", "first")
+    assert fake_redis.get("lease") == "second"
+
+
+def test_one_leader_at_a_time(fake_redis):
+    first = LeaderLease(key="leader", ttl=10)
+    second = LeaderLease(key="leader", ttl=10)
+    assert first.token != second.token
+
+    assert first.refresh()
+    assert not second.refresh()
+    assert first.refresh()
+
+    first.release()
+    assert not first.is_leader
+    assert second.refresh()
+
+
+def test_leader_notices_a_lost_lease(fake_redis):
+    first = LeaderLease(key="leader", ttl=0.05)
+    second = LeaderLease(key="leader", ttl=10)
+    assert first.refresh()
+    time.sleep(0.1)
+    assert second.refresh()
+
+    assert not first.refresh()
+    assert not first.is_leader
+    # Releasing after the loss leaves the new leader alone.
+    first.release()
+    assert fake_redis.get("leader") == second.token
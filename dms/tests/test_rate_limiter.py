@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+from app.rate_limiter import TokenBucket
+
+
+def test_buckets_with_the_same_key_share_the_budget(fake_redis):
+    # Two processes, each with its own TokenBucket over one key.
+    first = TokenBucket(key="rate", rate=20, capacity=2)
+    second = TokenBucket(key="rate", rate=20, capacity=2)
+
+    async def acquire_many():
+        for bucket in [first, second, first, second]:
+            await bucket.acquire()
+
+    started_at = time.monotonic()
+    asyncio.run(acquire_many())
+    # Two tokens from the burst, then one every 50ms.
+    assert time.monotonic() - started_at >= 0.09
+    assert 0 < fake_redis.take_token("rate", 20, 2) <= 0.05
+
+
+def test_pause_holds_every_bucket_of_the_key(fake_redis):
+    bucket = TokenBucket(key="rate", rate=1000, capacity=5)
+    asyncio.run(bucket.pause(0.2))
+    assert 0.1 < fake_redis.take_token("rate", 1000, 5) <= 0.2
+    assert fake_redis.take_token("other", 1000, 5) == 0
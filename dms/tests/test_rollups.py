@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+
+from app.tickers.rollups import DAY, HOUR, WEEK, bucket_start, parse_resolution
+
+
+def timestamp(*args) -> int:
+    return int(datetime.datetime(*args, tzinfo=datetime.timezone.utc).timestamp())
+
+
+@pytest.mark.parametrize(
+    "resolution, seconds",
+    [("10m", 600), ("30m", 1800), ("4h", 4 * HOUR), ("1d", DAY), ("2w", 2 * WEEK)],
+)
+def test_parse_resolution(resolution, seconds):
+    assert parse_resolution(resolution) == seconds
+
+
+@pytest.mark.parametrize("resolution", ["", "0h", "5m", "15m", "1y", "1.5h", "h", "1H"])
+def test_parse_resolution_rejects_invalid(resolution):
+    with pytest.raises(ValueError):
+        parse_resolution(resolution)
+
+
+def test_bucket_start():
+    # Wednesday 2024-01-03 15:47:12 UTC.
+    moment = timestamp(2024, 1, 3, 15, 47, 12)
+    assert bucket_start(moment, 600) == timestamp(2024, 1, 3, 15, 40)
+    assert bucket_start(moment, HOUR) == timestamp(2024, 1, 3, 15)
+    assert bucket_start(moment, 4 * HOUR) == timestamp(2024, 1, 3, 12)
+    assert bucket_start(moment, DAY) == timestamp(2024, 1, 3)
+    assert bucket_start(moment, WEEK) == timestamp(2024, 1, 1)
+    assert bucket_start(timestamp(2024, 1, 1), WEEK) == timestamp(2024, 1, 1)
+    assert bucket_start(timestamp(2023, 12, 31, 23, 59), WEEK) == timestamp(
+        2023, 12, 25
+    )
@@ -0,0 +1,81 @@
+import datetime
+import json
+
+from app.redis import AGGREGATION_PROGRESS, AGGREGATION_SCHEDULE, next_due_timestamp
+
+TODAY = datetime.datetime.now(datetime.timezone.utc).date()
+DAY = datetime.timedelta(days=1)
+
+
+def test_next_due_timestamp():
+    assert (
+        next_due_timestamp(datetime.date(2024, 1, 1))
+        == datetime.datetime(2024, 1, 3, tzinfo=datetime.timezone.utc).timestamp()
+    )
+
+
+def test_only_due_tickers_are_claimed_once(fake_redis):
+    fake_redis.set_tickers_progress(
+        {"AAPL": TODAY - 5 * DAY, "MSFT": None, "TSLA": TODAY}
+    )
+
+    claimed = dict(fake_redis.claim_due_tickers(limit=10))
+    assert claimed == {"AAPL": TODAY - 5 * DAY, "MSFT": None}
+    # Claimed tickers are pushed out by the lease.
+    assert fake_redis.claim_due_tickers(limit=10) == []
+
+
+def test_claim_is_limited(fake_redis):
+    fake_redis.set_tickers_progress({"AAPL": None, "MSFT": None, "TSLA": None})
+    assert len(fake_redis.claim_due_tickers(limit=2)) == 2
+    assert len(fake_redis.claim_due_tickers(limit=2)) == 1
+    assert fake_redis.claim_due_tickers(limit=0) == []
+
+
+def test_claim_expires_without_progress(fake_redis):
+    fake_redis.set_tickers_progress({"AAPL": None})
+    assert fake_redis.claim_due_tickers(limit=10, lease_seconds=-1) == [("AAPL", None)]
+    assert fake_redis.claim_due_tickers(limit=10) == [("AAPL", None)]
+
+
+def test_recorded_progress_schedules_the_next_fetch(fake_redis):
+    fake_redis.set_tickers_progress({"AAPL": None})
+    fake_redis.claim_due_tickers(limit=10)
+    fake_redis.set_ticker_progress("AAPL", TODAY - 3 * DAY)
+
+    assert fake_redis.redis_conn.zscore(
+        AGGREGATION_SCHEDULE, "AAPL"
+    ) == next_due_timestamp(TODAY - 3 * DAY)
+    assert fake_redis.claim_due_tickers(limit=10) == [("AAPL", TODAY - 3 * DAY)]
+
+
+def test_new_tickers_are_scheduled_once(fake_redis):
+    fake_redis.set_tickers_progress({"AAPL": TODAY - 5 * DAY})
+
+    assert fake_redis.schedule_new_tickers(["AAPL", "MSFT", "TSLA"]) == [
+        "MSFT",
+        "TSLA",
+    ]
+    assert fake_redis.schedule_new_tickers(["MSFT"]) == []
+    # Scheduled as already claimed, the existing progress is kept.
+    assert dict(fake_redis.claim_due_tickers(limit=10)) == {"AAPL": TODAY - 5 * DAY}
+    assert fake_redis.redis_conn.hget(AGGREGATION_PROGRESS, "MSFT") == ""
+
+
+def test_unschedule_ticker(fake_redis):
+    fake_redis.set_tickers_progress({"AAPL": None})
+    fake_redis.unschedule_ticker("AAPL")
+    assert not fake_redis.has_schedule()
+    assert fake_redis.claim_due_tickers(limit=10) == []
+
+
+def test_migrate_computed_aggregations(fake_redis):
+    fake_redis.set("computed_aggregations", json.dumps({"AAPL": "2024-01-01"}))
+    fake_redis.migrate_computed_aggregations()
+
+    assert fake_redis.get("computed_aggregations") is None
+    assert dict(fake_redis.claim_due_tickers(limit=10)) == {
+        "AAPL": datetime.date(2024, 1, 1)
+    }
+    fake_redis.migrate_computed_aggregations()
+    assert fake_redis.has_schedule()
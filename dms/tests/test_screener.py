@@ -0,0 +1,27 @@
+import numpy as np
+
+from app.tickers.screener import DAILY_DTYPE, Screener
+
+
+def test_statistics():
+    days = np.array(
+        [
+            # ticker_id, timestamp, open, close, volume, vwap
+            (1, 0, 10.0, 11.0, 100.0, 10.5),
+            (1, 86400, 11.0, 12.0, 300.0, 11.5),
+            (2, 0, 50.0, 40.0, 0.0, 45.0),
+            (3, 86400, 20.0, 20.0, 10.0, 25.0),
+        ],
+        dtype=DAILY_DTYPE,
+    )
+    statistics = Screener.statistics(days)
+
+    np.testing.assert_array_equal(statistics["ticker_id"], [1, 2, 3])
+    np.testing.assert_array_equal(statistics["open_price"], [10.0, 50.0, 20.0])
+    np.testing.assert_array_equal(statistics["close_price"], [12.0, 40.0, 20.0])
+    np.testing.assert_array_equal(statistics["volume"], [400.0, 0.0, 10.0])
+    np.testing.assert_allclose(statistics["vwap"], [11.25, np.nan, 25.0])
+    np.testing.assert_allclose(statistics["change"], [20.0, -20.0, 0.0])
+    np.testing.assert_allclose(
+        statistics["vwap_deviation"], [(12 - 11.25) / 11.25 * 100, np.nan, -20.0]
+    )
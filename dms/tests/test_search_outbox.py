@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import elasticsearch
+from app.elasticsearch import REINDEX_TARGET, REINDEX_TOMBSTONES, es_client
+from app.tickers.ticker_setter import TickerSetter
+
+
+class Session:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def commit(self):
+        pass
+
+
+class Outbox:
+    """The outbox table and the tickers table, kept in lists and dicts."""
+
+    def __init__(self, tickers: dict, document_ids: list):
+        self.tickers = tickers
+        self.events = [
+            SimpleNamespace(id=i, index="tickers", document_id=document_id)
+            for i, document_id in enumerate(document_ids, start=1)
+        ]
+        self.retried = {}
+        self.claims = 0
+
+    def claim(self, batch_size, db):
+        self.claims += 1
+        return [event for event in self.events if event.id not in self.retried][
+            :batch_size
+        ]
+
+    def complete(self, event_ids, db):
+        self.events = [event for event in self.events if event.id not in event_ids]
+
+    def retry(self, events, errors, db):
+        for event in events:
+            self.retried[event.id] = errors[event.document_id]
+
+
+class Bulk:
+    """Records the bulk actions and fails the documents in `failing`."""
+
+    def __init__(self, failing=(), missing=()):
+        self.failing = set(failing)
+        self.missing = set(missing)
+        self.actions = []
+
+    def __call__(self, es, actions, raise_on_error):
+        self.actions += actions
+        errors = []
+        for action in actions:
+            op_type = action.get("_op_type", "index")
+            if action["_id"] in self.failing:
+                errors.append({op_type: {"_id": action["_id"], "status": 400}})
+            elif op_type == "delete" and action["_id"] in self.missing:
+                errors.append({op_type: {"_id": action["_id"], "status": 404}})
+        return len(actions) - len(errors), errors
+
+
+@pytest.fixture
+def outbox(monkeypatch, fake_redis):
+    outbox = Outbox(tickers={1: "AAPL", 3: "MSFT"}, document_ids=[1, 2, 1, 3])
+    monkeypatch.setattr(elasticsearch.postgres, "sessionLocal", Session)
+    monkeypatch.setattr(TickerSetter, "claim_search_events", outbox.claim)
+    monkeypatch.setattr(TickerSetter, "complete_search_events", outbox.complete)
+    monkeypatch.setattr(TickerSetter, "retry_search_events", outbox.retry)
+    monkeypatch.setattr(
+        elasticsearch.ticker_getter,
+        "get_ticker_documents",
+        lambda ticker_ids, db: [
+            {"id": ticker_id, "ticker": outbox.tickers[ticker_id]}
+            for ticker_id in ticker_ids
+            if ticker_id in outbox.tickers
+        ],
+    )
+    return outbox
+
+
+def test_drain_indexes_each_document_once(outbox, monkeypatch):
+    bulk = Bulk(missing=[2])
+    monkeypatch.setattr(elasticsearch, "bulk", bulk)
+
+    assert es_client.drain_search_outbox(batch_size=10) == 4
+    assert outbox.events == []
+    # Events for one document collapse, the deleted row becomes a delete.
+    assert sorted(
+        (action.get("_op_type", "index"), action["_id"]) for action in bulk.actions
+    ) == [("delete", 2), ("index", 1), ("index", 3)]
+
+
+def test_drain_works_in_batches(outbox, monkeypatch):
+    monkeypatch.setattr(elasticsearch, "bulk", Bulk())
+
+    assert es_client.drain_search_outbox(batch_size=3) == 4
+    assert outbox.claims == 2
+
+
+def test_failed_documents_are_retried(outbox, monkeypatch):
+    monkeypatch.setattr(elasticsearch, "bulk", Bulk(failing=[1]))
+
+    assert es_client.drain_search_outbox(batch_size=10) == 2
+    assert [event.document_id for event in outbox.events] == [1, 1]
+    assert set(outbox.retried) == {1, 3}
+    assert outbox.claims == 1
+
+
+def test_drain_writes_to_the_index_being_rebuilt(outbox, monkeypatch, fake_redis):
+    bulk = Bulk()
+    monkeypatch.setattr(elasticsearch, "bulk", bulk)
+    fake_redis.redis_conn.set(REINDEX_TARGET.format(index="tickers"), "tickers_v2")
+
+    es_client.drain_search_outbox(batch_size=10)
+    assert {action["_index"] for action in bulk.actions} == {"tickers", "tickers_v2"}
+    assert fake_redis.get_set_members(REINDEX_TOMBSTONES.format(index="tickers")) == [
+        "2"
+    ]
@@ -0,0 +1,106 @@
+import pytest
+
+from app.exceptions.exceptions import TickerNotFoundException
+from app.settings.redis_settings import redis_settings
+from app.tickers.ticker_index import TickerIndex
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class Tickers:
+    """Answers the ticker queries of the index from a dict, counting them."""
+
+    def __init__(self, ids: dict):
+        self.ids = ids
+        self.queries = 0
+
+    def scalar(self, statement):
+        self.queries += 1
+        [symbol] = statement.compile().params.values()
+        return self.ids.get(symbol)
+
+    def execute(self, statement):
+        self.queries += 1
+        params = statement.compile().params
+        if "symbols" in params:
+            return Result(
+                [
+                    (symbol, self.ids[symbol])
+                    for symbol in params["symbols"]
+                    if symbol in self.ids
+                ]
+            )
+        return Result(
+            [
+                (ticker_id, symbol)
+                for symbol, ticker_id in self.ids.items()
+                if ticker_id in params["ids"]
+            ]
+        )
+
+
+@pytest.fixture
+def db(fake_redis):
+    return Tickers({"AAPL": 1, "MSFT": 2, "TSLA": 3})
+
+
+def test_held_symbols_need_no_query(db):
+    index = TickerIndex()
+    assert index.get_ticker_id("AAPL", db) == 1
+    queries = db.queries
+    for _ in range(10):
+        assert index.get_ticker_id("AAPL", db) == 1
+    assert db.queries == queries
+    assert index.peek_ticker_id("AAPL") == 1
+
+    with pytest.raises(TickerNotFoundException):
+        index.get_ticker_id("ZZZ", db)
+
+
+def test_batch_lookups_query_the_missing_symbols_together(db):
+    index = TickerIndex()
+    index.get_ticker_id("MSFT", db)
+    queries = db.queries
+
+    ids = index.get_ticker_ids(["TSLA", "ZZZ", "MSFT", "AAPL"], db)
+    assert list(ids.items()) == [("TSLA", 3), ("MSFT", 2), ("AAPL", 1)]
+    assert db.queries == queries + 1
+    assert index.get_ticker_symbols([3, 1], db) == {3: "TSLA", 1: "AAPL"}
+    assert db.queries == queries + 1
+
+
+def test_least_recently_used_symbol_is_evicted(db, monkeypatch):
+    monkeypatch.setattr(redis_settings, "TICKER_INDEX_SIZE", 2)
+    index = TickerIndex()
+    index.get_ticker_id("AAPL", db)
+    index.get_ticker_id("MSFT", db)
+    index.get_ticker_symbols([1], db)
+    index.get_ticker_id("TSLA", db)
+
+    assert list(index.ids) == ["AAPL", "TSLA"]
+    assert set(index.symbols) == {1, 3}
+
+
+def test_writes_in_another_process_are_picked_up(db, monkeypatch):
+    monkeypatch.setattr(redis_settings, "TICKER_INDEX_CHECK_INTERVAL", 60)
+    reader = TickerIndex()
+    writer = TickerIndex()
+    reader.get_ticker_id("AAPL", db)
+
+    db.ids = {"APPL": 1, "MSFT": 2, "TSLA": 3}
+    writer.invalidate()
+    # Until the next check the reader keeps its map.
+    assert reader.get_ticker_id("AAPL", db) == 1
+
+    reader.checked_at = 0.0
+    assert reader.peek_ticker_id("AAPL") is None
+    assert reader.get_ticker_id("APPL", db) == 1
+    assert "AAPL" not in reader.ids
+    with pytest.raises(TickerNotFoundException):
+        reader.get_ticker_id("AAPL", db)